@@ -31,9 +31,6 @@ from qgis.core import (
 
 
 from safe.test.utilities import get_qgis_app
-# make sure this line executes first
-QGIS_APP, CANVAS, IFACE, PARENT = get_qgis_app()
-
 from safe.utilities.gis import qgis_version, validate_geo_array
 from safe.utilities.osm_downloader import download
 from safe.impact_function.impact_function import ImpactFunction
@@ -231,13 +228,15 @@ def impact_function_setup(
 
     :raises: Exception
     """
+    _, canvas, _, _ = get_qgis_app()
+
     # IF
     impact_function = ImpactFunction()
 
     impact_function.hazard = hazard
     impact_function.exposure = exposure
     impact_function.aggregation = aggregation
-    impact_function.map_canvas = CANVAS
+    impact_function.map_canvas = canvas
     # QSetting context
     settings = QSettings()
     crs = settings.value('inasafe/user_extent_crs', '', type=str)
@@ -294,6 +293,7 @@ def build_report(cli_arguments):
     """
     try:
         LOGGER.info('Building a report')
+        _, canvas, _, _ = get_qgis_app()
         impact_layer = get_layer(cli_arguments.output_file, 'Impact Layer')
         hazard_layer = get_layer(cli_arguments.hazard, 'Hazard Layer')
         layer_registry = QgsMapLayerRegistry.instance()
@@ -301,8 +301,8 @@ def build_report(cli_arguments):
         extra_layers = [hazard_layer]
         layer_registry.addMapLayer(impact_layer)
         layer_registry.addMapLayers(extra_layers)
-        CANVAS.setExtent(impact_layer.extent())
-        CANVAS.refresh()
+        canvas.setExtent(impact_layer.extent())
+        canvas.refresh()
         # FIXME : To make it work with InaSAFE V4.
         # report = ImpactReport(
         #     IFACE, cli_arguments.report_template, impact_layer,
@@ -365,7 +365,15 @@ def write_results(cli_arguments, impact_layer):
         raise RuntimeError(exception.message)
 
 
-if __name__ == '__main__':
+def main():
+    """Run the command line interface.
+
+    QGIS is started here and not when this module is imported, so a process
+    importing it (like the headless worker) starts QGIS when it needs it.
+    """
+    # make sure this line executes first
+    get_qgis_app()
+
     print "inasafe"
     print ""
     try:
@@ -409,8 +417,11 @@ if __name__ == '__main__':
         print excp.message
         print excp.__doc__
 
+    print " "
 
-print " "
+
+if __name__ == '__main__':
+    main()
 
 # INSTALL on Ubuntu with:
 # chmod ug+x inasafe
@@ -1,5 +1,6 @@
 # coding=utf-8
 from celery import Celery
+from celery.signals import worker_process_init
 
 __author__ = 'Rizky Maulana Nugraha <lana.pcfre@gmail.com>'
 __date__ = '1/28/16'
@@ -12,10 +13,44 @@ packages = (
     'headless',
 )
 
+QGIS_APP, CANVAS, IFACE, PARENT = None, None, None, None
 
-# initialize qgis_app
-from safe.test.utilities import get_qgis_app
-QGIS_APP, CANVAS, IFACE, PARENT = get_qgis_app()
+
+def warm_up():
+    """Load QGIS and InaSAFE once for all tasks of this process.
+
+    It starts the QGIS application, builds the definitions index and loads
+    the minimum needs profile, so tasks don't pay for it.
+    """
+    global QGIS_APP, CANVAS, IFACE, PARENT
+
+    # initialize qgis_app
+    from safe.test.utilities import get_qgis_app
+    QGIS_APP, CANVAS, IFACE, PARENT = get_qgis_app()
+
+    from safe.definitions.utilities import definition
+    from safe.definitions.hazard import hazard_earthquake
+    from safe.gui.tools.minimum_needs.needs_profile import NeedsProfile
+    definition(hazard_earthquake['key'])
+    NeedsProfile().load()
+
+
+# With warm workers, each worker process starts its own QGIS application
+# after the fork, so several analyses can run at the same time. Otherwise,
+# QGIS is started once at import like before.
+if not app.conf.get('INASAFE_HEADLESS_WARM_WORKERS', False):
+    warm_up()
+
+
+@worker_process_init.connect
+def warm_up_worker_process(**kwargs):
+    """Warm up a new worker process of the pool.
+
+    The pool recycles processes according to CELERYD_MAX_TASKS_PER_CHILD
+    and CELERYD_MAX_MEMORY_PER_CHILD, each new one is warmed up here.
+    """
+    if app.conf.get('INASAFE_HEADLESS_WARM_WORKERS', False):
+        warm_up()
 
 
 app.autodiscover_tasks(packages)
@@ -26,18 +26,42 @@ CELERY_ROUTES = {
 
 # Long bug description ahead! Beware.
 
-# This set InaSAFE Headless concurrency to 1. Which means this celery worker
-# will only uses 1 thread. This is necessary because we are using Xvfb to
-# handle graphical report generation (used by processing framework).
 # Somehow, qgis processing framework is not thread safe. It forgot to call
-# XInitThreads() which is necessary for multithreading. Read long description
-# here about XInitThreads(): http://www.remlab.net/op/xlib.shtml
-# In other words, you should always set this to 1. If not, it will default to
-# number of CPUs/core which can be multithreaded and will invoke debugging
-# **NIGHTMARE** to your celery worker. Read about this particular settings
-# here:
+# XInitThreads() which is necessary for multithreading, and we are using Xvfb
+# to handle graphical report generation (used by processing framework). Read
+# long description here about XInitThreads():
+# http://www.remlab.net/op/xlib.shtml
+# So never use a thread based pool (-P threads, eventlet or gevent), it will
+# invoke debugging **NIGHTMARE** to your celery worker.
+
+# The default prefork pool is fine: each child is a separate process. With
+# INASAFE_HEADLESS_WARM_WORKERS, each child starts its own QGIS application
+# after the fork and keeps it, with InaSAFE definitions and the minimum needs
+# profile, for all its tasks. The concurrency is the number of analyses this
+# worker can run at the same time. Each child holds a whole QGIS runtime, so
+# set it according to the memory of the host. Read about this particular
+# settings here:
 # http://docs.celeryproject.org/en/latest/configuration.html#celeryd-concurrency
-CELERYD_CONCURRENCY = 1
+CELERYD_CONCURRENCY = int(
+    os.environ.get('INASAFE_HEADLESS_CONCURRENCY', '1'))
+
+# Without warm workers, QGIS is started before the fork and can only be used
+# by a single child.
+INASAFE_HEADLESS_WARM_WORKERS = os.environ.get(
+    'INASAFE_HEADLESS_WARM_WORKERS', str(CELERYD_CONCURRENCY > 1)) == 'True'
+
+# Replace a child after this number of tasks. 0 means never.
+CELERYD_MAX_TASKS_PER_CHILD = int(
+    os.environ.get('INASAFE_HEADLESS_MAX_TASKS_PER_CHILD', '0')) or None
+
+# Replace a child after a task if its resident memory is above this size in
+# kilobytes (Celery 4 or later). 0 means no limit.
+CELERYD_MAX_MEMORY_PER_CHILD = int(
+    os.environ.get('INASAFE_HEADLESS_MAX_MEMORY_PER_CHILD', '0')) or None
+
+# An analysis is a long task, a child should not reserve other tasks while
+# another child is idle.
+CELERYD_PREFETCH_MULTIPLIER = 1
 
 CELERY_ALWAYS_EAGER = os.environ.get('CELERY_ALWAYS_EAGER', 'False') == 'True'
 
@@ -10,8 +10,6 @@ from headless.celery_app import app
 from headless.celeryconfig import DEPLOY_OUTPUT_DIR, DEPLOY_OUTPUT_URL
 from headless.tasks.utilities import download_layer, archive_layer, \
     generate_styles, download_file
-from bin.inasafe import CommandLineArguments, get_impact_function_list, \
-    run_impact_function, build_report, get_layer
 from safe.utilities.keyword_io import KeywordIO
 
 __author__ = 'Rizky Maulana Nugraha <lana.pcfre@gmail.com>'
@@ -34,6 +32,10 @@ def filter_impact_function(hazard=None, exposure=None):
     :rtype: list(dict)
 
     """
+    # QGIS is started by the worker process, the CLI module is imported
+    # only when a task runs.
+    from bin.inasafe import CommandLineArguments, get_impact_function_list
+
     # download the file first
     arguments = CommandLineArguments()
     if hazard and exposure:
@@ -58,6 +60,9 @@ def filter_impact_function(hazard=None, exposure=None):
 def run_analysis(hazard, exposure, function, aggregation=None,
                  generate_report=False):
     """Run analysis"""
+    from bin.inasafe import CommandLineArguments, run_impact_function, \
+        build_report, get_layer
+
     hazard_file = download_layer(hazard)
     exposure_file = download_layer(exposure)
     aggregation_file = None
@@ -0,0 +1,53 @@
+# coding=utf-8
+import os
+import subprocess
+import sys
+import unittest
+
+__author__ = 'Rizky Maulana Nugraha <lana.pcfre@gmail.com>'
+__date__ = '10/18/16'
+
+
+# Import the worker like celery does, then fork like the prefork pool.
+# Exit codes: 1 QGIS started before the fork, 2 not started in the child,
+# 3 started in the parent by the child.
+WARM_WORKER_SCRIPT = """
+import os
+import sys
+
+from safe.test import utilities
+from headless import celery_app
+import headless.tasks.inasafe_wrapper
+import bin.inasafe
+
+if utilities.QGIS_APP is not None:
+    sys.exit(1)
+
+pid = os.fork()
+if pid == 0:
+    celery_app.warm_up_worker_process()
+    started = (
+        utilities.QGIS_APP is not None and celery_app.QGIS_APP is not None)
+    os._exit(0 if started else 2)
+
+_, status = os.waitpid(pid, 0)
+if os.WEXITSTATUS(status):
+    sys.exit(os.WEXITSTATUS(status))
+sys.exit(3 if utilities.QGIS_APP is not None else 0)
+"""
+
+
+class TestCeleryApp(unittest.TestCase):
+
+    @unittest.skipIf(not hasattr(os, 'fork'), 'The pool needs fork.')
+    def test_warm_workers(self):
+        """Test warm workers start QGIS after the fork, in each child."""
+        environment = dict(os.environ)
+        environment['INASAFE_HEADLESS_WARM_WORKERS'] = 'True'
+        status = subprocess.call(
+            [sys.executable, '-c', WARM_WORKER_SCRIPT], env=environment)
+        self.assertEqual(0, status)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+# coding=utf-8
+import os
+import shutil
+import tempfile
+import unittest
+import zlib
+from zipfile import ZipFile, ZIP_STORED, ZIP_DEFLATED
+
+from headless.tasks import utilities
+from headless.tasks.utilities import download_layer, download_file, \
+    evict_cache, archive_layer, zip_stream, file_checksum, check_zip32
+
+
+class TestDownloadCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_dir = utilities.CACHE_DIR
+        self.cache_size = utilities.CACHE_SIZE
+        self.cache_lease = utilities.CACHE_LEASE
+        utilities.CACHE_DIR = os.path.join(self.temp_dir, 'cache')
+
+        self.archive = os.path.join(self.temp_dir, 'layer.zip')
+        with ZipFile(self.archive, 'w') as zipf:
+            zipf.writestr('layer.shp', 'shp')
+            zipf.writestr('layer.dbf', 'dbf')
+
+    def tearDown(self):
+        utilities.CACHE_DIR = self.cache_dir
+        utilities.CACHE_SIZE = self.cache_size
+        utilities.CACHE_LEASE = self.cache_lease
+        shutil.rmtree(self.temp_dir)
+
+    def test_download_layer_cache(self):
+        """Test layers are extracted once and shared."""
+        layer_path = download_layer(self.archive)
+        self.assertTrue(os.path.exists(layer_path))
+        self.assertTrue(layer_path.startswith(utilities.CACHE_DIR))
+        self.assertEqual(layer_path, download_layer(self.archive))
+
+        # The caller gets its own copy of a file.
+        file_path = download_file(self.archive)
+        self.assertFalse(file_path.startswith(utilities.CACHE_DIR))
+        self.assertEqual(
+            os.path.getsize(self.archive), os.path.getsize(file_path))
+        os.remove(file_path)
+
+        # A new version of the file is a new entry.
+        with ZipFile(self.archive, 'a') as zipf:
+            zipf.writestr('layer.prj', 'prj')
+        self.assertNotEqual(layer_path, download_layer(self.archive))
+
+        # Entries used recently might be read by another task.
+        utilities.CACHE_SIZE = 0
+        evict_cache()
+        self.assertTrue(os.path.exists(layer_path))
+
+        # Least recently used entries are removed above the size.
+        utilities.CACHE_LEASE = 0
+        evict_cache()
+        self.assertFalse(os.path.exists(layer_path))
+
+
+class TestArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.files = {
+            'impact.shp': 'shp' * 1000,
+            'impact.dbf': 'dbf' * 1000,
+            'impact.png': 'png',
+            'other.shp': 'other',
+        }
+        for name, content in self.files.items():
+            with open(os.path.join(self.temp_dir, name), 'wb') as f:
+                f.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_archive_layer(self):
+        """Test the archive of a layer with its compression levels."""
+        for compress_level in [0, 6]:
+            zip_path = archive_layer(
+                os.path.join(self.temp_dir, 'impact.shp'), compress_level)
+            with ZipFile(zip_path) as zipf:
+                self.assertIsNone(zipf.testzip())
+                self.assertEqual(
+                    sorted(zipf.namelist()),
+                    ['impact.dbf', 'impact.png', 'impact.shp'])
+                for name in zipf.namelist():
+                    self.assertEqual(self.files[name], zipf.read(name))
+
+                # The png is already compressed, it's always stored.
+                self.assertEqual(
+                    ZIP_STORED, zipf.getinfo('impact.png').compress_type)
+                expected = ZIP_DEFLATED if compress_level else ZIP_STORED
+                self.assertEqual(
+                    expected, zipf.getinfo('impact.shp').compress_type)
+
+    def test_zip_stream(self):
+        """Test we can name files in the streamed archive."""
+        path = os.path.join(self.temp_dir, 'impact.shp')
+        zip_path = os.path.join(self.temp_dir, 'stream.zip')
+        with open(zip_path, 'wb') as f:
+            for chunk in zip_stream([(path, 'folder/renamed.shp')]):
+                f.write(chunk)
+        with ZipFile(zip_path) as zipf:
+            self.assertEqual(
+                self.files['impact.shp'], zipf.read('folder/renamed.shp'))
+
+    def test_zip32(self):
+        """Test the checksum of stored files and the limits of zip."""
+        path = os.path.join(self.temp_dir, 'impact.png')
+        content = self.files['impact.png']
+        self.assertEqual(
+            (zlib.crc32(content) & 0xffffffff, len(content)),
+            file_checksum(path))
+
+        check_zip32(0xffffffff, 0)
+        self.assertRaises(ValueError, check_zip32, 0, 0xffffffff + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
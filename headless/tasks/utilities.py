@@ -1,11 +1,18 @@
 # coding=utf-8
+import fcntl
+import hashlib
 import os
+import struct
 import tempfile
+import time
 import urlparse
-from zipfile import ZipFile
+import zlib
+from contextlib import contextmanager
+from zipfile import ZipFile, ZIP_STORED, ZIP_DEFLATED
 
 import requests
 import shutil
+from osgeo import gdal
 
 from safe.utilities.styling import set_vector_categorized_style, \
     set_vector_graduated_style, setRasterStyle
@@ -14,31 +21,247 @@ __author__ = 'Rizky Maulana Nugraha <lana.pcfre@gmail.com>'
 __date__ = '1/27/16'
 
 
-def download_file(url):
+# Downloaded archives and their extracted layers are kept in this cache, so
+# the same input is not downloaded and extracted again by the next analysis.
+CACHE_DIR = os.environ.get(
+    'INASAFE_HEADLESS_CACHE_DIR',
+    os.path.join(tempfile.gettempdir(), 'inasafe-headless-cache'))
+# Maximum total size of the cache in megabytes. The least recently used
+# entries are removed above this size.
+CACHE_SIZE = int(os.environ.get('INASAFE_HEADLESS_CACHE_SIZE', '10240'))
+# Entries used within this number of seconds are not removed, a task of
+# another worker might still read them. It should be longer than a task.
+CACHE_LEASE = int(os.environ.get('INASAFE_HEADLESS_CACHE_LEASE', '7200'))
+
+# Assign User-Agent to emulate browser
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (X11; U; Linux i686) '
+                  'Gecko/20071127 Firefox/2.0.0.11'
+}
+
+# Name of the file marking a complete cache entry.
+COMPLETE_MARKER = '.complete'
+
+# Deflate level of result archives, from 0 (store) to 9.
+ARCHIVE_COMPRESS_LEVEL = int(
+    os.environ.get('INASAFE_HEADLESS_COMPRESS_LEVEL', '6'))
+# These files are already compressed, they are stored in archives.
+COMPRESSED_EXTENSIONS = ['.gpkg', '.zip', '.png', '.jpg', '.jpeg']
+# Size of the chunks read from files while archiving.
+ARCHIVE_CHUNK_SIZE = 1024 * 1024
+
+
+@contextmanager
+def cache_lock(key):
+    """Lock a cache entry, across processes.
+
+    Workers wait for each other, so a file is downloaded only once.
+
+    :param key: The key of the cache entry.
+    :type key: str
+    """
+    lock_file = open(os.path.join(cache_dir(), '%s.lock' % key), 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+    finally:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+
+def cache_dir():
+    """Return the cache directory, it's created if needed.
+
+    :return: The path of the cache directory.
+    :rtype: str
+    """
+    if not os.path.exists(CACHE_DIR):
+        try:
+            os.makedirs(CACHE_DIR)
+        except OSError:
+            # Another worker created it in the meantime.
+            if not os.path.isdir(CACHE_DIR):
+                raise
+    return CACHE_DIR
+
+
+def cache_key(url):
+    """Get the cache key of a url without downloading it.
+
+    For a local file, the key uses its path, size and modification time. For
+    http, it uses the ETag or the Last-Modified header.
+
+    :param url: The url or file path.
+    :type url: str
+
+    :return: The key or None if we need the content to get a key.
+    :rtype: str
+    """
     parsed_uri = urlparse.urlparse(url)
     if parsed_uri.scheme == 'http' or parsed_uri.scheme == 'https':
-        tmpfile = tempfile.mktemp()
-        # NOTE the stream=True parameter
-        # Assign User-Agent to emulate browser
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (X11; U; Linux i686) '
-                          'Gecko/20071127 Firefox/2.0.0.11'
-        }
-        r = requests.get(url, headers=headers, stream=True)
-        with open(tmpfile, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=1024):
-                if chunk:
-                    f.write(chunk)
-        return tmpfile
+        try:
+            response = requests.head(
+                url, headers=HEADERS, allow_redirects=True)
+        except requests.RequestException:
+            return None
+        if response.status_code >= 400:
+            return None
+        validator = (
+            response.headers.get('ETag') or
+            response.headers.get('Last-Modified'))
+        if not validator:
+            return None
     elif parsed_uri.scheme == 'file' or not parsed_uri.scheme:
-        tmpfile = tempfile.mktemp()
-        shutil.copy(parsed_uri.path, tmpfile)
-        return tmpfile
+        stat = os.stat(parsed_uri.path)
+        validator = '%s %s' % (stat.st_size, stat.st_mtime)
+    else:
+        return None
+    return hashlib.sha1('%s\n%s' % (url, validator)).hexdigest()
+
+
+def fetch(url, destination):
+    """Download a url or copy a file path to the destination.
+
+    :param url: The url or file path.
+    :type url: str
+
+    :param destination: The file path where to write the content.
+    :type destination: str
+
+    :return: The SHA1 of the content.
+    :rtype: str
+    """
+    parsed_uri = urlparse.urlparse(url)
+    if parsed_uri.scheme == 'http' or parsed_uri.scheme == 'https':
+        # NOTE the stream=True parameter
+        response = requests.get(url, headers=HEADERS, stream=True)
+        chunks = response.iter_content(chunk_size=1024 * 1024)
+    else:
+        source = open(parsed_uri.path, 'rb')
+        chunks = iter(lambda: source.read(1024 * 1024), '')
+
+    content_hash = hashlib.sha1()
+    with open(destination, 'wb') as f:
+        for chunk in chunks:
+            if chunk:
+                content_hash.update(chunk)
+                f.write(chunk)
+    return content_hash.hexdigest()
+
+
+def cached_entry(url):
+    """Get the cache entry of a url, it's downloaded if needed.
+
+    :param url: The url or file path.
+    :type url: str
+
+    :return: The directory of the cache entry, it contains the downloaded
+        file named 'archive'. None if the scheme is not supported.
+    :rtype: str
+    """
+    parsed_uri = urlparse.urlparse(url)
+    if parsed_uri.scheme not in ['http', 'https', 'file', '']:
+        return None
+
+    key = cache_key(url)
+    if not key:
+        # No validator, we download it and we use the content as the key.
+        # The extracted layers are still shared with the same content.
+        handle, temporary = tempfile.mkstemp(dir=cache_dir())
+        os.close(handle)
+        key = fetch(url, temporary)
+    else:
+        temporary = None
+
+    entry = os.path.join(cache_dir(), key)
+    with cache_lock(key):
+        if not os.path.exists(os.path.join(entry, COMPLETE_MARKER)):
+            if os.path.exists(entry):
+                # A worker stopped while it was writing this entry.
+                shutil.rmtree(entry)
+            os.makedirs(entry)
+            archive = os.path.join(entry, 'archive')
+            if temporary:
+                shutil.move(temporary, archive)
+                temporary = None
+            else:
+                fetch(url, archive)
+            open(os.path.join(entry, COMPLETE_MARKER), 'w').close()
+        # The modification time of the marker is the last use of the entry.
+        os.utime(os.path.join(entry, COMPLETE_MARKER), None)
+
+    if temporary:
+        os.remove(temporary)
+
+    evict_cache(keep=key)
+    return entry
+
+
+def evict_cache(keep=None):
+    """Remove the least recently used entries above the cache size.
+
+    Entries used by a task within CACHE_LEASE seconds are kept even above
+    the cache size, tasks don't hold a lock while they read an entry.
+
+    :param keep: A key which must not be removed.
+    :type keep: str
+    """
+    entries = []
+    total_size = 0
+    for key in os.listdir(cache_dir()):
+        entry = os.path.join(cache_dir(), key)
+        marker = os.path.join(entry, COMPLETE_MARKER)
+        if not os.path.exists(marker):
+            continue
+        size = 0
+        for root, dirs, files in os.walk(entry):
+            for f in files:
+                size += os.path.getsize(os.path.join(root, f))
+        total_size += size
+        entries.append((os.path.getmtime(marker), key, size))
+
+    entries.sort()
+    for _, key, size in entries:
+        if total_size <= CACHE_SIZE * 1024 * 1024:
+            break
+        if key == keep:
+            continue
+        marker = os.path.join(cache_dir(), key, COMPLETE_MARKER)
+        with cache_lock(key):
+            # The entry might have been used since we listed it.
+            try:
+                last_use = os.path.getmtime(marker)
+            except OSError:
+                continue
+            if time.time() - last_use < CACHE_LEASE:
+                continue
+            shutil.rmtree(os.path.join(cache_dir(), key), ignore_errors=True)
+        total_size -= size
+
+
+def download_file(url):
+    """Download a file specified by url, using the cache.
+
+    :param url: The url or file path of the file.
+    :type url: str
+
+    :return: The path of a copy of the file, the caller can modify it.
+    :rtype: str
+    """
+    entry = cached_entry(url)
+    if not entry:
+        return None
+    tmpfile = tempfile.mktemp()
+    shutil.copy(os.path.join(entry, 'archive'), tmpfile)
+    return tmpfile
 
 
 def download_layer(url):
     """Download a layer specified by url to a directory
 
+    The archive is extracted once in the cache and the layer is shared by
+    the next tasks using the same url.
+
     :param url: The url or file path of the zip file
     :type url: str
 
@@ -46,33 +269,45 @@ def download_layer(url):
     :rtype: str
     """
     # download archive file
-    filename = download_file(url)
-    base_name, _ = os.path.splitext(filename)
-    dir_name = os.path.dirname(filename)
+    entry = cached_entry(url)
+    filename = os.path.join(entry, 'archive')
+    dir_name = os.path.join(entry, 'layer')
+    key = os.path.basename(entry)
     layer_base_name = None
-    with ZipFile(filename) as zipf:
-        name_list = zipf.namelist()
-        zipf.extractall(path=dir_name)
-        layer_extensions = ['.shp', '.tif', '.asc']
-        layer_ext = None
-        for name in name_list:
-            for ext in layer_extensions:
-                if name.endswith(ext):
-                    layer_ext = ext
-                    layer_base_name = name
+    with cache_lock(key):
+        with ZipFile(filename) as zipf:
+            name_list = zipf.namelist()
+            if not os.path.exists(dir_name):
+                extract_dir = tempfile.mkdtemp(dir=entry)
+                zipf.extractall(path=extract_dir)
+                os.rename(extract_dir, dir_name)
+            layer_extensions = ['.shp', '.tif', '.asc']
+            layer_ext = None
+            for name in name_list:
+                for ext in layer_extensions:
+                    if name.endswith(ext):
+                        layer_ext = ext
+                        layer_base_name = name
+                        break
+                if layer_ext:
                     break
-            if layer_ext:
-                break
 
     return os.path.join(dir_name, layer_base_name)
 
 
-def archive_layer(layer_name):
+def archive_layer(layer_name, compress_level=None):
     """Archiving a layer with all dependent files to .zip
 
+    Files are streamed one by one in the archive.
+
     :param layer_name: the layer name to archive
     :type layer_name: str
 
+    :param compress_level: The deflate level, from 0 (store) to 9. Files
+        which are already compressed are always stored. Default to
+        ARCHIVE_COMPRESS_LEVEL.
+    :type compress_level: int
+
     :return: path to archive file
     :rtype: str
 
@@ -83,17 +318,197 @@ def archive_layer(layer_name):
 
     zip_path = os.path.join(dirname, zip_basename)
 
-    with ZipFile(zip_path, 'w') as zipf:
-        for root, dirs, files in os.walk(dirname):
-            for f in files:
-                _, ext = os.path.splitext(f)
-                if rootname in f and not f == zip_basename:
-                    filename = os.path.join(root, f)
-                    zipf.write(filename, arcname=f)
+    files = (
+        path for path in layer_files(layer_name)
+        if not os.path.basename(path) == zip_basename)
+    with open(zip_path, 'wb') as zipf:
+        for chunk in zip_stream(files, compress_level):
+            zipf.write(chunk)
 
     return zip_path
 
 
+def layer_files(layer_name):
+    """Generate the files of a layer, with all dependent files.
+
+    :param layer_name: the layer name
+    :type layer_name: str
+
+    :return: Generator of file paths.
+    :rtype: generator
+    """
+    dirname, basename = os.path.split(layer_name)
+    rootname, ext = os.path.splitext(basename)
+    for root, dirs, files in os.walk(dirname):
+        for f in files:
+            if rootname in f:
+                yield os.path.join(root, f)
+
+
+def is_compressed(path):
+    """Check if a file is already compressed, so deflate is useless.
+
+    :param path: The file path.
+    :type path: str
+
+    :return: True if the file is compressed.
+    :rtype: bool
+    """
+    _, ext = os.path.splitext(path)
+    ext = ext.lower()
+    if ext in COMPRESSED_EXTENSIONS:
+        return True
+    if ext in ['.tif', '.tiff']:
+        dataset = gdal.Open(path)
+        if dataset is None:
+            return False
+        metadata = dataset.GetMetadata('IMAGE_STRUCTURE') or {}
+        return metadata.get('COMPRESSION', 'NONE') != 'NONE'
+    return False
+
+
+def file_checksum(path):
+    """Compute the CRC-32 and the size of a file with a single read.
+
+    :param path: The file path.
+    :type path: str
+
+    :return: Tuple with the CRC-32 and the size in bytes.
+    :rtype: (int, int)
+    """
+    crc = size = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(ARCHIVE_CHUNK_SIZE), ''):
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+    return crc & 0xffffffff, size
+
+
+def check_zip32(*values):
+    """Check sizes and offsets fit in a zip archive without Zip64.
+
+    :param values: Sizes or offsets in bytes.
+    :type values: list
+
+    :raises: ValueError if a value is too big.
+    """
+    if max(values) > 0xffffffff:
+        raise ValueError('Zip64 archives are not supported.')
+
+
+def zip_stream(files, compress_level=None):
+    """Generate a zip archive by chunks, while files are added.
+
+    The archive is never staged on the disk, so it can be written or sent
+    as it comes. Files are read when the generator gets them, so they can be
+    given as soon as they are written.
+
+    :param files: Iterable of file paths, or of tuples (path, name in the
+        archive).
+    :type files: iterable
+
+    :param compress_level: The deflate level, from 0 (store) to 9. Files
+        which are already compressed are always stored. Default to
+        ARCHIVE_COMPRESS_LEVEL.
+    :type compress_level: int
+
+    :return: Generator of chunks of the zip archive.
+    :rtype: generator
+    """
+    if compress_level is None:
+        compress_level = ARCHIVE_COMPRESS_LEVEL
+
+    offset = 0
+    central_directory = []
+    for item in files:
+        if isinstance(item, tuple):
+            path, arcname = item
+        else:
+            path, arcname = item, os.path.basename(item)
+        arcname = arcname.encode('utf-8') if isinstance(
+            arcname, unicode) else arcname
+
+        stat = os.stat(path)
+        mtime = time.localtime(stat.st_mtime)
+        dos_time = (
+            mtime.tm_hour << 11 | mtime.tm_min << 5 | mtime.tm_sec // 2)
+        dos_date = (
+            (max(mtime.tm_year, 1980) - 1980) << 9 |
+            mtime.tm_mon << 5 | mtime.tm_mday)
+
+        stored = compress_level == 0 or is_compressed(path)
+        if stored:
+            # Sizes and CRC must be in the header of a stored file, they
+            # are computed with the same read.
+            method, flags = ZIP_STORED, 0
+            crc, size = file_checksum(path)
+            compressed_size = size
+        else:
+            # Sizes and CRC are in a data descriptor after the data.
+            method, flags = ZIP_DEFLATED, 0x08
+            crc = size = compressed_size = 0
+
+        header = struct.pack(
+            '<IHHHHHIIIHH', 0x04034b50, 20, flags, method, dos_time,
+            dos_date, crc, compressed_size, size, len(arcname), 0)
+        header_offset = offset
+        offset += len(header) + len(arcname)
+        if stored:
+            check_zip32(offset + size)
+        else:
+            check_zip32(offset)
+        yield header + arcname
+
+        with open(path, 'rb') as f:
+            if stored:
+                # The file is read again to be streamed, it must not have
+                # changed since the header.
+                read_crc = read_size = 0
+                for chunk in iter(lambda: f.read(ARCHIVE_CHUNK_SIZE), ''):
+                    read_crc = zlib.crc32(chunk, read_crc)
+                    read_size += len(chunk)
+                    if read_size > size:
+                        break
+                    yield chunk
+                if (read_crc & 0xffffffff, read_size) != (crc, size):
+                    raise ValueError(
+                        'The file %s has changed while archiving.' % path)
+                offset += size
+            else:
+                compressor = zlib.compressobj(
+                    compress_level, zlib.DEFLATED, -zlib.MAX_WBITS)
+                for chunk in iter(lambda: f.read(ARCHIVE_CHUNK_SIZE), ''):
+                    crc = zlib.crc32(chunk, crc)
+                    size += len(chunk)
+                    chunk = compressor.compress(chunk)
+                    compressed_size += len(chunk)
+                    check_zip32(size, offset + compressed_size)
+                    if chunk:
+                        yield chunk
+                chunk = compressor.flush()
+                compressed_size += len(chunk)
+                crc &= 0xffffffff
+                descriptor = struct.pack(
+                    '<IIII', 0x08074b50, crc, compressed_size, size)
+                offset += compressed_size + len(descriptor)
+                check_zip32(offset)
+                yield chunk
+                yield descriptor
+
+        central_directory.append(struct.pack(
+            '<IHHHHHHIIIHHHHHII', 0x02014b50, 0x0314, 20, flags, method,
+            dos_time, dos_date, crc, compressed_size, size, len(arcname),
+            0, 0, 0, 0, (stat.st_mode & 0xffff) << 16,
+            header_offset) + arcname)
+
+    directory = ''.join(central_directory)
+    check_zip32(offset + len(directory), len(central_directory) << 16)
+    yield directory
+    yield struct.pack(
+        '<IHHHHIIH', 0x06054b50, 0, 0, len(central_directory),
+        len(central_directory), len(directory), offset, 0)
+
+
 def generate_styles(safe_impact_layer, qgis_impact_layer):
     # Get requested style for impact layer of either kind
     style = safe_impact_layer.get_style_info()
@@ -450,6 +450,13 @@ class ProcessingInstallationError(InaSAFEError):
     pass
 
 
+class InvalidFormulaError(InaSAFEError):
+
+    """When a post processor formula is not a simple arithmetic formula."""
+
+    pass
+
+
 class AlignRastersError(Exception):
     """Raised if alignment of hazard and exposure rasters failed"""
     pass
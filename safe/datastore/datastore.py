@@ -3,12 +3,15 @@
 """Datastore implementation."""
 
 import logging
+from threading import Thread, Lock, current_thread
 
 from abc import ABCMeta, abstractmethod
 from qgis.core import QgsMapLayer, QgsRasterLayer, QgsVectorLayer, QGis
 
-from safe.utilities.keyword_io import KeywordIO
+from safe.common.exceptions import ErrorDataStore
 from safe.utilities.i18n import tr
+from safe.utilities.metadata import (
+    copy_layer_keywords, write_iso19115_metadata)
 from safe.utilities.utilities import monkey_patch_keywords
 
 __copyright__ = "Copyright 2016, The InaSAFE Project"
@@ -49,6 +52,13 @@ class DataStore(object):
         self._index = 1
         self._use_index = False
 
+        # Layers waiting to be written by the background thread, and layers
+        # written but not pointing to the datastore yet.
+        self._pending = []
+        self._written = []
+        self._lock = Lock()
+        self._writer = None
+
     @property
     def use_index(self):
         """Return if we use an index to add the layer name.
@@ -105,10 +115,139 @@ class DataStore(object):
 
         .. versionadded:: 4.0
         """
+        self.wait()
+        layer_name = self._indexed_name(layer_name)
+        try:
+            keywords = layer.keywords
+        except AttributeError:
+            keywords = None
+        return self._save_layer(layer, layer_name, keywords)
+
+    def add_layer_async(self, layer, layer_name):
+        """Add a layer to the datastore on a background thread.
+
+        A vector layer is written by a background thread while the analysis
+        goes on. The layer itself is returned: it serves reads from memory
+        and it will use the datastore once wait() is called. Layers are
+        written in the order they are added.
+
+        Raster layers are written before returning, the layer from the
+        datastore is returned.
+
+        :param layer: The layer to add. It must not be edited anymore.
+        :type layer: QgsMapLayer
+
+        :param layer_name: The name of the layer in the datastore.
+        :type layer_name: str
+
+        :return: The layer to use.
+        :rtype: QgsMapLayer
+
+        :raises: ErrorDataStore
+        """
+        if isinstance(layer, QgsRasterLayer):
+            result, name = self.add_layer(layer, layer_name)
+            if not result:
+                raise ErrorDataStore(name)
+            return self.layer(name)
+
+        layer_name = self._indexed_name(layer_name)
+        # The keywords may be edited while the layer is written.
+        keywords = copy_layer_keywords(layer.keywords)
+
+        with self._lock:
+            self._pending.append((layer, layer_name, keywords))
+            if self._writer is None:
+                self._writer = Thread(
+                    target=self._write_pending_layers,
+                    name='InaSAFE datastore writer')
+                self._writer.start()
+
+        return layer
+
+    def wait(self):
+        """Wait until layers added in the background are written.
+
+        Written layers are pointed to the datastore, they keep their style
+        and their keywords.
+
+        :raises: ErrorDataStore
+        """
+        writer = self._writer
+        if writer is current_thread():
+            return
+        if writer is not None:
+            writer.join()
+
+        with self._lock:
+            written, self._written = self._written, []
+
+        errors = []
+        for layer, (result, name) in written:
+            if not result:
+                errors.append(name)
+                continue
+            layer.setDataSource(self.layer_uri(name), layer.name(), 'ogr')
+
+        if errors:
+            raise ErrorDataStore(
+                tr('Something went wrong with the datastore : '
+                   '{error_message}').format(error_message=', '.join(errors)))
+
+    def _write_pending_layers(self):
+        """Write layers added in the background, in the background thread.
+
+        The thread stops when there is no more layer to write.
+        """
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._writer = None
+                    return
+                layer, layer_name, keywords = self._pending.pop(0)
+
+            # noinspection PyBroadException
+            try:
+                result = self._save_layer(layer, layer_name, keywords)
+            except Exception as e:
+                LOGGER.exception(e)
+                result = False, u'{name} : {error}'.format(
+                    name=layer_name, error=e)
+
+            with self._lock:
+                self._written.append((layer, result))
+
+    def _indexed_name(self, layer_name):
+        """Add the index to the layer name if we use an index.
+
+        :param layer_name: The name of the layer in the datastore.
+        :type layer_name: str
+
+        :return: The name to use.
+        :rtype: str
+        """
         if self._use_index:
             layer_name = '%s-%s' % (self._index, layer_name)
             self._index += 1
+        return layer_name
+
+    def _save_layer(self, layer, layer_name, keywords):
+        """Write a layer and its keywords in the datastore.
+
+        :param layer: The layer to add.
+        :type layer: QgsMapLayer
+
+        :param layer_name: The name of the layer in the datastore.
+        :type layer_name: str
+
+        :param keywords: The keywords of the layer, None if it has none.
+        :type keywords: dict
 
+        :returns: A two-tuple. The first element will be True if we could add
+            the layer to the datastore. The second element will be the layer
+            name which has been used or the error message.
+        :rtype: (bool, str)
+        """
         if self.layer_uri(layer_name):
             return False, tr('The layer already exists in the datastore.')
 
@@ -124,17 +263,15 @@ class DataStore(object):
             LOGGER.info(
                 u'Layer saved {layer_name}'.format(layer_name=result[1]))
 
-        try:
-            layer.keywords
-            real_layer = self.layer(result[1])
-            if isinstance(real_layer, bool):
-                message = ('{name} was not found in the datastore or the '
-                           'layer was not valid.'.format(name=result[1]))
+        if result[0] and keywords is not None:
+            # We don't create a QGIS layer, it might be the writer thread.
+            uri = self.layer_uri(result[1])
+            if not uri:
+                message = ('{name} was not found in the datastore.'.format(
+                    name=result[1]))
                 LOGGER.debug(message)
                 return False, message
-            KeywordIO().write_keywords(real_layer, layer.keywords)
-        except AttributeError:
-            pass
+            write_iso19115_metadata(uri, keywords)
 
         return result
 
@@ -149,6 +286,7 @@ class DataStore(object):
 
         .. versionadded:: 4.0
         """
+        self.wait()
         uri = self.layer_uri(layer_name)
         layer = QgsVectorLayer(uri, layer_name, 'ogr')
         if not layer.isValid():
@@ -186,6 +324,8 @@ class DataStore(object):
     def layers(self):
         """Return a list of layers available.
 
+        Layers added in the background are available after wait().
+
         :return: List of layers available in the datastore.
         :rtype: list
 
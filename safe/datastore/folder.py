@@ -13,6 +13,7 @@ from qgis.core import (
 
 from safe.datastore.datastore import DataStore
 from safe.common.exceptions import ErrorDataStore
+from safe.gis.raster.storage import is_in_memory, copy_raster
 from safe.utilities.utilities import human_sorting
 
 __copyright__ = "Copyright 2016, The InaSAFE Project"
@@ -236,6 +237,11 @@ class Folder(DataStore):
             # If it's tiff file based.
             QFile.copy(source.absoluteFilePath(), output.absoluteFilePath())
 
+        elif is_in_memory(raster_layer.source()):
+            # If it's an intermediate raster in memory, we write it on the
+            # disk with the same values.
+            copy_raster(raster_layer.source(), output.absoluteFilePath())
+
         else:
             # If it's not file based.
             renderer = raster_layer.renderer()
@@ -12,16 +12,33 @@ Contact : ole.moller.nielsen@gmail.com
 """
 
 from osgeo import ogr, osr, gdal
-from PyQt4.QtCore import QFileInfo
-from qgis.core import (
-    QgsVectorLayer,
-    QgsRasterLayer,
-)
+from PyQt4.QtCore import QFileInfo, QPyNullVariant, QDate, QDateTime, Qt
 
 from safe.definitions.gis import QGIS_OGR_GEOMETRY_MAP
 from safe.datastore.datastore import DataStore
 from safe.common.exceptions import ErrorDataStore
 
+# GDAL 2.2 is required to store rasters which are not Byte, using the tiled
+# gridded coverage extension.
+gridded_coverage_version = 2020000
+
+# The data types of a tiled gridded coverage. Other types are converted.
+GRIDDED_COVERAGE_TYPES = [
+    gdal.GDT_Byte, gdal.GDT_Int16, gdal.GDT_UInt16, gdal.GDT_Float32]
+
+# From http://doc.qt.io/qt-4.8/qvariant.html#Type-enum
+QVARIANT_OGR_FIELD_MAP = {
+    1: ogr.OFTInteger,  # Bool
+    2: ogr.OFTInteger,  # Int
+    3: ogr.OFTInteger,  # UInt
+    4: ogr.OFTInteger64,  # LongLong
+    5: ogr.OFTInteger64,  # ULongLong
+    6: ogr.OFTReal,  # Double
+    10: ogr.OFTString,  # String
+    14: ogr.OFTDate,  # Date
+    16: ogr.OFTDateTime,  # DateTime
+}
+
 
 class GeoPackage(DataStore):
     """
@@ -65,6 +82,10 @@ class GeoPackage(DataStore):
             datasource = self.vector_driver.CreateDataSource(path)
             del datasource
 
+        # The connection to the geopackage, opened on the first write and
+        # reused for all layers.
+        self._vector_datasource = None
+
     @property
     def uri_path(self):
         """Return the URI of the datastore as a path. It's not a layer URI.
@@ -85,7 +106,7 @@ class GeoPackage(DataStore):
         .. versionadded:: 4.0
         """
         # Fixme, need to check DB permissions ?
-        return self._uri.absolutePath().isWritable()
+        return QFileInfo(self._uri.absolutePath()).isWritable()
 
     def supports_rasters(self):
         """Check if we can support raster in the geopackage.
@@ -100,6 +121,38 @@ class GeoPackage(DataStore):
         else:
             return True
 
+    @staticmethod
+    def supports_gridded_coverage():
+        """Check if we can store rasters which are not Byte.
+
+        :return: If GDAL supports the tiled gridded coverage extension.
+        :rtype: bool
+        """
+        version = int(gdal.VersionInfo('VERSION_NUM'))
+        return version >= gridded_coverage_version
+
+    @property
+    def vector_datasource(self):
+        """Return the OGR datasource of the geopackage, opened for writing.
+
+        The datasource is opened once and kept for the life of the
+        datastore, so each new layer doesn't open a new SQLite connection.
+
+        :return: The datasource.
+        :rtype: ogr.DataSource
+        """
+        if self._vector_datasource is None:
+            self._vector_datasource = self.vector_driver.Open(
+                self.uri.absoluteFilePath(), True)
+        return self._vector_datasource
+
+    def close(self):
+        """Close the connection to the geopackage.
+
+        It will be opened again if another layer is added.
+        """
+        self._vector_datasource = None
+
     def _vector_layers(self):
         """Return a list of vector layers available.
 
@@ -109,8 +162,11 @@ class GeoPackage(DataStore):
         .. versionadded:: 4.0
         """
         layers = []
-        vector_datasource = self.vector_driver.Open(
-            self.uri.absoluteFilePath())
+        vector_datasource = self.vector_datasource
+        if vector_datasource is None:
+            # The geopackage might be read only.
+            vector_datasource = self.vector_driver.Open(
+                self.uri.absoluteFilePath())
         if vector_datasource:
             for i in range(vector_datasource.GetLayerCount()):
                 layers.append(vector_datasource.GetLayer(i).GetName())
@@ -195,28 +251,93 @@ class GeoPackage(DataStore):
 
         .. versionadded:: 4.0
         """
+        return self._write_layer(vector_layer, layer_name)
+
+    def _write_layer(self, vector_layer, layer_name, tabular=False):
+        """Write a vector or a tabular layer in a single transaction.
+
+        Vector layers get a R-tree spatial index. Tabular layers are stored
+        as attribute tables, without geometry column.
+
+        :param vector_layer: The layer to add.
+        :type vector_layer: QgsVectorLayer
 
+        :param layer_name: The name of the layer in the datastore.
+        :type layer_name: str
+
+        :param tabular: If the layer must be stored without geometry.
+        :type tabular: bool
+
+        :returns: A two-tuple. The first element will be True if we could add
+            the layer to the datastore. The second element will be the layer
+            name which has been used or the error message.
+        :rtype: (bool, str)
+        """
         # Fixme
         # if not self.is_writable():
         #    return False, 'The destination is not writable.'
 
-        geometry = QGIS_OGR_GEOMETRY_MAP[vector_layer.wkbType()]
-
-        spatial_reference = osr.SpatialReference()
-        qgis_spatial_reference = vector_layer.crs().authid()
-        spatial_reference.ImportFromEPSG(
-            int(qgis_spatial_reference.split(':')[1]))
+        vector_datasource = self.vector_datasource
+        if vector_datasource is None:
+            return False, 'The geopackage can not be opened for writing.'
 
-        vector_datasource = self.vector_driver.Open(
-            self.uri.absoluteFilePath(), True)
-        vector_datasource.CreateLayer(layer_name, spatial_reference, geometry)
-        uri = u'{}|layerid=0'.format(self.uri.absoluteFilePath())
-        vector_layer = QgsVectorLayer(uri, layer_name, u'ogr')
-
-        data_provider = vector_layer.dataProvider()
+        if tabular:
+            geometry_type = ogr.wkbNone
+            spatial_reference = None
+            options = ['ASPATIAL_VARIANT=GPKG_ATTRIBUTES']
+        else:
+            geometry_type = QGIS_OGR_GEOMETRY_MAP[vector_layer.wkbType()]
+            spatial_reference = osr.SpatialReference()
+            qgis_spatial_reference = vector_layer.crs().authid()
+            if qgis_spatial_reference.startswith('EPSG:'):
+                spatial_reference.ImportFromEPSG(
+                    int(qgis_spatial_reference.split(':')[1]))
+            else:
+                spatial_reference.ImportFromWkt(vector_layer.crs().toWkt())
+            options = ['SPATIAL_INDEX=YES']
+
+        output = vector_datasource.CreateLayer(
+            layer_name, spatial_reference, geometry_type, options)
+        if output is None:
+            return False, 'The layer {name} can not be created.'.format(
+                name=layer_name)
+
+        fields = vector_layer.fields()
+        for field in fields.toList():
+            field_type = QVARIANT_OGR_FIELD_MAP.get(
+                field.type(), ogr.OFTString)
+            field_definition = ogr.FieldDefn(field.name(), field_type)
+            if field_type == ogr.OFTString and field.length() > 0:
+                field_definition.SetWidth(field.length())
+            output.CreateField(field_definition)
+
+        definition = output.GetLayerDefn()
+        field_count = fields.count()
+
+        output.StartTransaction()
         for feature in vector_layer.getFeatures():
-            data_provider.addFeatures([feature])
-
+            ogr_feature = ogr.Feature(definition)
+            if not tabular:
+                geometry = feature.geometry()
+                if geometry and not geometry.isGeosEmpty():
+                    ogr_geometry = ogr.CreateGeometryFromWkb(
+                        bytes(geometry.asWkb()))
+                    if geometry_type != ogr.wkbUnknown and (
+                            ogr_geometry.GetGeometryType() != geometry_type):
+                        ogr_geometry = ogr.ForceTo(ogr_geometry, geometry_type)
+                    ogr_feature.SetGeometryDirectly(ogr_geometry)
+
+            attributes = feature.attributes()
+            for index in xrange(field_count):
+                value = _ogr_value(attributes[index])
+                if value is not None:
+                    ogr_feature.SetField(index, value)
+
+            output.CreateFeature(ogr_feature)
+        output.CommitTransaction()
+
+        # Write the extent and build the spatial index now.
+        output.SyncToDisk()
         return True, layer_name
 
     def _add_raster_layer(self, raster_layer, layer_name):
@@ -237,23 +358,36 @@ class GeoPackage(DataStore):
         """
 
         source = gdal.Open(raster_layer.source())
-        array = source.GetRasterBand(1).ReadAsArray()
+        band = source.GetRasterBand(1)
+        array = band.ReadAsArray()
 
         x_size = source.RasterXSize
         y_size = source.RasterYSize
 
+        # Keep the data type if the tiled gridded coverage is available.
+        data_type = gdal.GDT_Byte
+        no_data = None
+        if self.supports_gridded_coverage():
+            data_type = band.DataType
+            if data_type not in GRIDDED_COVERAGE_TYPES:
+                data_type = gdal.GDT_Float32
+            no_data = band.GetNoDataValue()
+
         output = self.raster_driver.Create(
             self.uri.absoluteFilePath(),
             x_size,
             y_size,
             1,
-            gdal.GDT_Byte,
+            data_type,
             ['APPEND_SUBDATASET=YES', 'RASTER_TABLE=%s' % layer_name]
         )
 
         output.SetGeoTransform(source.GetGeoTransform())
         output.SetProjection(source.GetProjection())
-        output.GetRasterBand(1).WriteArray(array)
+        output_band = output.GetRasterBand(1)
+        if no_data is not None:
+            output_band.SetNoDataValue(no_data)
+        output_band.WriteArray(array)
 
         # Once we're done, close properly the dataset
         output = None
@@ -276,4 +410,22 @@ class GeoPackage(DataStore):
 
         .. versionadded:: 4.0
         """
-        return self._add_vector_layer(tabular_layer, layer_name)
+        return self._write_layer(tabular_layer, layer_name, tabular=True)
+
+
+def _ogr_value(value):
+    """Convert a QGIS attribute value to a value OGR can write.
+
+    :param value: The value of the attribute.
+    :type value: int, float, basestring, QDate, QDateTime, QPyNullVariant
+
+    :return: The value, None for a null value.
+    :rtype: int, float, basestring
+    """
+    if value is None or isinstance(value, QPyNullVariant):
+        return None
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (QDate, QDateTime)):
+        return value.toString(Qt.ISODate)
+    return value
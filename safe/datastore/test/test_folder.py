@@ -21,6 +21,7 @@ from PyQt4.QtCore import QDir
 
 from safe.test.utilities import load_test_raster_layer, load_test_vector_layer
 from safe.datastore.folder import Folder
+from safe.common.exceptions import ErrorDataStore
 
 qgis_iface()
 
@@ -109,5 +110,37 @@ class TestFolder(unittest.TestCase):
             data_store.layer_keyword('layer_purpose', 'hazard')
         )
 
+    def test_add_layer_async(self):
+        """Test we can add layers in the background."""
+        data_store = Folder(mkdtemp())
+        data_store.default_vector_format = 'geojson'
+
+        layer = load_test_vector_layer(
+            'hazard', 'flood_multipart_polygons.shp', clone_to_memory=True)
+        handle = data_store.add_layer_async(layer, 'flood')
+
+        # We can use the layer while it's written.
+        self.assertIs(handle, layer)
+        self.assertEqual(handle.providerType(), 'memory')
+        self.assertEqual(handle.keywords['layer_purpose'], 'hazard')
+
+        data_store.wait()
+        self.assertEqual(data_store.layers(), ['flood'])
+        self.assertEqual(handle.providerType(), 'ogr')
+        self.assertEqual(handle.source(), data_store.layer_uri('flood'))
+        self.assertEqual(handle.featureCount(), layer.featureCount())
+        self.assertEqual(
+            data_store.layer('flood').keywords['layer_purpose'], 'hazard')
+
+        # Errors are raised when we wait.
+        data_store.add_layer_async(layer, 'flood')
+        self.assertRaises(ErrorDataStore, data_store.wait)
+
+        # A raster is written right away.
+        layer = load_test_raster_layer('hazard', 'classified_hazard.tif')
+        handle = data_store.add_layer_async(layer, 'flood_raster')
+        self.assertEqual(handle.source(), data_store.layer_uri('flood_raster'))
+
+
 if __name__ == '__main__':
     unittest.main()
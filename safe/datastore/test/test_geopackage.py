@@ -16,7 +16,7 @@ import sys
 from tempfile import mktemp
 from qgis.core import QgsVectorLayer, QgsRasterLayer
 from PyQt4.QtCore import QFileInfo
-from osgeo import gdal
+from osgeo import gdal, ogr
 
 from safe.test.utilities import (
     get_qgis_app,
@@ -122,6 +122,40 @@ class TestGeoPackage(unittest.TestCase):
         result = data_store.add_layer(layer, tabular_layer_name)
         self.assertTrue(result[0])
 
+    @unittest.skipIf(
+        int(gdal.VersionInfo('VERSION_NUM')) < 2000000,
+        'GDAL 2.0 is required for geopackage.')
+    def test_layers_content(self):
+        """Test features, spatial index and tables in the geopackage."""
+        path = QFileInfo(mktemp() + '.gpkg')
+        data_store = GeoPackage(path)
+
+        layer = load_test_vector_layer(
+            'hazard', 'flood_multipart_polygons.shp')
+        self.assertTrue(data_store.add_layer(layer, 'flood')[0])
+
+        table = load_test_vector_layer(
+            'gisv4', 'impacts', 'exposure_summary_table.csv')
+        self.assertTrue(data_store.add_layer(table, 'breakdown')[0])
+
+        flood = data_store.layer('flood')
+        self.assertEqual(flood.featureCount(), layer.featureCount())
+        self.assertEqual(
+            flood.fields().count(), layer.fields().count())
+        self.assertEqual(flood.crs().authid(), layer.crs().authid())
+
+        breakdown = data_store.layer('breakdown')
+        self.assertEqual(breakdown.featureCount(), table.featureCount())
+        self.assertFalse(breakdown.hasGeometryType())
+
+        data_store.close()
+        datasource = ogr.Open(path.absoluteFilePath())
+        result = datasource.ExecuteSQL(
+            'SELECT name FROM sqlite_master WHERE name LIKE \'rtree_%\'')
+        tables = [feature.GetField(0) for feature in result]
+        datasource.ReleaseResultSet(result)
+        self.assertIn('rtree_flood_geom', tables)
+
     @unittest.skipIf(
         int(gdal.VersionInfo('VERSION_NUM')) < 2000000,
         'GDAL 2.0 is required for geopackage.')
@@ -16,6 +16,33 @@ inasafe_default_settings = {
     'developer_mode': False,
     'generate_report': True,
 
+    # Size in pixels of the windows used to process rasters.
+    'raster_tile_size': 2048,
+
+    # Number of processes and features per partition for intersection and
+    # union. 1 process means no process pool. The pool is headless only: in
+    # QGIS desktop, it runs serially unless multiprocessing.set_executable()
+    # points to a Python interpreter (Windows).
+    'vector_workers': 1,
+    'vector_partition_size': 1000,
+
+    # Where intermediate rasters and vectors of an analysis are written:
+    # 'disk' or 'memory' for the GDAL /vsimem/ file system. Memory is faster
+    # but large rasters might not fit in it.
+    'intermediate_storage': 'disk',
+
+    # Datastore of the analysis outputs: 'geopackage' for a single file, if
+    # GDAL supports it, or 'folder' for GeoJSON and GeoTIFF files.
+    'default_datastore': 'geopackage',
+
+    # Count vertices of the output of each step in the profiling. It reads
+    # all the geometries again, it's always done in debug mode.
+    'profiling_vertex_count': False,
+
+    # Keep compiled Jinja2 report templates on the disk, in a private
+    # folder of the user, so they are compiled once for all processes.
+    'report_bytecode_cache': False,
+
     'ISO19115_ORGANIZATION': 'InaSAFE.org',
     'ISO19115_URL': 'http://inasafe.org',
     'ISO19115_EMAIL': 'info@inasafe.org',
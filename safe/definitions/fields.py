@@ -391,6 +391,113 @@ profiling_time_field = {
     ]
 }
 
+profiling_features_in_field = {
+    'key': 'profiling_features_in_field',
+    'name': tr('Profiling features in'),
+    'field_name': 'feat_in',
+    'type': QVariant.Int,
+    'length': default_field_length,
+    'precision': 0,
+    'help_text': tr(
+        'The number of features given to the function or the step.'),
+    'description': tr(
+        'The profiling system in InaSAFE provide metrics about each step '
+        'of the analysis workflow. Using the features fields we are able to '
+        'see how the number of features changes along the analysis.'),
+    'citations': [
+        {
+            'text': None,
+            'link': None
+        }
+    ]
+}
+
+profiling_features_out_field = {
+    'key': 'profiling_features_out_field',
+    'name': tr('Profiling features out'),
+    'field_name': 'feat_out',
+    'type': QVariant.Int,
+    'length': default_field_length,
+    'precision': 0,
+    'help_text': tr(
+        'The number of features produced by the function or the step.'),
+    'description': tr(
+        'The profiling system in InaSAFE provide metrics about each step '
+        'of the analysis workflow. Using the features fields we are able to '
+        'see how the number of features changes along the analysis.'),
+    'citations': [
+        {
+            'text': None,
+            'link': None
+        }
+    ]
+}
+
+profiling_vertices_out_field = {
+    'key': 'profiling_vertices_out_field',
+    'name': tr('Profiling vertices out'),
+    'field_name': 'vertices',
+    'type': QVariant.Int,
+    'length': default_field_length,
+    'precision': 0,
+    'help_text': tr(
+        'The number of vertices of the layer produced by the step.'),
+    'description': tr(
+        'The profiling system in InaSAFE provide metrics about each step '
+        'of the analysis workflow. Using the vertices field we are able to '
+        'see which step makes the geometries more complex.'),
+    'citations': [
+        {
+            'text': None,
+            'link': None
+        }
+    ]
+}
+
+profiling_memory_field = {
+    'key': 'profiling_memory_field',
+    'name': tr('Profiling memory'),
+    'field_name': 'memory',
+    'type': QVariant.Double,
+    'length': default_field_length,
+    'precision': default_field_precision,
+    'help_text': tr(
+        'The difference of resident memory in MB between the start and the '
+        'end of the function or the step.'),
+    'description': tr(
+        'The profiling system in InaSAFE provide metrics about each step '
+        'of the analysis workflow. Using the memory fields we are able to '
+        'find which step uses too much memory.'),
+    'citations': [
+        {
+            'text': None,
+            'link': None
+        }
+    ]
+}
+
+profiling_peak_memory_field = {
+    'key': 'profiling_peak_memory_field',
+    'name': tr('Profiling peak memory'),
+    'field_name': 'peak_mem',
+    'type': QVariant.Double,
+    'length': default_field_length,
+    'precision': default_field_precision,
+    'help_text': tr(
+        'The peak resident memory in MB of the process at the end of the '
+        'function or the step.'),
+    'description': tr(
+        'The profiling system in InaSAFE provide metrics about each step '
+        'of the analysis workflow. Using the memory fields we are able to '
+        'find which step uses too much memory.'),
+    'citations': [
+        {
+            'text': None,
+            'link': None
+        }
+    ]
+}
+
 # # # # # # # # # #
 # Count, inputs (Absolute values)
 # # # # # # # # # #
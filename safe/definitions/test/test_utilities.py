@@ -40,6 +40,7 @@ from safe.definitions.hazard import hazard_cyclone
 
 from safe.definitions.utilities import (
     definition,
+    class_for_value,
     purposes_for_layer,
     hazards_for_layer,
     exposures_for_layer,
@@ -76,6 +77,26 @@ class TestDefinitionsUtilities(unittest.TestCase):
         keyword_definition = definition(keyword)
         self.assertTrue('description' in keyword_definition)
 
+        self.assertIsNone(definition('not a definition key'))
+
+        # A new definition is found after the index has been built.
+        new_definition = {
+            'key': 'definition_added_for_test',
+        }
+        definitions.definition_added_for_test = new_definition
+        try:
+            self.assertIs(
+                new_definition, definition('definition_added_for_test'))
+        finally:
+            del definitions.definition_added_for_test
+        self.assertIsNone(definition('definition_added_for_test'))
+
+    def test_class_for_value(self):
+        """Test we can get the class of a classification for a value."""
+        self.assertEqual(
+            'VIII', class_for_value('earthquake_mmi_scale', 8)['key'])
+        self.assertIsNone(class_for_value('earthquake_mmi_scale', 99))
+
     def test_layer_purpose_for_layer(self):
         """Test for purpose_for_layer method."""
         expected = ['aggregation', 'exposure', 'hazard']
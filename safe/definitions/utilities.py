@@ -241,6 +241,40 @@ def get_non_compulsory_fields(layer_purpose, layer_subcategory=None):
     return all_fields
 
 
+# Index of definitions, key: definition key, value: attribute name in
+# safe.definitions. It's built on the first call to definition().
+_definitions_index = {}
+
+# Number of attributes in safe.definitions when the index was built.
+_definitions_index_size = None
+
+# Interval tables of classifications, key: classification key.
+_classification_intervals = {}
+
+
+def _build_definitions_index():
+    """Build the index of definitions from the safe.definitions package.
+
+    Attributes are read in the same order as dir(), so if two definitions
+    share the same key, the first one is kept like before.
+    """
+    global _definitions_index_size
+    _definitions_index.clear()
+    _classification_intervals.clear()
+    for item in dir(definitions):
+        if not item.startswith("__"):
+            var = getattr(definitions, item)
+            if isinstance(var, dict):
+                key = var.get('key')
+                try:
+                    if key is not None and key not in _definitions_index:
+                        _definitions_index[key] = item
+                except TypeError:
+                    # The key is not hashable.
+                    pass
+    _definitions_index_size = len(vars(definitions))
+
+
 def definition(keyword):
     """Given a keyword, try to get a definition dict for it.
 
@@ -255,6 +289,9 @@ def definition(keyword):
     definition = kio.definition(keyword)
     print definition
 
+    The lookup is using an index built once. The index is built again if
+    a definition has been added, replaced or removed since.
+
     :param keyword: A keyword key.
     :type keyword: str
 
@@ -262,13 +299,78 @@ def definition(keyword):
         from definitions, otherwise None if no match was found.
     :rtype: dict, None
     """
+    if _definitions_index_size != len(vars(definitions)):
+        _build_definitions_index()
+
+    for attempt in range(2):
+        try:
+            item = _definitions_index.get(keyword)
+        except TypeError:
+            # The keyword is not hashable.
+            return None
+        if item is None:
+            return None
 
-    for item in dir(definitions):
-        if not item.startswith("__"):
-            var = getattr(definitions, item)
-            if isinstance(var, dict):
-                if var.get('key') == keyword:
-                    return var
+        var = getattr(definitions, item, None)
+        if isinstance(var, dict) and var.get('key') == keyword:
+            return var
+
+        # The definition has changed since the index was built.
+        _build_definitions_index()
+
+    return None
+
+
+def classification_intervals(classification_key):
+    """Get the interval table of a classification.
+
+    The table is computed once per classification. Classes without numeric
+    default thresholds are not in the table.
+
+    :param classification_key: The classification key.
+    :type classification_key: str
+
+    :returns: List of tuples (minimum, maximum, class definition), in the
+        same order as the classes of the classification.
+    :rtype: list
+    """
+    intervals = _classification_intervals.get(classification_key)
+    if intervals is not None:
+        return intervals
+
+    intervals = []
+    for the_class in definition(classification_key)['classes']:
+        minimum = the_class.get('numeric_default_min')
+        maximum = the_class.get('numeric_default_max')
+        if isinstance(minimum, dict) or isinstance(maximum, dict):
+            # Thresholds depend on the unit.
+            continue
+        if minimum is None or maximum is None:
+            continue
+        intervals.append((minimum, maximum, the_class))
+
+    _classification_intervals[classification_key] = intervals
+    return intervals
+
+
+def class_for_value(classification_key, value):
+    """Get the class of a classification for a value.
+
+    The first class where minimum < value <= maximum is returned.
+
+    :param classification_key: The classification key.
+    :type classification_key: str
+
+    :param value: The value.
+    :type value: int, float
+
+    :returns: The class definition or None if the value is not in a class.
+    :rtype: dict, None
+    """
+    for minimum, maximum, the_class in classification_intervals(
+            classification_key):
+        if minimum < value <= maximum:
+            return the_class
     return None
 
 
@@ -9,9 +9,9 @@ from qgis.core import (
 from qgis.analysis import QgsAlignRaster
 
 
-from safe.common.utilities import unique_filename
 from safe.common.exceptions import AlignRastersError
 from safe.definitions.processing_steps import align_steps
+from safe.gis.raster.storage import intermediate_filename
 from safe.gis.sanity_check import check_layer
 from safe.utilities.profiling import profile
 from safe.utilities.i18n import tr
@@ -55,8 +55,8 @@ def align_rasters(hazard_layer, exposure_layer, extent):
     output_layer_name = align_steps['output_layer_name']
     processing_step = align_steps['step_name']
 
-    hazard_output = unique_filename(suffix='.tif')
-    exposure_output = unique_filename(suffix='.tif')
+    hazard_output = intermediate_filename(suffix='.tif')
+    exposure_output = intermediate_filename(suffix='.tif')
 
     # Setup the two raster layers for alignment
     align = QgsAlignRaster()
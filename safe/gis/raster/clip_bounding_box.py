@@ -5,11 +5,14 @@
 import processing
 import logging
 
+from osgeo import gdal
 from qgis.core import QgsRasterLayer
 
 from safe.common.exceptions import ProcessingInstallationError
 from safe.common.utilities import unique_filename, temp_dir
 from safe.definitions.processing_steps import quick_clip_steps
+from safe.gis.raster.storage import (
+    intermediate_storage, intermediate_filename, memory_storage)
 from safe.gis.sanity_check import check_layer
 from safe.utilities.gis import is_raster_y_inverted
 from safe.utilities.profiling import profile
@@ -77,28 +80,47 @@ def clip_by_extent(layer, extent, callback=None):
                 str(extent.yMaximum())
             ]
 
-        # These values are all from the processing algorithm.
-        # https://github.com/qgis/QGIS/blob/master/python/plugins/processing/
-        # algs/gdal/ClipByExtent.py
-        # Please read the file to know these parameters.
-        parameters = dict()
-        parameters['INPUT'] = layer.source()
-        parameters['NO_DATA'] = ''
-        parameters['PROJWIN'] = ','.join(bbox)
-        parameters['RTYPE'] = 5
-        parameters['COMPRESS'] = 4
-        parameters['JPEGCOMPRESSION'] = 75
-        parameters['ZLEVEL'] = 6
-        parameters['PREDICTOR'] = 1
-        parameters['TILED'] = False
-        parameters['BIGTIFF'] = 0
-        parameters['TFW'] = False
-        parameters['EXTRA'] = ''
-        parameters['OUTPUT'] = output_raster
-        result = processing.runalg("gdalogr:cliprasterbyextent", parameters)
-
-        if result is None:
-            raise ProcessingInstallationError
+        if (intermediate_storage() == memory_storage
+                and hasattr(gdal, 'Translate')):
+            # We clip in the same process, in memory. Processing would run
+            # gdal_translate in another process which can't read or write
+            # our memory files.
+            output_raster = intermediate_filename(suffix='.tif')
+            parameters = dict(
+                projWin=[float(bbox[0]), float(bbox[3]),
+                         float(bbox[1]), float(bbox[2])],
+                outputType=gdal.GDT_Float32)
+            dataset = gdal.Translate(
+                output_raster, gdal.Open(layer.source()), **parameters)
+            if dataset is None:
+                raise ProcessingInstallationError
+            dataset = None
+            result = {'OUTPUT': output_raster}
+
+        else:
+            # These values are all from the processing algorithm.
+            # https://github.com/qgis/QGIS/blob/master/python/plugins/
+            # processing/algs/gdal/ClipByExtent.py
+            # Please read the file to know these parameters.
+            parameters = dict()
+            parameters['INPUT'] = layer.source()
+            parameters['NO_DATA'] = ''
+            parameters['PROJWIN'] = ','.join(bbox)
+            parameters['RTYPE'] = 5
+            parameters['COMPRESS'] = 4
+            parameters['JPEGCOMPRESSION'] = 75
+            parameters['ZLEVEL'] = 6
+            parameters['PREDICTOR'] = 1
+            parameters['TILED'] = False
+            parameters['BIGTIFF'] = 0
+            parameters['TFW'] = False
+            parameters['EXTRA'] = ''
+            parameters['OUTPUT'] = output_raster
+            result = processing.runalg(
+                "gdalogr:cliprasterbyextent", parameters)
+
+            if result is None:
+                raise ProcessingInstallationError
 
         clipped = QgsRasterLayer(result['OUTPUT'], output_layer_name)
 
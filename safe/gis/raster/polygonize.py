@@ -11,12 +11,13 @@ from qgis.core import (
     QgsFeatureRequest,
 )
 
-from safe.common.utilities import unique_filename, temp_dir
+from safe.common.utilities import temp_dir
 from safe.definitions.constants import no_data_value
 from safe.definitions.fields import hazard_value_field, exposure_type_field
 from safe.definitions.layer_geometry import (
     layer_geometry, layer_geometry_polygon)
 from safe.definitions.processing_steps import polygonize_steps
+from safe.gis.raster.storage import intermediate_filename
 from safe.gis.sanity_check import check_layer
 from safe.utilities.profiling import profile
 
@@ -61,7 +62,7 @@ def polygonize(layer, callback=None):
     srs.ImportFromWkt(input_raster.GetProjectionRef())
 
     temporary_dir = temp_dir(sub_dir='pre-process')
-    out_shapefile = unique_filename(
+    out_shapefile = intermediate_filename(
         suffix='-%s.shp' % output_layer_name, dir=temporary_dir)
 
     driver = ogr.GetDriverByName("ESRI Shapefile")
@@ -6,6 +6,8 @@ import logging
 import sys
 import subprocess
 from tempfile import mkdtemp
+from osgeo import gdal, ogr, osr
+from PyQt4.QtCore import QPyNullVariant
 from qgis.core import QgsRasterLayer, QgsRasterBandStats
 from processing import runalg
 
@@ -14,6 +16,7 @@ from safe.datastore.folder import Folder
 from safe.definitions.fields import aggregation_id_field
 from safe.definitions.processing_steps import rasterize_steps
 from safe.definitions.layer_purposes import layer_purpose_aggregation_summary
+from safe.gis.raster.storage import intermediate_filename
 from safe.gis.sanity_check import check_layer
 from safe.utilities.profiling import profile
 
@@ -45,16 +48,138 @@ def rasterize_vector_layer(layer, width, height, extent):
     :rtype: QgsRasterLayer
     """
     name = rasterize_steps['gdal_layer_name']
-    output_filename = unique_filename(prefix=name, suffix='.tif')
+    keywords = dict(layer.keywords)
+    field = layer.keywords['inasafe_fields'][aggregation_id_field['key']]
+
+    # We rasterize in the same process, with GDAL, into a raster aligned on
+    # the given grid. It is not written on the disk if intermediate files are
+    # stored in memory.
+    output_filename = intermediate_filename(prefix=name, suffix='.tif')
+    rasterized = _rasterize_in_process(
+        layer, field, width, height, extent, output_filename)
+
+    if not rasterized:
+        # We keep the GDAL command line as a fallback.
+        output_filename = unique_filename(prefix=name, suffix='.tif')
+        _rasterize_command_line(layer, width, height, extent, output_filename)
+
+    layer_aligned = QgsRasterLayer(output_filename, name, 'gdal')
+    assert layer_aligned.isValid()
+
+    layer_aligned.keywords = keywords
+    layer_aligned.keywords['title'] = (
+        rasterize_steps['output_layer_name'] % 'aggregation')
+    layer_aligned.keywords['layer_purpose'] = (
+        layer_purpose_aggregation_summary['key'])
+    del layer_aligned.keywords['inasafe_fields']
+
+    check_layer(layer_aligned)
+    return layer_aligned
+
+
+def _rasterize_in_process(layer, field, width, height, extent, filename):
+    """Rasterize a vector layer with GDAL, without leaving the process.
+
+    Features are copied to an OGR memory layer and burnt with
+    gdal.RasterizeLayer in a raster aligned on the grid given by extent and
+    width/height.
+
+    :param layer: The vector layer.
+    :type layer: QgsVectorLayer
+
+    :param field: The field name to burn.
+    :type field: basestring
+
+    :param width: The width of the output.
+    :type width: int
+
+    :param height: The height of the output.
+    :type height: int
+
+    :param extent: The extent to use.
+    :type extent: QgsRectangle
 
+    :param filename: The output file name, it can be in /vsimem/.
+    :type filename: basestring
+
+    :return: True if the raster has been created.
+    :rtype: bool
+    """
+    srs = osr.SpatialReference()
+    srs.ImportFromWkt(str(layer.crs().toWkt()))
+
+    source = ogr.GetDriverByName('Memory').CreateDataSource('')
+    vector = source.CreateLayer(
+        rasterize_steps['gdal_layer_name'], srs, ogr.wkbUnknown)
+    vector.CreateField(ogr.FieldDefn(field, ogr.OFTInteger))
+
+    index = layer.fieldNameIndex(field)
+    for feature in layer.getFeatures():
+        if not feature.geometry():
+            continue
+        ogr_feature = ogr.Feature(vector.GetLayerDefn())
+        ogr_feature.SetGeometry(
+            ogr.CreateGeometryFromWkb(bytes(feature.geometry().asWkb())))
+        value = feature.attributes()[index]
+        if not isinstance(value, QPyNullVariant) and value is not None:
+            ogr_feature.SetField(0, int(value))
+        vector.CreateFeature(ogr_feature)
+        ogr_feature = None
+
+    raster = gdal.GetDriverByName('GTiff').Create(
+        filename, width, height, 1, gdal.GDT_Int16)
+    if raster is None:
+        return False
+    raster.SetGeoTransform((
+        extent.xMinimum(),
+        extent.width() / width,
+        0,
+        extent.yMaximum(),
+        0,
+        -extent.height() / height))
+    raster.SetProjection(srs.ExportToWkt())
+    band = raster.GetRasterBand(1)
+    band.SetNoDataValue(-1)
+    band.Fill(-1)
+
+    result = gdal.RasterizeLayer(
+        raster, [1], vector, options=['ATTRIBUTE=%s' % field])
+    raster.FlushCache()
+    raster = None
+    source = None
+
+    if result != gdal.CE_None:
+        LOGGER.info(
+            'In process rasterization failed : %s' % gdal.GetLastErrorMsg())
+        gdal.Unlink(filename)
+        return False
+    return True
+
+
+def _rasterize_command_line(layer, width, height, extent, output_filename):
+    """Rasterize a vector layer using the gdal_rasterize command line.
+
+    :param layer: The vector layer.
+    :type layer: QgsVectorLayer
+
+    :param width: The width of the output.
+    :type width: int
+
+    :param height: The height of the output.
+    :type height: int
+
+    :param extent: The extent to use.
+    :type extent: QgsRectangle
+
+    :param output_filename: The output file name.
+    :type output_filename: basestring
+    """
     extent_str = '%f,%f,%f,%f' % (
         extent.xMinimum(),
         extent.xMaximum(),
         extent.yMinimum(),
         extent.yMaximum())
 
-    keywords = dict(layer.keywords)
-
     # The layer is in memory, we need to save it to a file for Processing.
     data_store = Folder(mkdtemp())
     data_store.default_vector_format = 'geojson'
@@ -112,16 +237,3 @@ def rasterize_vector_layer(layer, width, height, extent):
 
         result = runalg('gdalogr:rasterize', parameters)
         assert result is not None
-
-    layer_aligned = QgsRasterLayer(output_filename, name, 'gdal')
-    assert layer_aligned.isValid()
-
-    layer_aligned.keywords = keywords
-    layer_aligned.keywords['title'] = (
-        rasterize_steps['output_layer_name'] % 'aggregation')
-    layer_aligned.keywords['layer_purpose'] = (
-        layer_purpose_aggregation_summary['key'])
-    del layer_aligned.keywords['inasafe_fields']
-
-    check_layer(layer_aligned)
-    return layer_aligned
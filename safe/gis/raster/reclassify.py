@@ -4,15 +4,17 @@
 
 import numpy as np
 from osgeo import gdal
-from os.path import isfile
+from shutil import move
 from qgis.core import QgsRasterLayer
 
 from safe.common.exceptions import (
     FileNotFoundError, InvalidKeywordsForProcessingAlgorithm)
-from safe.common.utilities import unique_filename, temp_dir
 from safe.definitions.constants import no_data_value
 from safe.definitions.utilities import definition
 from safe.definitions.processing_steps import reclassify_raster_steps
+from safe.gis.raster.storage import (
+    intermediate_filename, is_in_memory, file_exists, copy_raster)
+from safe.gis.raster.tiles import band_windows
 from safe.gis.sanity_check import check_layer
 from safe.utilities.profiling import profile
 from safe.utilities.metadata import (
@@ -24,6 +26,90 @@ __email__ = "info@inasafe.org"
 __revision__ = '$Format:%H$'
 
 
+def make_classifier(ranges):
+    """Prepare sorted threshold edges to reclassify values in a single pass.
+
+    :param ranges: The ranges, key: the class value, value: a list
+        [minimum, maximum] for the interval minimum < value <= maximum.
+        None means there isn't any limit.
+    :type ranges: dict
+
+    :return: A tuple with numpy arrays (upper edges, lower edges, class
+        values) sorted by upper edge and the ranges. Arrays are None if some
+        intervals overlap.
+    :rtype: tuple
+    """
+    intervals = []
+    for value, interval in ranges.iteritems():
+        v_min = -np.inf if interval[0] is None else interval[0]
+        v_max = np.inf if interval[1] is None else interval[1]
+        if v_min < v_max:
+            intervals.append((v_max, v_min, value))
+    intervals.sort()
+
+    for previous, current in zip(intervals, intervals[1:]):
+        if current[1] < previous[0]:
+            # Intervals overlap, the order of the classes matters.
+            return None, None, None, ranges
+
+    upper = np.array([interval[0] for interval in intervals], dtype=float)
+    # The extra edge is used for values above all intervals.
+    lower = np.array(
+        [interval[1] for interval in intervals] + [np.inf], dtype=float)
+    values = np.array(
+        [interval[2] for interval in intervals] + [0])
+    return upper, lower, values, ranges
+
+
+def reclassify_array(source, classifier, no_data=None):
+    """Reclassify an array of values.
+
+    Values which are not in any interval are kept.
+
+    :param source: The values.
+    :type source: numpy.array
+
+    :param classifier: The classifier from make_classifier().
+    :type classifier: tuple
+
+    :param no_data: The no data value in the source.
+    :type no_data: float
+
+    :return: The reclassified values.
+    :rtype: numpy.array
+    """
+    upper, lower, values, ranges = classifier
+    destination = source.copy()
+
+    if upper is None:
+        # Some intervals overlap, we apply each class one by one.
+        for value, interval in ranges.iteritems():
+            v_min = interval[0]
+            v_max = interval[1]
+
+            if v_min is None:
+                destination[np.where(source <= v_max)] = value
+
+            if v_max is None:
+                destination[np.where(source > v_min)] = value
+
+            if v_min < v_max:
+                destination[
+                    np.where((v_min < source) & (source <= v_max))] = value
+    else:
+        # Single pass: the first interval with an upper edge greater or
+        # equal to the value is the only one which can contain the value.
+        index = np.searchsorted(upper, source, side='left')
+        classified = source > lower[index]
+        destination[classified] = values[index[classified]]
+
+    # Tag no data cells
+    if no_data is not None:
+        destination[source == no_data] = no_data_value
+
+    return destination
+
+
 @profile
 def reclassify(layer, exposure_key=None, overwrite_input=False, callback=None):
     """Reclassify a continuous raster layer.
@@ -98,49 +184,53 @@ def reclassify(layer, exposure_key=None, overwrite_input=False, callback=None):
         ranges[hazard_class['value']] = thresholds[hazard_class['key']]
         value_map[hazard_class['key']] = [hazard_class['value']]
 
-    if overwrite_input:
-        output_raster = layer.source()
-    else:
-        output_raster = unique_filename(suffix='.tiff', dir=temp_dir())
+    # We can't overwrite the input while we are reading it by windows.
+    # We write in a temporary file and we replace the input at the end.
+    output_raster = intermediate_filename(suffix='.tiff')
 
     driver = gdal.GetDriverByName('GTiff')
 
     raster_file = gdal.Open(layer.source())
     band = raster_file.GetRasterBand(1)
     no_data = band.GetNoDataValue()
-    source = band.ReadAsArray()
-    destination = source.copy()
-
-    for value, interval in ranges.iteritems():
-        v_min = interval[0]
-        v_max = interval[1]
-
-        if v_min is None:
-            destination[np.where(source <= v_max)] = value
-
-        if v_max is None:
-            destination[np.where(source > v_min)] = value
-
-        if v_min < v_max:
-            destination[np.where((v_min < source) & (source <= v_max))] = value
-
-    # Tag no data cells
-    destination[np.where(source == no_data)] = no_data_value
 
     # Create the new file.
     output_file = driver.Create(
         output_raster, raster_file.RasterXSize, raster_file.RasterYSize, 1)
-    output_file.GetRasterBand(1).WriteArray(destination)
-    output_file.GetRasterBand(1).SetNoDataValue(no_data_value)
+    output_band = output_file.GetRasterBand(1)
+    output_band.SetNoDataValue(no_data_value)
 
     # CRS
     output_file.SetProjection(raster_file.GetProjection())
     output_file.SetGeoTransform(raster_file.GetGeoTransform())
+
+    classifier = make_classifier(ranges)
+
+    # We walk through the raster window by window, so the memory used
+    # doesn't depend on the raster size.
+    for x_offset, y_offset, x_size, y_size in band_windows(band):
+        source = band.ReadAsArray(x_offset, y_offset, x_size, y_size)
+        destination = reclassify_array(source, classifier, no_data)
+        output_band.WriteArray(destination, x_offset, y_offset)
+
     output_file.FlushCache()
 
-    del output_file
+    del output_band, output_file
+    del band, raster_file
+
+    if overwrite_input:
+        in_memory = [is_in_memory(output_raster), is_in_memory(layer.source())]
+        if all(in_memory):
+            gdal.Rename(output_raster, layer.source())
+        elif any(in_memory):
+            # We can't move a file between the memory and the disk.
+            copy_raster(output_raster, layer.source())
+            gdal.Unlink(output_raster)
+        else:
+            move(output_raster, layer.source())
+        output_raster = layer.source()
 
-    if not isfile(output_raster):
+    if not file_exists(output_raster):
         raise FileNotFoundError
 
     reclassified = QgsRasterLayer(output_raster, output_layer_name)
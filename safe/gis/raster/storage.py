@@ -0,0 +1,184 @@
+# coding=utf-8
+
+"""Storage of intermediate files, on the disk or in GDAL memory."""
+
+import logging
+import threading
+from uuid import uuid4
+
+from osgeo import gdal, ogr
+
+from safe.common.utilities import unique_filename, temp_dir
+from safe.definitions.default_settings import inasafe_default_settings
+from safe.utilities.settings import setting
+
+__copyright__ = "Copyright 2016, The InaSAFE Project"
+__license__ = "GPL version 3"
+__email__ = "info@inasafe.org"
+__revision__ = '$Format:%H$'
+
+LOGGER = logging.getLogger('InaSAFE')
+
+memory_storage = 'memory'
+disk_storage = 'disk'
+
+# GDAL virtual file system in memory. It is shared by GDAL, OGR and the QGIS
+# GDAL/OGR providers, but only inside the current process.
+memory_prefix = '/vsimem/'
+
+# Files created in memory outside of an analysis which are not released yet.
+_memory_files = set()
+
+# The active intermediate files of each thread.
+_context = threading.local()
+
+
+class IntermediateFiles(object):
+
+    """Intermediate files created in memory by one analysis.
+
+    It is used as a context manager in the thread running the analysis,
+    files created in memory are added to it. Releasing them doesn't affect
+    files of other analyses in the process::
+
+        files = IntermediateFiles()
+        with files:
+            function_creating_intermediate_files()
+        files.release()
+    """
+
+    def __init__(self):
+        # Files created in memory which are not released yet.
+        self.files = set()
+
+        # Intermediate files active in the thread before these ones.
+        self._previous = []
+
+    def __enter__(self):
+        self._previous.append(getattr(_context, 'files', None))
+        _context.files = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _context.files = self._previous.pop()
+
+    def release(self):
+        """Release the files of the analysis stored in memory.
+
+        Layers using these files must not be used after this call.
+        """
+        _release(self.files)
+
+
+def intermediate_storage():
+    """Get where intermediate files are stored during an analysis.
+
+    :return: 'memory' or 'disk'.
+    :rtype: basestring
+    """
+    default = inasafe_default_settings['intermediate_storage']
+    storage = setting('intermediate_storage', default, str)
+    if storage not in [memory_storage, disk_storage]:
+        storage = default
+    return storage
+
+
+def intermediate_filename(prefix='', suffix='', dir=None):
+    """Create a new file name for an intermediate file.
+
+    If intermediate files are stored in memory, the file name is in the GDAL
+    /vsimem/ file system. Otherwise, it's a file name from unique_filename.
+
+    :param prefix: The prefix of the file name.
+    :type prefix: basestring
+
+    :param suffix: The suffix of the file name, such as '.tif'.
+    :type suffix: basestring
+
+    :param dir: The directory to use if files are stored on the disk.
+        Default to the temporary directory.
+    :type dir: basestring
+
+    :return: The file name.
+    :rtype: basestring
+    """
+    if intermediate_storage() == memory_storage:
+        filename = '%s%s%s%s' % (memory_prefix, prefix, uuid4().hex, suffix)
+        files = getattr(_context, 'files', None)
+        if files is None:
+            _memory_files.add(filename)
+        else:
+            files.files.add(filename)
+        return filename
+
+    if not dir:
+        dir = temp_dir()
+    return unique_filename(prefix=prefix, suffix=suffix, dir=dir)
+
+
+def is_in_memory(filename):
+    """Check if a file name is in the GDAL /vsimem/ file system.
+
+    :param filename: The file name.
+    :type filename: basestring
+
+    :return: True if the file is in memory.
+    :rtype: bool
+    """
+    return filename.startswith(memory_prefix)
+
+
+def file_exists(filename):
+    """Check if a file exists, on the disk or in memory.
+
+    :param filename: The file name.
+    :type filename: basestring
+
+    :return: True if the file exists.
+    :rtype: bool
+    """
+    return gdal.VSIStatL(filename) is not None
+
+
+def copy_raster(source, destination):
+    """Copy a raster, from or to the memory, as a GeoTIFF.
+
+    :param source: The file name of the raster.
+    :type source: basestring
+
+    :param destination: The file name of the copy.
+    :type destination: basestring
+    """
+    dataset = gdal.Open(source)
+    copy = gdal.GetDriverByName('GTiff').CreateCopy(destination, dataset)
+    copy.FlushCache()
+    del copy, dataset
+
+
+def release_intermediate_files():
+    """Release intermediate files stored in memory outside of an analysis.
+
+    Layers using these files must not be used after this call. Files created
+    by an analysis are released with IntermediateFiles.release.
+    """
+    _release(_memory_files)
+
+
+def _release(filenames):
+    """Release files stored in memory.
+
+    :param filenames: The files, the set is emptied.
+    :type filenames: set
+    """
+    for filename in filenames:
+        if filename.endswith('.shp'):
+            driver = ogr.GetDriverByName('ESRI Shapefile')
+            if file_exists(filename):
+                driver.DeleteDataSource(filename)
+        else:
+            # GDAL or QGIS may have written statistics next to the raster.
+            for path in [filename, filename + '.aux.xml']:
+                if file_exists(path):
+                    gdal.Unlink(path)
+    LOGGER.info('%s intermediate files released' % len(filenames))
+    filenames.clear()
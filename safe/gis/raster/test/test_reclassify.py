@@ -8,10 +8,13 @@ from safe.test.utilities import (
     load_test_raster_layer)
 QGIS_APP, CANVAS, IFACE, PARENT = get_qgis_app()
 
+import numpy as np
 from qgis.core import QgsRasterBandStats
 
+from safe.definitions.constants import no_data_value
 from safe.definitions.processing_steps import reclassify_raster_steps
-from safe.gis.raster.reclassify import reclassify
+from safe.gis.raster.reclassify import (
+    reclassify, make_classifier, reclassify_array)
 from safe.definitions.exposure import exposure_structure
 from safe.definitions.hazard_classifications import generic_hazard_classes
 
@@ -75,3 +78,43 @@ class TestReclassifyRaster(unittest.TestCase):
             1, QgsRasterBandStats.Min | QgsRasterBandStats.Max)
         self.assertEqual(stats.minimumValue, 1.0)
         self.assertEqual(stats.maximumValue, 3.0)
+
+    def test_reclassify_array(self):
+        """Test we can reclassify an array in a single pass."""
+        source = np.array([
+            [-1, 0.2, 0.3, 1],
+            [5, 6, -9999, 0.5]])
+
+        ranges = {
+            1: [None, 0.2],
+            2: [0.2, 1],
+            3: [1, None],
+        }
+        expected = np.array([
+            [1, 1, 2, 2],
+            [3, 3, no_data_value, 2]])
+        result = reclassify_array(source, make_classifier(ranges), -9999)
+        self.assertTrue(np.array_equal(expected, result))
+
+        # Values which are not in any interval are kept.
+        ranges = {
+            1: [0, 0.5],
+            2: [0.5, 5],
+        }
+        expected = np.array([
+            [-1, 1, 1, 2],
+            [2, 6, no_data_value, 1]])
+        result = reclassify_array(source, make_classifier(ranges), -9999)
+        self.assertTrue(np.array_equal(expected, result))
+
+        # With overlapping intervals, the order of classes is used.
+        ranges = {
+            1: [0, 1],
+            2: [0.4, 5],
+        }
+        self.assertIsNone(make_classifier(ranges)[0])
+        expected = np.array([
+            [-1, 1, 1, 2],
+            [2, 6, no_data_value, 2]])
+        result = reclassify_array(source, make_classifier(ranges), -9999)
+        self.assertTrue(np.array_equal(expected, result))
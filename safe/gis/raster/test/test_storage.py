@@ -0,0 +1,81 @@
+# coding=utf-8
+"""Test intermediate storage."""
+
+import unittest
+
+from safe.test.utilities import get_qgis_app, load_test_raster_layer
+QGIS_APP, CANVAS, IFACE, PARENT = get_qgis_app()
+
+from safe.gis.raster.storage import (
+    intermediate_filename,
+    is_in_memory,
+    file_exists,
+    copy_raster,
+    release_intermediate_files,
+    IntermediateFiles,
+)
+from safe.utilities.settings import set_setting, delete_setting
+
+__copyright__ = "Copyright 2016, The InaSAFE Project"
+__license__ = "GPL version 3"
+__email__ = "info@inasafe.org"
+__revision__ = '$Format:%H$'
+
+
+class TestIntermediateStorage(unittest.TestCase):
+
+    """Test intermediate storage."""
+
+    def tearDown(self):
+        delete_setting('intermediate_storage')
+
+    def test_memory_storage(self):
+        """Test intermediate files in memory are released."""
+        set_setting('intermediate_storage', 'memory')
+        layer = load_test_raster_layer(
+            'hazard', 'continuous_flood_20_20.asc')
+
+        filename = intermediate_filename(suffix='.tif')
+        self.assertTrue(is_in_memory(filename))
+        self.assertFalse(file_exists(filename))
+
+        copy_raster(layer.source(), filename)
+        self.assertTrue(file_exists(filename))
+
+        release_intermediate_files()
+        self.assertFalse(file_exists(filename))
+
+    def test_analysis_files(self):
+        """Test intermediate files are released for one analysis only."""
+        set_setting('intermediate_storage', 'memory')
+        layer = load_test_raster_layer(
+            'hazard', 'continuous_flood_20_20.asc')
+
+        first, second = IntermediateFiles(), IntermediateFiles()
+        with first:
+            first_filename = intermediate_filename(suffix='.tif')
+        with second:
+            second_filename = intermediate_filename(suffix='.tif')
+        copy_raster(layer.source(), first_filename)
+        copy_raster(layer.source(), second_filename)
+
+        first.release()
+        self.assertFalse(file_exists(first_filename))
+        self.assertTrue(file_exists(second_filename))
+
+        # Files of an analysis are not released with files outside of it.
+        release_intermediate_files()
+        self.assertTrue(file_exists(second_filename))
+        second.release()
+        self.assertFalse(file_exists(second_filename))
+
+    def test_disk_storage(self):
+        """Test intermediate files on the disk."""
+        set_setting('intermediate_storage', 'disk')
+        filename = intermediate_filename(suffix='.tif')
+        self.assertFalse(is_in_memory(filename))
+        self.assertTrue(filename.endswith('.tif'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+# coding=utf-8
+"""Test raster windows."""
+
+import unittest
+
+from safe.gis.raster.tiles import windows
+
+__copyright__ = "Copyright 2016, The InaSAFE Project"
+__license__ = "GPL version 3"
+__email__ = "info@inasafe.org"
+__revision__ = '$Format:%H$'
+
+
+class TestRasterTiles(unittest.TestCase):
+
+    """Test raster windows."""
+
+    def test_windows_cover_the_raster(self):
+        """Test windows cover each pixel once."""
+        for block_x_size, block_y_size in [(100, 1), (16, 16), (7, 3)]:
+            pixels = set()
+            for x_offset, y_offset, x_size, y_size in windows(
+                    100, 45, block_x_size, block_y_size, 10):
+                for row in xrange(y_offset, y_offset + y_size):
+                    for column in xrange(x_offset, x_offset + x_size):
+                        self.assertNotIn((row, column), pixels)
+                        pixels.add((row, column))
+            self.assertEqual(len(pixels), 100 * 45)
+
+    def test_windows_aligned_to_blocks(self):
+        """Test windows are aligned to the GDAL block size."""
+        # Strips: a window is a group of full width strips.
+        result = list(windows(100, 10, 100, 1, 20))
+        self.assertEqual(
+            result,
+            [(0, 0, 100, 4), (0, 4, 100, 4), (0, 8, 100, 2)])
+
+        # Square blocks: a window is a group of blocks.
+        result = list(windows(50, 30, 16, 16, 40))
+        self.assertEqual(
+            result,
+            [(0, 0, 32, 30), (32, 0, 18, 30)])
+
+        # A window is never smaller than a block.
+        result = list(windows(50, 30, 16, 16, 1))
+        self.assertEqual(result[0], (0, 0, 16, 16))
+        self.assertEqual(len(result), 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+# coding=utf-8
+
+"""Walk a raster by windows so memory does not depend on the raster size."""
+
+from safe.definitions.default_settings import inasafe_default_settings
+from safe.utilities.settings import setting
+
+__copyright__ = "Copyright 2016, The InaSAFE Project"
+__license__ = "GPL version 3"
+__email__ = "info@inasafe.org"
+__revision__ = '$Format:%H$'
+
+
+def raster_tile_size():
+    """Get the tile size in pixels to use when processing rasters.
+
+    :return: The width and height of a tile in pixels.
+    :rtype: int
+    """
+    default = inasafe_default_settings['raster_tile_size']
+    tile_size = setting('raster_tile_size', default, int)
+    if tile_size <= 0:
+        tile_size = default
+    return tile_size
+
+
+def windows(x_size, y_size, block_x_size, block_y_size, tile_size):
+    """Split a raster into windows aligned to its GDAL block size.
+
+    A window holds about tile_size x tile_size pixels. If blocks are strips
+    covering the full width of the raster, a window will be a group of
+    strips. Otherwise, the window is a square group of blocks. Windows are
+    never smaller than a single block.
+
+    :param x_size: The width of the raster in pixels.
+    :type x_size: int
+
+    :param y_size: The height of the raster in pixels.
+    :type y_size: int
+
+    :param block_x_size: The width of a GDAL block.
+    :type block_x_size: int
+
+    :param block_y_size: The height of a GDAL block.
+    :type block_y_size: int
+
+    :param tile_size: The size of the window in pixels.
+    :type tile_size: int
+
+    :return: Generator of tuples (x_offset, y_offset, x_size, y_size), row by
+        row, from the top left corner.
+    :rtype: generator
+    """
+    block_x_size = max(1, min(block_x_size, x_size))
+    block_y_size = max(1, min(block_y_size, y_size))
+
+    if block_x_size >= x_size:
+        window_x_size = x_size
+        rows = (tile_size * tile_size) // x_size
+        window_y_size = max(
+            block_y_size, rows // block_y_size * block_y_size)
+    else:
+        window_x_size = max(
+            block_x_size, tile_size // block_x_size * block_x_size)
+        window_y_size = max(
+            block_y_size, tile_size // block_y_size * block_y_size)
+
+    for y_offset in xrange(0, y_size, window_y_size):
+        height = min(window_y_size, y_size - y_offset)
+        for x_offset in xrange(0, x_size, window_x_size):
+            width = min(window_x_size, x_size - x_offset)
+            yield x_offset, y_offset, width, height
+
+
+def band_windows(band, tile_size=None):
+    """Split a GDAL band into windows aligned to its block size.
+
+    :param band: The GDAL band.
+    :type band: gdal.Band
+
+    :param tile_size: The size of the window in pixels. Default to the
+        raster_tile_size setting.
+    :type tile_size: int
+
+    :return: Generator of tuples (x_offset, y_offset, x_size, y_size).
+    :rtype: generator
+    """
+    if not tile_size:
+        tile_size = raster_tile_size()
+    block_x_size, block_y_size = band.GetBlockSize()
+    return windows(
+        band.XSize, band.YSize, block_x_size, block_y_size, tile_size)
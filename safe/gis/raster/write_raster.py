@@ -78,6 +78,40 @@ def array_to_raster(array, destination_filename, other_layer):
     return raster
 
 
+def empty_raster_like(destination_filename, other_layer):
+    """Create an empty raster TIF file we can later fill by windows.
+
+    The geo metadata and the size will be the same as the other given QGIS
+    raster layer, like in array_to_raster().
+
+    :param destination_filename: The destination file name.
+    :type destination_filename: basestring
+
+    :param other_layer: The other layer.
+    :type other_layer: QgsRasterLayer
+
+    :return: The new GDAL dataset, opened for writing.
+    :rtype: GDALDataset
+    """
+    provider = other_layer.dataProvider()
+    top_left = (
+        other_layer.extent().xMinimum(), other_layer.extent().yMaximum())
+    pixel_size = other_layer.extent().width() / provider.xSize()
+    wkt_projection = str(other_layer.crs().toWkt())
+
+    driver = gdal.GetDriverByName('GTiff')
+    dataset = driver.Create(
+        destination_filename,
+        provider.xSize(),
+        provider.ySize(),
+        1,
+        gdal.GDT_Float32, )
+    dataset.SetGeoTransform(
+        (top_left[0], pixel_size, 0, top_left[1], 0, -pixel_size))
+    dataset.SetProjection(wkt_projection)
+    return dataset
+
+
 def make_array(width, height):
     """Create a numpy array we can later use in array_to_raster() method.
 
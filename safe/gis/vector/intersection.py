@@ -6,7 +6,6 @@ import logging
 from qgis.core import (
     QGis,
     QgsGeometry,
-    QgsFeatureRequest,
     QgsWKBTypes,
     QgsFeature,
 )
@@ -16,6 +15,16 @@ from safe.definitions.layer_purposes import layer_purpose_exposure_summary
 from safe.definitions.processing_steps import intersection_steps
 from safe.gis.vector.tools import (
     create_memory_layer, wkb_type_groups, create_spatial_index)
+from safe.gis.vector.parallel import (
+    vector_workers,
+    vector_partition_size,
+    geometry_to_wkb,
+    geometry_from_wkb,
+    picklable_attributes,
+    bounding_box,
+    spatial_partitions,
+    run_partitions,
+)
 from safe.gis.sanity_check import check_layer
 from safe.utilities.profiling import profile
 
@@ -71,63 +80,39 @@ def intersection(source, mask, callback=None):
 
     writer.startEditing()
 
-    # Begin copy/paste from Processing plugin.
-    # Please follow their code as their code is optimized.
-    # The code below is not following our coding standards because we want to
-    # be able to track any diffs from QGIS easily.
-
-    out_feature = QgsFeature()
     index = create_spatial_index(mask)
+    workers = vector_workers()
 
-    # Todo callback
-    # total = 100.0 / len(selectionA)
+    if workers > 1:
+        _parallel_intersection(
+            source, mask, index, writer, workers, vector_partition_size())
+    else:
+        # cache features from mask layer for faster retrieval
+        mask_features = {}
+        for feature_mask in mask.getFeatures():
+            mask_features[feature_mask.id()] = (
+                QgsGeometry(feature_mask.geometry()),
+                feature_mask.attributes())
 
-    for current, in_feature in enumerate(source.getFeatures()):
-        # progress.setPercentage(int(current * total))
-        geom = in_feature.geometry()
-        attributes = in_feature.attributes()
-        intersects = index.intersects(geom.boundingBox())
-        for i in intersects:
-            request = QgsFeatureRequest().setFilterFid(i)
-            feature_mask = next(mask.getFeatures(request))
-            tmp_geom = feature_mask.geometry()
-            if geom.intersects(tmp_geom):
-                mask_attributes = feature_mask.attributes()
-                int_geom = QgsGeometry(geom.intersection(tmp_geom))
-                if int_geom.wkbType() == QgsWKBTypes.Unknown\
-                        or QgsWKBTypes.flatType(
-                        int_geom.geometry().wkbType()) ==\
-                                QgsWKBTypes.GeometryCollection:
-                    int_com = geom.combine(tmp_geom)
-                    int_geom = QgsGeometry()
-                    if int_com:
-                        int_sym = geom.symDifference(tmp_geom)
-                        int_geom = QgsGeometry(int_com.difference(int_sym))
-                if int_geom.isGeosEmpty() or not int_geom.isGeosValid():
-                    # LOGGER.debug(
-                    #     tr('GEOS geoprocessing error: One or more input '
-                    #        'features have invalid geometry.'))
-                    pass
-                try:
-                    geom_types = wkb_type_groups[
-                        wkb_type_groups[int_geom.wkbType()]]
-                    if int_geom.wkbType() in geom_types:
-                        if int_geom.type() == source.geometryType():
-                            # We got some features which have not the same
-                            # kind of geometry. We want to skip them.
-                            out_feature.setGeometry(int_geom)
-                            attrs = []
-                            attrs.extend(attributes)
-                            attrs.extend(mask_attributes)
-                            out_feature.setAttributes(attrs)
-                            writer.addFeature(out_feature)
-                except:
-                    LOGGER.debug(
-                        tr('Feature geometry error: One or more output '
-                           'features ignored due to invalid geometry.'))
-                    continue
+        # prepared geometries of the mask, created only if needed
+        mask_engines = {}
+
+        out_feature = QgsFeature()
+        for in_feature in source.getFeatures():
+            geom = in_feature.geometry()
+            intersects = index.intersects(geom.boundingBox())
+            outputs = _intersect_feature(
+                geom,
+                in_feature.attributes(),
+                intersects,
+                mask_features,
+                mask_engines,
+                source.geometryType())
+            for int_geom, attrs in outputs:
+                out_feature.setGeometry(int_geom)
+                out_feature.setAttributes(attrs)
+                writer.addFeature(out_feature)
 
-    # End copy/paste from Processing plugin.
     writer.commitChanges()
 
     writer.keywords = dict(source.keywords)
@@ -142,3 +127,180 @@ def intersection(source, mask, callback=None):
 
     check_layer(writer)
     return writer
+
+
+def _intersect_feature(
+        geom, attributes, intersects, mask_features, mask_engines,
+        geometry_type):
+    """Intersect a feature with the mask features found by the index.
+
+    :param geom: The geometry of the source feature.
+    :type geom: QgsGeometry
+
+    :param attributes: The attributes of the source feature.
+    :type attributes: list
+
+    :param intersects: IDs of the mask features found by the spatial index.
+    :type intersects: list
+
+    :param mask_features: Mask features, key: ID, value: tuple (geometry,
+        attributes).
+    :type mask_features: dict
+
+    :param mask_engines: Prepared geometries of the mask, key: ID, value:
+        the geometry engine. It's filled when a new mask feature is used.
+    :type mask_engines: dict
+
+    :param geometry_type: The geometry type of the output.
+    :type geometry_type: QGis.GeometryType
+
+    :return: List of tuples (geometry, attributes) to write.
+    :rtype: list
+    """
+    outputs = []
+
+    # Begin copy/paste from Processing plugin.
+    # Please follow their code as their code is optimized.
+    # The code below is not following our coding standards because we want to
+    # be able to track any diffs from QGIS easily.
+
+    for i in intersects:
+        tmp_geom, mask_attributes = mask_features[i]
+
+        # use prepared geometry: makes multiple intersection tests faster
+        engine = mask_engines.get(i)
+        if engine is None:
+            engine = QgsGeometry.createGeometryEngine(tmp_geom.geometry())
+            engine.prepareGeometry()
+            mask_engines[i] = engine
+
+        if engine.intersects(geom.geometry()):
+            int_geom = QgsGeometry(geom.intersection(tmp_geom))
+            if int_geom.wkbType() == QgsWKBTypes.Unknown\
+                    or QgsWKBTypes.flatType(
+                    int_geom.geometry().wkbType()) ==\
+                            QgsWKBTypes.GeometryCollection:
+                int_com = geom.combine(tmp_geom)
+                int_geom = QgsGeometry()
+                if int_com:
+                    int_sym = geom.symDifference(tmp_geom)
+                    int_geom = QgsGeometry(int_com.difference(int_sym))
+            if int_geom.isGeosEmpty() or not int_geom.isGeosValid():
+                # LOGGER.debug(
+                #     tr('GEOS geoprocessing error: One or more input '
+                #        'features have invalid geometry.'))
+                pass
+            try:
+                geom_types = wkb_type_groups[
+                    wkb_type_groups[int_geom.wkbType()]]
+                if int_geom.wkbType() in geom_types:
+                    if int_geom.type() == geometry_type:
+                        # We got some features which have not the same
+                        # kind of geometry. We want to skip them.
+                        attrs = []
+                        attrs.extend(attributes)
+                        attrs.extend(mask_attributes)
+                        outputs.append((int_geom, attrs))
+            except:
+                LOGGER.debug(
+                    tr('Feature geometry error: One or more output '
+                       'features ignored due to invalid geometry.'))
+                continue
+
+    # End copy/paste from Processing plugin.
+
+    return outputs
+
+
+def _intersection_partition(task):
+    """Intersect a partition of the source layer in a process of the pool.
+
+    :param task: Tuple with source features (position, WKB, attributes, IDs
+        of mask features found by the index), mask features (ID, WKB,
+        attributes) and the geometry type of the output.
+    :type task: tuple
+
+    :return: List of tuples (position, list of (WKB, attributes)).
+    :rtype: list
+    """
+    source_features, mask_features, geometry_type = task
+    mask_features = dict(
+        (i, (geometry_from_wkb(wkb), attributes))
+        for i, wkb, attributes in mask_features)
+    mask_engines = {}
+
+    results = []
+    for position, wkb, attributes, intersects in source_features:
+        outputs = _intersect_feature(
+            geometry_from_wkb(wkb),
+            attributes,
+            intersects,
+            mask_features,
+            mask_engines,
+            geometry_type)
+        results.append((position, [
+            (geometry_to_wkb(int_geom), picklable_attributes(attrs))
+            for int_geom, attrs in outputs]))
+    return results
+
+
+def _parallel_intersection(
+        source, mask, index, writer, workers, partition_size):
+    """Intersect two layers by spatial partitions with a process pool.
+
+    Source features are split in spatial partitions. Each partition is sent
+    with the mask features it needs. Features are written in the same order
+    as without the process pool.
+
+    :param source: The vector layer to clip.
+    :type source: QgsVectorLayer
+
+    :param mask: The vector layer to use for clipping.
+    :type mask: QgsVectorLayer
+
+    :param index: The spatial index of the mask layer.
+    :type index: QgsSpatialIndex
+
+    :param writer: The output layer, in editing mode.
+    :type writer: QgsVectorLayer
+
+    :param workers: The number of processes.
+    :type workers: int
+
+    :param partition_size: The number of source features in a partition.
+    :type partition_size: int
+    """
+    mask_features = {}
+    for feature_mask in mask.getFeatures():
+        mask_features[feature_mask.id()] = (
+            geometry_to_wkb(feature_mask.geometry()),
+            picklable_attributes(feature_mask.attributes()))
+
+    items = []
+    for position, in_feature in enumerate(source.getFeatures()):
+        geom = in_feature.geometry()
+        intersects = index.intersects(geom.boundingBox())
+        if not intersects:
+            continue
+        payload = (
+            geometry_to_wkb(geom),
+            picklable_attributes(in_feature.attributes()),
+            intersects)
+        items.append((position, bounding_box(geom), payload))
+
+    tasks = []
+    for partition in spatial_partitions(items, partition_size):
+        needed = sorted(set(
+            i for item in partition for i in item[2][2]))
+        tasks.append((
+            [(item[0], ) + item[2] for item in partition],
+            [(i, ) + mask_features[i] for i in needed],
+            source.geometryType()))
+
+    out_feature = QgsFeature()
+    for position, outputs in run_partitions(
+            _intersection_partition, tasks, workers):
+        for wkb, attrs in outputs:
+            out_feature.setGeometry(geometry_from_wkb(wkb))
+            out_feature.setAttributes(attrs)
+            writer.addFeature(out_feature)
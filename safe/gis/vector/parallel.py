@@ -0,0 +1,219 @@
+# coding=utf-8
+
+"""Run a vector algorithm on spatial partitions with a process pool."""
+
+import logging
+import sys
+from multiprocessing import Pool, forking
+
+from PyQt4.QtCore import QPyNullVariant
+from qgis.core import QgsGeometry
+from qgis.utils import iface
+
+from safe.definitions.default_settings import inasafe_default_settings
+from safe.utilities.settings import setting
+
+__copyright__ = "Copyright 2016, The InaSAFE Project"
+__license__ = "GPL version 3"
+__email__ = "info@inasafe.org"
+__revision__ = '$Format:%H$'
+
+LOGGER = logging.getLogger('InaSAFE')
+
+# Precision of the grid used to sort features along a Z-order curve.
+_grid_bits = 16
+
+
+def process_pool_available():
+    """Check if a process pool can be started from this process.
+
+    Headless, processes are forked or spawned from a Python interpreter.
+    In QGIS desktop, a fork would copy the Qt application and a spawned
+    process would start QGIS again, so we need a Python interpreter set
+    with multiprocessing.set_executable(), which is only available on
+    Windows.
+
+    :return: True if a process pool can be used.
+    :rtype: bool
+    """
+    if iface is None:
+        return True
+    if sys.platform == 'win32':
+        return forking._python_exe != sys.executable
+    return False
+
+
+def vector_workers():
+    """Get the number of processes to use for intersection and union.
+
+    :return: The number of processes. 1 means no process pool.
+    :rtype: int
+    """
+    default = inasafe_default_settings['vector_workers']
+    workers = max(1, setting('vector_workers', default, int))
+    if workers > 1 and not process_pool_available():
+        LOGGER.info(
+            'No process pool in QGIS desktop, vector_workers is ignored.')
+        return 1
+    return workers
+
+
+def vector_partition_size():
+    """Get the number of features in a partition sent to a process.
+
+    :return: The number of features.
+    :rtype: int
+    """
+    default = inasafe_default_settings['vector_partition_size']
+    partition_size = setting('vector_partition_size', default, int)
+    if partition_size <= 0:
+        partition_size = default
+    return partition_size
+
+
+def geometry_to_wkb(geometry):
+    """Export a geometry to WKB so it can be sent to another process.
+
+    :param geometry: The geometry.
+    :type geometry: QgsGeometry
+
+    :return: The WKB.
+    :rtype: str
+    """
+    return bytes(geometry.asWkb())
+
+
+def geometry_from_wkb(wkb):
+    """Create a geometry from WKB received from another process.
+
+    :param wkb: The WKB.
+    :type wkb: str
+
+    :return: The geometry.
+    :rtype: QgsGeometry
+    """
+    geometry = QgsGeometry()
+    geometry.fromWkb(wkb)
+    return geometry
+
+
+def picklable_attributes(attributes):
+    """Replace null values so attributes can be sent to another process.
+
+    :param attributes: The attributes of a feature.
+    :type attributes: list
+
+    :return: The attributes, with None instead of QPyNullVariant.
+    :rtype: list
+    """
+    return [
+        None if isinstance(value, QPyNullVariant) else value
+        for value in attributes]
+
+
+def _z_order(x, y):
+    """Interleave the bits of two grid coordinates.
+
+    :param x: The column in the grid.
+    :type x: int
+
+    :param y: The row in the grid.
+    :type y: int
+
+    :return: The position on the Z-order curve.
+    :rtype: int
+    """
+    key = 0
+    for bit in xrange(_grid_bits):
+        key |= ((x >> bit) & 1) << (2 * bit)
+        key |= ((y >> bit) & 1) << (2 * bit + 1)
+    return key
+
+
+def spatial_partitions(items, partition_size):
+    """Split items in spatially compact partitions.
+
+    Items are sorted along a Z-order curve using the center of their bounding
+    box, then cut in partitions of partition_size items. The result only
+    depends on the items, not on the number of processes.
+
+    :param items: List of tuples (position, bounding box, payload). The
+        bounding box is a tuple (x_min, y_min, x_max, y_max).
+    :type items: list
+
+    :param partition_size: The maximum number of items in a partition.
+    :type partition_size: int
+
+    :return: List of partitions, each partition is a list of items.
+    :rtype: list
+    """
+    if not items:
+        return []
+
+    x_min = min(item[1][0] for item in items)
+    y_min = min(item[1][1] for item in items)
+    x_max = max(item[1][2] for item in items)
+    y_max = max(item[1][3] for item in items)
+    cells = (1 << _grid_bits) - 1
+    width = (x_max - x_min) or 1.0
+    height = (y_max - y_min) or 1.0
+
+    def key(item):
+        """Sort key of an item."""
+        position, box = item[0], item[1]
+        x = ((box[0] + box[2]) / 2.0 - x_min) / width
+        y = ((box[1] + box[3]) / 2.0 - y_min) / height
+        return _z_order(int(x * cells), int(y * cells)), position
+
+    items = sorted(items, key=key)
+    return [
+        items[i:i + partition_size]
+        for i in xrange(0, len(items), partition_size)]
+
+
+def run_partitions(worker, tasks, workers):
+    """Run a worker function on each task with a process pool.
+
+    The worker must be a module level function returning a list of tuples
+    (position, result). Results of all tasks are merged and sorted by
+    position, so the output is the same whatever the number of processes.
+
+    :param worker: The function to run on each task.
+    :type worker: function
+
+    :param tasks: The tasks, they must be picklable.
+    :type tasks: list
+
+    :param workers: The number of processes.
+    :type workers: int
+
+    :return: The merged list of (position, result) sorted by position.
+    :rtype: list
+    """
+    LOGGER.info(
+        'Running %s on %s partitions with %s processes' % (
+            worker.__name__, len(tasks), workers))
+    pool = Pool(processes=workers)
+    try:
+        results = pool.map(worker, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    merged = [item for result in results for item in result]
+    merged.sort(key=lambda item: item[0])
+    return merged
+
+
+def bounding_box(geometry):
+    """Get the bounding box of a geometry as a tuple.
+
+    :param geometry: The geometry.
+    :type geometry: QgsGeometry
+
+    :return: Tuple (x_min, y_min, x_max, y_max).
+    :rtype: tuple
+    """
+    box = geometry.boundingBox()
+    return (
+        box.xMinimum(), box.yMinimum(), box.xMaximum(), box.yMaximum())
@@ -26,10 +26,14 @@ from safe.definitions.processing_steps import (
 from safe.definitions.utilities import definition
 from safe.definitions.hazard_classifications import not_exposed_class
 from safe.gis.vector.summary_tools import (
-    check_inputs, create_absolute_values_structure, add_fields)
+    check_inputs,
+    create_absolute_values_structure,
+    add_fields,
+    layer_rows,
+    write_values,
+    SummaryAccumulator)
 from safe.gis.sanity_check import check_layer
 from safe.utilities.profiling import profile
-from safe.utilities.pivot_table import FlatTable
 from safe.utilities.i18n import tr
 
 __copyright__ = "Copyright 2016, The InaSAFE Project"
@@ -106,6 +110,7 @@ def aggregate_hazard_summary(impact, aggregate_hazard, callback=None):
 
     fields = ['aggregation_id', 'hazard_id']
     absolute_values = create_absolute_values_structure(impact, fields)
+    absolute_indexes = absolute_values.keys()
 
     # We need to know what kind of exposure we are going to count.
     # the size, or the number of features or population.
@@ -121,83 +126,94 @@ def aggregate_hazard_summary(impact, aggregate_hazard, callback=None):
         unique_exposure,
         exposure_count_field
     )
+    aggregate_hazard.commitChanges()
+
+    # A single pass on the impact, values are summed by the accumulator.
+    accumulator = SummaryAccumulator(len(absolute_indexes))
 
-    flat_table = FlatTable('aggregation_id', 'hazard_id', 'exposure_class')
+    aggregation_index = impact.fieldNameIndex(aggregation_id)
+    hazard_index = impact.fieldNameIndex(hazard_id)
+    subset = [aggregation_index, hazard_index, exposure_class_index]
+    subset.extend(absolute_indexes)
+    if field_index is not None:
+        subset.append(field_index)
 
     request = QgsFeatureRequest()
     request.setFlags(QgsFeatureRequest.NoGeometry)
+    request.setSubsetOfAttributes(subset)
     LOGGER.debug('Computing the aggregate hazard summary.')
     for feature in impact.getFeatures(request):
+        attributes = feature.attributes()
+
         # Field_index can be equal to 0.
         if field_index is not None:
-            value = feature[field_index]
+            value = attributes[field_index]
         else:
             value = 1
 
-        aggregation_value = feature[aggregation_id]
-        hazard_value = feature[hazard_id]
+        aggregation_value = attributes[aggregation_index]
+        hazard_value = attributes[hazard_index]
         if not hazard_value or isinstance(hazard_value, QPyNullVariant):
             hazard_value = not_exposed_class['key']
-        exposure_value = feature[exposure_class]
+        exposure_value = attributes[exposure_class_index]
         if not exposure_value or isinstance(exposure_value, QPyNullVariant):
             exposure_value = 'NULL'
 
-        flat_table.add_value(
+        # We summarize every absolute values.
+        absolute_values_feature = []
+        for field in absolute_indexes:
+            absolute_value = attributes[field]
+            if not absolute_value or isinstance(
+                    absolute_value, QPyNullVariant):
+                absolute_value = 0
+            absolute_values_feature.append(absolute_value)
+
+        accumulator.add(
+            aggregation_value,
+            hazard_value,
+            exposure_value,
             value,
-            aggregation_id=aggregation_value,
-            hazard_id=hazard_value,
-            exposure_class=exposure_value
-        )
+            absolute_values_feature)
 
-        # We summarize every absolute values.
-        for field, field_definition in absolute_values.iteritems():
-            value = feature[field]
-            if not value or isinstance(value, QPyNullVariant):
-                value = 0
-            field_definition[0].add_value(
-                value,
-                aggregation_id=aggregation_value,
-                hazard_id=hazard_value
-            )
+    accumulator.reduce()
 
     hazard_keywords = aggregate_hazard.keywords['hazard_keywords']
     classification = hazard_keywords['classification']
 
-    for area in aggregate_hazard.getFeatures(request):
-        aggregation_value = area[aggregation_id]
-        feature_hazard_id = area[hazard_id]
+    aggregation_index = aggregate_hazard.fieldNameIndex(aggregation_id)
+    hazard_index = aggregate_hazard.fieldNameIndex(hazard_id)
+    hazard_class_index = aggregate_hazard.fieldNameIndex(hazard_class)
+
+    changes = {}
+    for area_id, area in layer_rows(aggregate_hazard):
+        aggregation_value = area[aggregation_index]
+        feature_hazard_id = area[hazard_index]
         if not feature_hazard_id or isinstance(
                 feature_hazard_id, QPyNullVariant):
             feature_hazard_id = not_exposed_class['key']
-        feature_hazard_value = area[hazard_class]
+        feature_hazard_value = area[hazard_class_index]
+
+        values = {}
         total = 0
         for i, val in enumerate(unique_exposure):
-            sum = flat_table.get_value(
-                aggregation_id=aggregation_value,
-                hazard_id=feature_hazard_id,
-                exposure_class=val
-            )
+            sum = accumulator.value(aggregation_value, feature_hazard_id, val)
             total += sum
-            aggregate_hazard.changeAttributeValue(area.id(), shift + i, sum)
+            values[shift + i] = sum
 
         affected = post_processor_affected_function(
             classification=classification, hazard_class=feature_hazard_value)
-        affected = tr(unicode(affected))
-        aggregate_hazard.changeAttributeValue(
-            area.id(), shift + len(unique_exposure), affected)
+        values[shift + len(unique_exposure)] = tr(unicode(affected))
 
-        aggregate_hazard.changeAttributeValue(
-            area.id(), shift + len(unique_exposure) + 1, total)
+        values[shift + len(unique_exposure) + 1] = total
 
-        for i, field in enumerate(absolute_values.itervalues()):
-            value = field[0].get_value(
-                aggregation_id=aggregation_value,
-                hazard_id=feature_hazard_id
-            )
-            aggregate_hazard.changeAttributeValue(
-                area.id(), shift + len(unique_exposure) + 2 + i, value)
+        for i in xrange(len(absolute_indexes)):
+            values[shift + len(unique_exposure) + 2 + i] = (
+                accumulator.absolute_value(
+                    aggregation_value, feature_hazard_id, i))
 
-    aggregate_hazard.commitChanges()
+        changes[area_id] = values
+
+    write_values(aggregate_hazard, changes)
 
     aggregate_hazard.keywords['title'] = (
         layer_purpose_aggregate_hazard_impacted['name'])
@@ -3,7 +3,7 @@
 """Aggregate the aggregate hazard to the aggregation layer."""
 
 from PyQt4.QtCore import QPyNullVariant
-from qgis.core import QGis, QgsFeatureRequest
+from qgis.core import QGis
 
 from safe.definitions.fields import (
     aggregation_id_field,
@@ -21,10 +21,14 @@ from safe.definitions.processing_steps import (
     summary_2_aggregation_steps)
 from safe.gis.vector.tools import read_dynamic_inasafe_field
 from safe.gis.vector.summary_tools import (
-    check_inputs, create_absolute_values_structure, add_fields)
+    check_inputs,
+    create_absolute_values_structure,
+    add_fields,
+    layer_rows,
+    write_values)
 from safe.gis.sanity_check import check_layer
 from safe.utilities.profiling import profile
-from safe.utilities.pivot_table import FlatTable
+from safe.utilities.pivot_table import ArrayFlatTable
 from safe.utilities.i18n import tr
 
 __copyright__ = "Copyright 2016, The InaSAFE Project"
@@ -34,7 +38,8 @@ __revision__ = '$Format:%H$'
 
 
 @profile
-def aggregation_summary(aggregate_hazard, aggregation, callback=None):
+def aggregation_summary(
+        aggregate_hazard, aggregation, callback=None, rows=None):
     """Compute the summary from the aggregate hazard to the analysis layer.
 
     Source layer :
@@ -57,6 +62,10 @@ def aggregation_summary(aggregate_hazard, aggregation, callback=None):
         Defaults to None.
     :type callback: function
 
+    :param rows: The attributes of the aggregate hazard from layer_rows, if
+        they have been read already. Defaults to None.
+    :type rows: list
+
     :return: The new aggregation layer with summary.
     :rtype: QgsVectorLayer
 
@@ -92,28 +101,33 @@ def aggregation_summary(aggregate_hazard, aggregation, callback=None):
     absolute_values = create_absolute_values_structure(
         aggregate_hazard, ['aggregation_id'])
 
-    flat_table = FlatTable('aggregation_id', 'exposure_class')
+    flat_table = ArrayFlatTable('aggregation_id', 'exposure_class')
+
+    aggregation_index = aggregate_hazard.fieldNameIndex(
+        source_fields[aggregation_id_field['key']])
+    affected_index = aggregate_hazard.fieldNameIndex(
+        affected_field['field_name'])
+    exposure_indexes = [
+        (key.replace(pattern, ''), aggregate_hazard.fieldNameIndex(name))
+        for key, name in source_fields.iteritems() if key.endswith(pattern)]
 
-    aggregation_index = source_fields[aggregation_id_field['key']]
+    if rows is None:
+        rows = layer_rows(aggregate_hazard)
 
     # We want to loop over affected features only.
-    request = QgsFeatureRequest()
-    request.setFlags(QgsFeatureRequest.NoGeometry)
-    expression = '\"%s\" = \'%s\'' % (
-        affected_field['field_name'], tr('True'))
-    request.setFilterExpression(expression)
-    for area in aggregate_hazard.getFeatures(request):
-
-        for key, name_field in source_fields.iteritems():
-            if key.endswith(pattern):
-                aggregation_id = area[aggregation_index]
-                exposure_class = key.replace(pattern, '')
-                value = area[name_field]
-                flat_table.add_value(
-                    value,
-                    aggregation_id=aggregation_id,
-                    exposure_class=exposure_class
-                )
+    affected = tr('True')
+    for area_id, area in rows:
+        if area[affected_index] != affected:
+            continue
+
+        aggregation_id = area[aggregation_index]
+        for exposure_class, index in exposure_indexes:
+            value = area[index]
+            flat_table.add_value(
+                value,
+                aggregation_id=aggregation_id,
+                exposure_class=exposure_class
+            )
 
         # We summarize every absolute values.
         for field, field_definition in absolute_values.iteritems():
@@ -122,7 +136,7 @@ def aggregation_summary(aggregate_hazard, aggregation, callback=None):
                 value = 0
             field_definition[0].add_value(
                 value,
-                aggregation_id=area[aggregation_index],
+                aggregation_id=aggregation_id,
             )
 
     shift = aggregation.fields().count()
@@ -136,12 +150,15 @@ def aggregation_summary(aggregate_hazard, aggregation, callback=None):
         unique_exposure,
         affected_exposure_count_field)
 
-    aggregation_index = target_fields[aggregation_id_field['key']]
+    aggregation.commitChanges()
+
+    aggregation_index = aggregation.fieldNameIndex(
+        target_fields[aggregation_id_field['key']])
 
-    request = QgsFeatureRequest()
-    request.setFlags(QgsFeatureRequest.NoGeometry)
-    for area in aggregation.getFeatures(request):
+    changes = {}
+    for area_id, area in layer_rows(aggregation):
         aggregation_value = area[aggregation_index]
+        values = {}
         total = 0
         for i, val in enumerate(unique_exposure):
             sum = flat_table.get_value(
@@ -149,20 +166,20 @@ def aggregation_summary(aggregate_hazard, aggregation, callback=None):
                 exposure_class=val
             )
             total += sum
-            aggregation.changeAttributeValue(area.id(), shift + i, sum)
+            values[shift + i] = sum
 
-        aggregation.changeAttributeValue(
-            area.id(), shift + len(unique_exposure), total)
+        values[shift + len(unique_exposure)] = total
 
         for i, field in enumerate(absolute_values.itervalues()):
             value = field[0].get_value(
                 aggregation_id=aggregation_value,
             )
             target_index = shift + len(unique_exposure) + 1 + i
-            aggregation.changeAttributeValue(
-                area.id(), target_index, value)
+            values[target_index] = value
 
-    aggregation.commitChanges()
+        changes[area_id] = values
+
+    write_values(aggregation, changes)
 
     aggregation.keywords['title'] = layer_purpose_aggregation_summary['name']
     aggregation.setLayerName(aggregation.keywords['title'])
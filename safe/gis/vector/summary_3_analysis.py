@@ -4,7 +4,7 @@
 
 from math import isnan
 from PyQt4.QtCore import QPyNullVariant
-from qgis.core import QGis, QgsFeatureRequest
+from qgis.core import QGis
 
 from safe.definitions.fields import (
     analysis_id_field,
@@ -25,10 +25,14 @@ from safe.definitions.hazard_classifications import not_exposed_class
 from safe.definitions.layer_purposes import layer_purpose_analysis_impacted
 from safe.definitions.post_processors import post_processor_affected_function
 from safe.gis.vector.summary_tools import (
-    check_inputs, create_absolute_values_structure, add_fields)
+    check_inputs,
+    create_absolute_values_structure,
+    add_fields,
+    layer_rows,
+    write_values)
 from safe.gis.sanity_check import check_layer
 from safe.utilities.profiling import profile
-from safe.utilities.pivot_table import FlatTable
+from safe.utilities.pivot_table import ArrayFlatTable
 
 __copyright__ = "Copyright 2016, The InaSAFE Project"
 __license__ = "GPL version 3"
@@ -37,7 +41,7 @@ __revision__ = '$Format:%H$'
 
 
 @profile
-def analysis_summary(aggregate_hazard, analysis, callback=None):
+def analysis_summary(aggregate_hazard, analysis, callback=None, rows=None):
     """Compute the summary from the aggregate hazard to analysis.
 
     Source layer :
@@ -60,6 +64,10 @@ def analysis_summary(aggregate_hazard, analysis, callback=None):
         Defaults to None.
     :type callback: function
 
+    :param rows: The attributes of the aggregate hazard from layer_rows, if
+        they have been read already. Defaults to None.
+    :type rows: list
+
     :return: The new target layer with summary.
     :rtype: QgsVectorLayer
 
@@ -97,17 +105,17 @@ def analysis_summary(aggregate_hazard, analysis, callback=None):
     classification = hazard_keywords['classification']
 
     total = source_fields[total_field['key']]
+    total_index = aggregate_hazard.fieldNameIndex(total)
+
+    flat_table = ArrayFlatTable('hazard_class')
 
-    flat_table = FlatTable('hazard_class')
+    if rows is None:
+        rows = layer_rows(aggregate_hazard)
 
     # First loop over the aggregate_hazard layer
-    request = QgsFeatureRequest()
-    request.setSubsetOfAttributes(
-        [hazard_class, total], aggregate_hazard.fields())
-    request.setFlags(QgsFeatureRequest.NoGeometry)
-    for area in aggregate_hazard.getFeatures():
+    for area_id, area in rows:
         hazard_value = area[hazard_class_index]
-        value = area[total]
+        value = area[total_index]
         if not value or isinstance(value, QPyNullVariant) or isnan(value):
             # For isnan, see ticket #3812
             value = 0
@@ -145,18 +153,22 @@ def analysis_summary(aggregate_hazard, analysis, callback=None):
         unique_hazard,
         hazard_count_field)
 
+    analysis.commitChanges()
+
     affected_sum = 0
     not_affected_sum = 0
     not_exposed_sum = 0
 
-    for area in analysis.getFeatures(request):
+    changes = {}
+    for area_id, area in layer_rows(analysis):
+        values = {}
         total = 0
         for i, val in enumerate(unique_hazard):
             if not val or isinstance(val, QPyNullVariant):
                 val = 'NULL'
             sum = flat_table.get_value(hazard_class=val)
             total += sum
-            analysis.changeAttributeValue(area.id(), shift + i, sum)
+            values[shift + i] = sum
 
             affected = post_processor_affected_function(
                     classification=classification, hazard_class=val)
@@ -168,28 +180,27 @@ def analysis_summary(aggregate_hazard, analysis, callback=None):
                 not_affected_sum += sum
 
         # Affected field
-        analysis.changeAttributeValue(
-            area.id(), shift + len(unique_hazard), affected_sum)
+        values[shift + len(unique_hazard)] = affected_sum
 
         # Not affected field
-        analysis.changeAttributeValue(
-            area.id(), shift + len(unique_hazard) + 1, not_affected_sum)
+        values[shift + len(unique_hazard) + 1] = not_affected_sum
 
         # Not exposed field
-        analysis.changeAttributeValue(
-            area.id(), shift + len(unique_hazard) + 2, not_exposed_sum)
+        values[shift + len(unique_hazard) + 2] = not_exposed_sum
 
         # Total field
-        analysis.changeAttributeValue(
-            area.id(), shift + len(unique_hazard) + 3, total)
+        values[shift + len(unique_hazard) + 3] = total
 
         # Any absolute postprocessors
         for i, field in enumerate(absolute_values.itervalues()):
             value = field[0].get_value(
                 all='all'
             )
-            analysis.changeAttributeValue(
-                area.id(), shift + len(unique_hazard) + 4 + i, value)
+            values[shift + len(unique_hazard) + 4 + i] = value
+
+        changes[area_id] = values
+
+    write_values(analysis, changes)
 
     # Sanity check ± 1 to the result. Disabled for now as it seems ± 1 is not
     # enough. ET 13/02/17
@@ -198,8 +209,6 @@ def analysis_summary(aggregate_hazard, analysis, callback=None):
     # if not -1 < (total_computed - total) < 1:
     #     raise ComputationError
 
-    analysis.commitChanges()
-
     analysis.keywords['title'] = layer_purpose_analysis_impacted['name']
     analysis.setLayerName(analysis.keywords['title'])
     analysis.keywords['layer_purpose'] = layer_purpose_analysis_impacted['key']
@@ -3,7 +3,7 @@
 """Aggregate the aggregate hazard to the analysis layer."""
 
 from PyQt4.QtCore import QPyNullVariant
-from qgis.core import QGis, QgsFeatureRequest, QgsFeature
+from qgis.core import QGis, QgsFeature
 
 from safe.definitions.utilities import definition
 from safe.definitions.fields import (
@@ -32,9 +32,9 @@ from safe.gis.vector.tools import (
     create_memory_layer)
 from safe.gis.sanity_check import check_layer
 from safe.gis.vector.summary_tools import (
-    check_inputs, create_absolute_values_structure)
+    check_inputs, create_absolute_values_structure, layer_rows)
 from safe.utilities.profiling import profile
-from safe.utilities.pivot_table import FlatTable
+from safe.utilities.pivot_table import ArrayFlatTable
 
 __copyright__ = "Copyright 2016, The InaSAFE Project"
 __license__ = "GPL version 3"
@@ -43,7 +43,7 @@ __revision__ = '$Format:%H$'
 
 
 @profile
-def exposure_summary_table(aggregate_hazard, callback=None):
+def exposure_summary_table(aggregate_hazard, callback=None, rows=None):
     """Compute the summary from the aggregate hazard to analysis.
 
     Source layer :
@@ -60,6 +60,10 @@ def exposure_summary_table(aggregate_hazard, callback=None):
         Defaults to None.
     :type callback: function
 
+    :param rows: The attributes of the aggregate hazard from layer_rows, if
+        they have been read already. Defaults to None.
+    :type rows: list
+
     :return: The new tabular table, without geometry.
     :rtype: QgsVectorLayer
 
@@ -91,16 +95,22 @@ def exposure_summary_table(aggregate_hazard, callback=None):
     unique_exposure = read_dynamic_inasafe_field(
         source_fields, exposure_count_field)
 
-    flat_table = FlatTable('hazard_class', 'exposure_class')
+    flat_table = ArrayFlatTable('hazard_class', 'exposure_class')
+
+    exposure_indexes = []
+    for exposure in unique_exposure:
+        key_name = exposure_count_field['key'] % exposure
+        field_name = source_fields[key_name]
+        exposure_indexes.append(
+            (exposure, aggregate_hazard.fieldNameIndex(field_name)))
+
+    if rows is None:
+        rows = layer_rows(aggregate_hazard)
 
-    request = QgsFeatureRequest()
-    request.setFlags(QgsFeatureRequest.NoGeometry)
-    for area in aggregate_hazard.getFeatures():
+    for area_id, area in rows:
         hazard_value = area[hazard_class_index]
-        for exposure in unique_exposure:
-            key_name = exposure_count_field['key'] % exposure
-            field_name = source_fields[key_name]
-            exposure_count = area[field_name]
+        for exposure, index in exposure_indexes:
+            exposure_count = area[index]
             if not exposure_count or isinstance(
                     exposure_count, QPyNullVariant):
                 exposure_count = 0
@@ -177,6 +187,9 @@ def exposure_summary_table(aggregate_hazard, callback=None):
         value = field_definition['field_name']
         tabular.keywords['inasafe_fields'][key] = value
 
+    tabular.commitChanges()
+
+    features = []
     for exposure_type in unique_exposure:
         feature = QgsFeature()
         attributes = [exposure_type]
@@ -214,7 +227,7 @@ def exposure_summary_table(aggregate_hazard, callback=None):
             attributes.append(value)
 
         feature.setAttributes(attributes)
-        tabular.addFeature(feature)
+        features.append(feature)
 
         # Sanity check ± 1 to the result. Disabled for now as it seems ± 1 is
         # not enough. ET 13/02/17
@@ -223,7 +236,7 @@ def exposure_summary_table(aggregate_hazard, callback=None):
         # if not -1 < (total_computed - total) < 1:
         #     raise ComputationError
 
-    tabular.commitChanges()
+    tabular.dataProvider().addFeatures(features)
 
     tabular.keywords['title'] = layer_purpose_exposure_summary_table['name']
     tabular.setLayerName(tabular.keywords['title'])
@@ -1,11 +1,12 @@
 # coding=utf-8
 
+import numpy
 from PyQt4.QtCore import QPyNullVariant
-
+from qgis.core import QgsFeatureRequest
 
 from safe.definitions.fields import count_fields
 from safe.definitions.utilities import definition
-from safe.utilities.pivot_table import FlatTable
+from safe.utilities.pivot_table import ArrayFlatTable
 from safe.common.exceptions import InvalidKeywordsForProcessingAlgorithm
 from safe.gis.vector.tools import create_field_from_definition
 
@@ -56,7 +57,7 @@ def create_absolute_values_structure(layer, fields):
         if field in absolute_fields:
             field_name = source_fields[field]
             index = layer.fieldNameIndex(field_name)
-            flat_table = FlatTable(*fields)
+            flat_table = ArrayFlatTable(*fields)
             summaries[index] = (flat_table, field)
     return summaries
 
@@ -106,3 +107,191 @@ def add_fields(
         key = field_definition['key']
         value = field_definition['field_name']
         layer.keywords['inasafe_fields'][key] = value
+
+
+def layer_rows(layer):
+    """Read the attributes of every feature of a layer, without geometry.
+
+    Summaries of the same layer can share these rows instead of reading the
+    layer again.
+
+    :param layer: The vector layer.
+    :type layer: QgsVectorLayer
+
+    :return: List of tuples (feature id, attributes) in the layer order.
+    :rtype: list
+    """
+    request = QgsFeatureRequest()
+    request.setFlags(QgsFeatureRequest.NoGeometry)
+    return [
+        (feature.id(), feature.attributes())
+        for feature in layer.getFeatures(request)]
+
+
+def write_values(layer, changes):
+    """Write attribute values with a single call to the provider.
+
+    The layer must not be in edit mode.
+
+    :param layer: The vector layer.
+    :type layer: QgsVectorLayer
+
+    :param changes: Dictionary feature id: {field index: value}.
+    :type changes: dict
+    """
+    if changes:
+        layer.dataProvider().changeAttributeValues(changes)
+
+
+class SummaryAccumulator(object):
+
+    """Sums of the impact by aggregation, hazard and exposure class.
+
+    Features are added once, with their codes and values. reduce() sums them
+    in a dense array aggregation x hazard x exposure class for the reported
+    value and in an array aggregation x hazard x count field for absolute
+    values. Values are summed in the order they are added.
+    """
+
+    def __init__(self, count_fields_number):
+        """Constructor.
+
+        :param count_fields_number: The number of absolute values per feature.
+        :type count_fields_number: int
+        """
+        self.aggregations = {}
+        self.hazards = {}
+        self.exposures = {}
+        self._count_fields_number = count_fields_number
+        self._codes = ([], [], [])
+        self._values = []
+        self._absolute_values = []
+        self._integer_values = True
+        self._integer_absolute_values = [True] * count_fields_number
+        self.values = None
+        self.absolute_values = None
+
+    @staticmethod
+    def _code(codes, key):
+        """Get the code of a key, a new one if it's not known yet."""
+        code = codes.get(key)
+        if code is None:
+            code = len(codes)
+            codes[key] = code
+        return code
+
+    def add(self, aggregation, hazard, exposure, value, absolute_values):
+        """Add a feature of the impact.
+
+        :param aggregation: The aggregation ID of the feature.
+        :type aggregation: int, basestring
+
+        :param hazard: The hazard ID of the feature.
+        :type hazard: basestring
+
+        :param exposure: The exposure class of the feature.
+        :type exposure: basestring
+
+        :param value: The reported value of the feature.
+        :type value: int, float
+
+        :param absolute_values: The absolute values of the feature.
+        :type absolute_values: list
+        """
+        self._codes[0].append(self._code(self.aggregations, aggregation))
+        self._codes[1].append(self._code(self.hazards, hazard))
+        self._codes[2].append(self._code(self.exposures, exposure))
+        self._values.append(value)
+        if self._integer_values and not isinstance(value, (int, long)):
+            self._integer_values = False
+        for i, absolute_value in enumerate(absolute_values):
+            if not isinstance(absolute_value, (int, long)):
+                self._integer_absolute_values[i] = False
+        self._absolute_values.append(absolute_values)
+
+    def reduce(self):
+        """Sum the values added so far in the dense arrays."""
+        shape = (
+            max(len(self.aggregations), 1),
+            max(len(self.hazards), 1),
+            max(len(self.exposures), 1))
+        size = shape[0] * shape[1] * shape[2]
+        codes = [numpy.array(code, dtype=numpy.int64) for code in self._codes]
+
+        if self._values:
+            index = numpy.ravel_multi_index(codes, shape)
+            self.values = numpy.bincount(
+                index,
+                weights=numpy.array(self._values, dtype=numpy.float64),
+                minlength=size).reshape(shape)
+        else:
+            self.values = numpy.zeros(shape)
+
+        self.absolute_values = numpy.zeros(
+            shape[:2] + (self._count_fields_number, ))
+        if self._absolute_values:
+            index = numpy.ravel_multi_index(codes[:2], shape[:2])
+            absolute_values = numpy.array(
+                self._absolute_values, dtype=numpy.float64)
+            for i in xrange(self._count_fields_number):
+                self.absolute_values[:, :, i] = numpy.bincount(
+                    index,
+                    weights=absolute_values[:, i],
+                    minlength=shape[0] * shape[1]).reshape(shape[:2])
+
+        self._codes = ([], [], [])
+        self._values = []
+        self._absolute_values = []
+
+    @staticmethod
+    def _number(value, integer):
+        """Convert a sum to int if all values were integers."""
+        if integer:
+            return int(round(value))
+        return float(value)
+
+    def value(self, aggregation, hazard, exposure):
+        """Get the sum of the reported value for a combination.
+
+        :param aggregation: The aggregation ID.
+        :type aggregation: int, basestring
+
+        :param hazard: The hazard ID.
+        :type hazard: basestring
+
+        :param exposure: The exposure class.
+        :type exposure: basestring
+
+        :return: The sum, 0 if the combination is not in the impact.
+        :rtype: int, float
+        """
+        try:
+            value = self.values[
+                self.aggregations[aggregation],
+                self.hazards[hazard],
+                self.exposures[exposure]]
+        except KeyError:
+            return 0
+        return self._number(value, self._integer_values)
+
+    def absolute_value(self, aggregation, hazard, index):
+        """Get the sum of an absolute value for an aggregation and hazard.
+
+        :param aggregation: The aggregation ID.
+        :type aggregation: int, basestring
+
+        :param hazard: The hazard ID.
+        :type hazard: basestring
+
+        :param index: The position of the absolute value.
+        :type index: int
+
+        :return: The sum, 0 if the combination is not in the impact.
+        :rtype: int, float
+        """
+        try:
+            value = self.absolute_values[
+                self.aggregations[aggregation], self.hazards[hazard], index]
+        except KeyError:
+            return 0
+        return self._number(value, self._integer_absolute_values[index])
@@ -8,6 +8,7 @@ from safe.test.utilities import (
 QGIS_APP, CANVAS, IFACE, PARENT = get_qgis_app()
 
 from safe.gis.vector.intersection import intersection
+from safe.utilities.settings import set_setting, delete_setting
 
 __copyright__ = "Copyright 2016, The InaSAFE Project"
 __license__ = "GPL version 3"
@@ -45,3 +46,30 @@ class TestIntersectionVector(unittest.TestCase):
             aggregation.fields().count() + exposure.fields().count(),
             layer.fields().count()
         )
+
+    def test_intersection_process_pool(self):
+        """Test the process pool gives the same result."""
+        exposure = load_test_vector_layer(
+            'gisv4', 'exposure', 'roads.geojson')
+        aggregation = load_test_vector_layer(
+            'gisv4', 'hazard', 'classified_vector.geojson')
+        aggregation.keywords = {
+            'aggregation_keywords': {},
+            'hazard_keywords': {},
+            'inasafe_fields': {}
+        }
+
+        expected = intersection(exposure, aggregation)
+
+        set_setting('vector_workers', 2)
+        set_setting('vector_partition_size', 2)
+        try:
+            layer = intersection(exposure, aggregation)
+        finally:
+            delete_setting('vector_workers')
+            delete_setting('vector_partition_size')
+
+        self.assertEqual(layer.featureCount(), expected.featureCount())
+        self.assertEqual(
+            [f.attributes() for f in expected.getFeatures()],
+            [f.attributes() for f in layer.getFeatures()])
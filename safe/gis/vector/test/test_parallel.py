@@ -0,0 +1,83 @@
+# coding=utf-8
+"""Test spatial partitions."""
+
+import sys
+import unittest
+
+from safe.test.utilities import get_qgis_app
+QGIS_APP, CANVAS, IFACE, PARENT = get_qgis_app()
+
+from safe.gis.vector import parallel
+from safe.gis.vector.parallel import spatial_partitions, vector_workers
+from safe.utilities.settings import set_setting, delete_setting
+
+__copyright__ = "Copyright 2016, The InaSAFE Project"
+__license__ = "GPL version 3"
+__email__ = "info@inasafe.org"
+__revision__ = '$Format:%H$'
+
+
+class TestParallel(unittest.TestCase):
+
+    """Test spatial partitions."""
+
+    def test_spatial_partitions(self):
+        """Test partitions are compact and deterministic."""
+        items = []
+        position = 0
+        for x in xrange(4):
+            for y in xrange(4):
+                box = (x, y, x + 1, y + 1)
+                items.append((position, box, 'payload %s' % position))
+                position += 1
+
+        partitions = spatial_partitions(items, 4)
+        self.assertEqual(len(partitions), 4)
+
+        # Each partition is a 2 x 2 square.
+        for partition in partitions:
+            columns = set(item[1][0] for item in partition)
+            rows = set(item[1][1] for item in partition)
+            self.assertEqual(len(columns), 2)
+            self.assertEqual(len(rows), 2)
+
+        # All items are there once.
+        positions = sorted(
+            item[0] for partition in partitions for item in partition)
+        self.assertEqual(positions, range(16))
+
+        # The order of the input doesn't matter.
+        self.assertEqual(
+            partitions, spatial_partitions(list(reversed(items)), 4))
+
+        self.assertEqual(spatial_partitions([], 4), [])
+
+    def test_vector_workers(self):
+        """Test the process pool is not used in QGIS desktop."""
+        set_setting('vector_workers', 2)
+        iface = parallel.iface
+        try:
+            # Headless.
+            parallel.iface = None
+            self.assertEqual(vector_workers(), 2)
+
+            # In QGIS desktop, without a Python interpreter to spawn.
+            parallel.iface = IFACE
+            if sys.platform == 'win32':
+                executable = parallel.forking._python_exe
+                try:
+                    parallel.forking._python_exe = sys.executable
+                    self.assertEqual(vector_workers(), 1)
+                    parallel.forking._python_exe = 'python.exe'
+                    self.assertEqual(vector_workers(), 2)
+                finally:
+                    parallel.forking._python_exe = executable
+            else:
+                self.assertEqual(vector_workers(), 1)
+        finally:
+            parallel.iface = iface
+            delete_setting('vector_workers')
+
+
+if __name__ == '__main__':
+    unittest.main()
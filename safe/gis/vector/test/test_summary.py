@@ -21,6 +21,7 @@ from safe.gis.vector.summary_2_aggregation import aggregation_summary
 from safe.gis.vector.summary_3_analysis import analysis_summary
 from safe.gis.vector.summary_4_exposure_summary_table import (
     exposure_summary_table)
+from safe.gis.vector.summary_tools import SummaryAccumulator, layer_rows
 from safe.impact_function.impact_function import ImpactFunction
 from safe.gis.sanity_check import check_inasafe_fields
 
@@ -110,6 +111,50 @@ class TestAggregateSummary(unittest.TestCase):
             len(unique_exposure) + number_of_fields + 1
         )
 
+    def test_summary_accumulator(self):
+        """Test the accumulator sums values like a flat table."""
+        accumulator = SummaryAccumulator(1)
+        accumulator.add('1', 'high', 'house', 1, [10])
+        accumulator.add('1', 'high', 'house', 1, [0.5])
+        accumulator.add('1', 'low', 'school', 1, [2])
+        accumulator.add('2', 'high', 'house', 1, [3])
+        accumulator.reduce()
+
+        self.assertEqual(accumulator.value('1', 'high', 'house'), 2)
+        self.assertIsInstance(accumulator.value('1', 'high', 'house'), int)
+        self.assertEqual(accumulator.value('1', 'high', 'school'), 0)
+        self.assertEqual(accumulator.value('1', 'low', 'school'), 1)
+        self.assertEqual(accumulator.value('2', 'high', 'house'), 1)
+        self.assertEqual(accumulator.value('3', 'high', 'house'), 0)
+
+        self.assertEqual(accumulator.absolute_value('1', 'high', 0), 10.5)
+        self.assertEqual(accumulator.absolute_value('2', 'high', 0), 3.0)
+        self.assertEqual(accumulator.absolute_value('2', 'low', 0), 0)
+
+    def test_summaries_with_rows(self):
+        """Test summaries are the same with rows read once."""
+        aggregate_hazard = load_test_vector_layer(
+            'gisv4',
+            'intermediate',
+            'aggregate_classified_hazard_summary.geojson')
+        rows = layer_rows(aggregate_hazard)
+        self.assertEqual(len(rows), aggregate_hazard.featureCount())
+
+        layers = []
+        for shared_rows in [None, rows]:
+            aggregation = load_test_vector_layer(
+                'gisv4',
+                'aggregation',
+                'aggregation_cleaned.geojson',
+                clone=True)
+            layers.append(aggregation_summary(
+                aggregate_hazard, aggregation, rows=shared_rows))
+
+        expected, result = [
+            [feature.attributes() for feature in layer.getFeatures()]
+            for layer in layers]
+        self.assertEqual(expected, result)
+
     def test_analysis_summary(self):
         """Test we can aggregate the aggregate hazard to the analysis."""
         aggregate_hazard = load_test_vector_layer(
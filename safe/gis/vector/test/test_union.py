@@ -10,6 +10,7 @@ QGIS_APP, CANVAS, IFACE, PARENT = get_qgis_app()
 
 from safe.gis.vector.union import union
 from safe.definitions.fields import hazard_class_field, hazard_value_field
+from safe.utilities.settings import set_setting, delete_setting
 
 __copyright__ = "Copyright 2016, The InaSAFE Project"
 __license__ = "GPL version 3"
@@ -44,6 +45,36 @@ class TestUnionVector(unittest.TestCase):
             layer.fields().count()
         )
 
+    def test_union_process_pool(self):
+        """Test the process pool gives the same result."""
+
+        def union_layers():
+            union_a = load_test_vector_layer(
+                'gisv4', 'hazard', 'classified_vector.geojson')
+            union_a.keywords['inasafe_fields'][hazard_class_field['key']] = (
+                union_a.keywords['inasafe_fields'][hazard_value_field['key']])
+            union_b = load_test_vector_layer(
+                'gisv4', 'aggregation', 'small_grid.geojson')
+            return union(union_a, union_b)
+
+        expected = union_layers()
+
+        set_setting('vector_workers', 2)
+        set_setting('vector_partition_size', 2)
+        try:
+            layer = union_layers()
+        finally:
+            delete_setting('vector_workers')
+            delete_setting('vector_partition_size')
+
+        self.assertEqual(layer.featureCount(), expected.featureCount())
+        self.assertEqual(
+            [f.attributes() for f in expected.getFeatures()],
+            [f.attributes() for f in layer.getFeatures()])
+        self.assertEqual(
+            [f.geometry().exportToWkt() for f in expected.getFeatures()],
+            [f.geometry().exportToWkt() for f in layer.getFeatures()])
+
     @unittest.expectedFailure
     def test_union_error(self):
         """Test we can union two layers like hazard and aggregation (2)."""
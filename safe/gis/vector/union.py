@@ -19,6 +19,16 @@ from safe.definitions.hazard_classifications import not_exposed_class
 from safe.gis.vector.tools import (
     create_memory_layer, wkb_type_groups, create_spatial_index)
 from safe.gis.vector.clean_geometry import geometry_checker
+from safe.gis.vector.parallel import (
+    vector_workers,
+    vector_partition_size,
+    geometry_to_wkb,
+    geometry_from_wkb,
+    picklable_attributes,
+    bounding_box,
+    spatial_partitions,
+    run_partitions,
+)
 from safe.gis.sanity_check import check_layer
 from safe.utilities.profiling import profile
 
@@ -92,196 +102,404 @@ def union(union_a, union_b, callback=None):
 
     writer.startEditing()
 
+    index_a = create_spatial_index(union_b)
+    index_b = create_spatial_index(union_a)
+    workers = vector_workers()
+
+    if workers > 1:
+        outputs = _parallel_union(
+            union_a,
+            union_b,
+            index_a,
+            index_b,
+            writer.geometryType(),
+            not_null_field_index,
+            workers,
+            vector_partition_size())
+        for attributes, geometry in outputs:
+            _write_feature(attributes, geometry, writer, not_null_field_index)
+    else:
+        # cache features for faster retrieval
+        features_a = _cache_features(union_a)
+        features_b = _cache_features(union_b)
+        length = len(union_a.fields())
+
+        for in_feat_a in union_a.getFeatures():
+            geom = geometry_checker(in_feat_a.geometry())
+            intersects = index_a.intersects(geom.boundingBox())
+            outputs = _union_feature_a(
+                geom, in_feat_a.attributes(), intersects, features_b)
+            _write_features(outputs, writer, not_null_field_index)
+
+        for in_feat_a in union_b.getFeatures():
+            geom = geometry_checker(in_feat_a.geometry())
+            intersects = index_b.intersects(geom.boundingBox())
+            outputs = _union_feature_b(
+                geom, in_feat_a.attributes(), intersects, features_a, length)
+            _write_features(outputs, writer, not_null_field_index)
+
+    writer.commitChanges()
+
+    fill_hazard_class(writer)
+
+    check_layer(writer)
+    return writer
+
+
+def _cache_features(layer):
+    """Read all features of a layer in memory.
+
+    :param layer: The vector layer.
+    :type layer: QgsVectorLayer
+
+    :return: Features, key: ID, value: tuple (geometry, attributes).
+    :rtype: dict
+    """
+    features = {}
+    for feature in layer.getFeatures():
+        features[feature.id()] = (
+            QgsGeometry(feature.geometry()), feature.attributes())
+    return features
+
+
+def _union_feature_a(geom, at_map_a, intersects, features_b):
+    """Compute the union of a feature from the first layer.
+
+    :param geom: The geometry of the feature.
+    :type geom: QgsGeometry
+
+    :param at_map_a: The attributes of the feature.
+    :type at_map_a: list
+
+    :param intersects: IDs of features from the second layer found by the
+        spatial index.
+    :type intersects: list
+
+    :param features_b: Features of the second layer, key: ID, value: tuple
+        (geometry, attributes).
+    :type features_b: dict
+
+    :return: List of tuples (attributes, geometry) to write.
+    :rtype: list
+    """
+    outputs = []
+
     # Begin copy/paste from Processing plugin.
     # Please follow their code as their code is optimized.
     # The code below is not following our coding standards because we want to
     # be able to track any diffs from QGIS easily.
 
-    index_a = create_spatial_index(union_b)
-    index_b = create_spatial_index(union_a)
-
-    count = 0
-    n_element = 0
-    # Todo fix callback
-    # nFeat = len(union_a.getFeatures())
-    for in_feat_a in union_a.getFeatures():
-        # progress.setPercentage(nElement / float(nFeat) * 50)
-        n_element += 1
-        list_intersecting_b = []
-        geom = geometry_checker(in_feat_a.geometry())
-        at_map_a = in_feat_a.attributes()
-        intersects = index_a.intersects(geom.boundingBox())
-        if len(intersects) < 1:
-            try:
-                _write_feature(at_map_a, geom, writer, not_null_field_index)
-            except:
-                # This really shouldn't happen, as we haven't
-                # edited the input geom at all
-                LOGGER.debug(
-                    tr('Feature geometry error: One or more output features '
-                       'ignored due to invalid geometry.'))
-        else:
-            request = QgsFeatureRequest().setFilterFids(intersects)
-
-            engine = QgsGeometry.createGeometryEngine(geom.geometry())
-            engine.prepareGeometry()
-
-            for in_feat_b in union_b.getFeatures(request):
-                count += 1
-
-                at_map_b = in_feat_b.attributes()
-                tmp_geom = geometry_checker(in_feat_b.geometry())
-
-                if engine.intersects(tmp_geom.geometry()):
-                    int_geom = geometry_checker(geom.intersection(tmp_geom))
-                    list_intersecting_b.append(QgsGeometry(tmp_geom))
-
-                    if not int_geom:
-                        # There was a problem creating the intersection
-                        # LOGGER.debug(
-                        #     tr('GEOS geoprocessing error: One or more input '
-                        #        'features have invalid geometry.'))
-                        pass
-                        int_geom = QgsGeometry()
-                    else:
-                        int_geom = QgsGeometry(int_geom)
-
-                    if int_geom.wkbType() == QgsWKBTypes.Unknown\
-                            or QgsWKBTypes.flatType(
-                            int_geom.geometry().wkbType()) == \
-                                    QgsWKBTypes.GeometryCollection:
-                        # Intersection produced different geometry types
-                        temp_list = int_geom.asGeometryCollection()
-                        for i in temp_list:
-                            if i.type() == geom.type():
-                                int_geom = QgsGeometry(geometry_checker(i))
-                                try:
-                                    _write_feature(
-                                        at_map_a + at_map_b,
-                                        int_geom,
-                                        writer,
-                                        not_null_field_index,
-                                    )
-                                except:
-                                    LOGGER.debug(
-                                        tr('Feature geometry error: One or '
-                                           'more output features ignored due '
-                                           'to invalid geometry.'))
-                    else:
-                        # Geometry list: prevents writing error
-                        # in geometries of different types
-                        # produced by the intersection
-                        # fix #3549
-                        if int_geom.wkbType() in wkb_type_groups[
-                            wkb_type_groups[int_geom.wkbType()]]:
-                            try:
-                                _write_feature(
-                                    at_map_a + at_map_b,
-                                    int_geom,
-                                    writer,
-                                    not_null_field_index)
-                            except:
-                                LOGGER.debug(
-                                    tr('Feature geometry error: One or more '
-                                       'output features ignored due to '
-                                       'invalid geometry.'))
-
-            # the remaining bit of inFeatA's geometry
-            # if there is nothing left, this will just silently fail and we
-            # are good
-            diff_geom = QgsGeometry(geom)
-            if len(list_intersecting_b) != 0:
-                int_b = QgsGeometry.unaryUnion(list_intersecting_b)
-                diff_geom = geometry_checker(diff_geom.difference(int_b))
-                if diff_geom is None or \
-                    diff_geom.isGeosEmpty() or not diff_geom.isGeosValid():
+    list_intersecting_b = []
+    if len(intersects) < 1:
+        outputs.append((at_map_a, geom))
+    else:
+        engine = QgsGeometry.createGeometryEngine(geom.geometry())
+        engine.prepareGeometry()
+
+        # Like the feature request before, hits are visited by ID, not in
+        # the order of the spatial index.
+        for fid in sorted(intersects):
+            tmp_geom, at_map_b = features_b[fid]
+            tmp_geom = geometry_checker(tmp_geom)
+
+            if engine.intersects(tmp_geom.geometry()):
+                int_geom = geometry_checker(geom.intersection(tmp_geom))
+                list_intersecting_b.append(QgsGeometry(tmp_geom))
+
+                if not int_geom:
+                    # There was a problem creating the intersection
                     # LOGGER.debug(
                     #     tr('GEOS geoprocessing error: One or more input '
                     #        'features have invalid geometry.'))
                     pass
+                    int_geom = QgsGeometry()
+                else:
+                    int_geom = QgsGeometry(int_geom)
+
+                if int_geom.wkbType() == QgsWKBTypes.Unknown\
+                        or QgsWKBTypes.flatType(
+                        int_geom.geometry().wkbType()) == \
+                                QgsWKBTypes.GeometryCollection:
+                    # Intersection produced different geometry types
+                    temp_list = int_geom.asGeometryCollection()
+                    for i in temp_list:
+                        if i.type() == geom.type():
+                            int_geom = QgsGeometry(geometry_checker(i))
+                            outputs.append((at_map_a + at_map_b, int_geom))
+                else:
+                    # Geometry list: prevents writing error
+                    # in geometries of different types
+                    # produced by the intersection
+                    # fix #3549
+                    if int_geom.wkbType() in wkb_type_groups[
+                        wkb_type_groups[int_geom.wkbType()]]:
+                        outputs.append((at_map_a + at_map_b, int_geom))
+
+        # the remaining bit of inFeatA's geometry
+        # if there is nothing left, this will just silently fail and we
+        # are good
+        diff_geom = QgsGeometry(geom)
+        if len(list_intersecting_b) != 0:
+            int_b = QgsGeometry.unaryUnion(list_intersecting_b)
+            diff_geom = geometry_checker(diff_geom.difference(int_b))
+            if diff_geom is None or \
+                diff_geom.isGeosEmpty() or not diff_geom.isGeosValid():
+                # LOGGER.debug(
+                #     tr('GEOS geoprocessing error: One or more input '
+                #        'features have invalid geometry.'))
+                pass
 
-            if diff_geom is not None and (
-                            diff_geom.wkbType() == 0 or QgsWKBTypes.flatType(
-                    diff_geom.geometry().wkbType()) ==
-                    QgsWKBTypes.GeometryCollection):
-                temp_list = diff_geom.asGeometryCollection()
-                for i in temp_list:
-                    if i.type() == geom.type():
-                        diff_geom = QgsGeometry(geometry_checker(i))
+        if diff_geom is not None and (
+                        diff_geom.wkbType() == 0 or QgsWKBTypes.flatType(
+                diff_geom.geometry().wkbType()) ==
+                QgsWKBTypes.GeometryCollection):
+            temp_list = diff_geom.asGeometryCollection()
+            for i in temp_list:
+                if i.type() == geom.type():
+                    diff_geom = QgsGeometry(geometry_checker(i))
+        outputs.append((at_map_a, diff_geom))
+
+    # End of copy/paste from processing
+
+    return outputs
+
+
+def _union_feature_b(geom, attributes, intersects, features_a, length):
+    """Compute the union of a feature from the second layer.
+
+    :param geom: The geometry of the feature.
+    :type geom: QgsGeometry
+
+    :param attributes: The attributes of the feature.
+    :type attributes: list
+
+    :param intersects: IDs of features from the first layer found by the
+        spatial index.
+    :type intersects: list
+
+    :param features_a: Features of the first layer, key: ID, value: tuple
+        (geometry, attributes).
+    :type features_a: dict
+
+    :param length: The number of fields in the first layer.
+    :type length: int
+
+    :return: List of tuples (attributes, geometry) to write.
+    :rtype: list
+    """
+    # Begin copy/paste from Processing plugin.
+    # Please follow their code as their code is optimized.
+    # The code below is not following our coding standards because we want to
+    # be able to track any diffs from QGIS easily.
+
+    atMap = [None] * length
+    atMap.extend(attributes)
+    lstIntersectingA = []
+
+    # Hits are visited by ID, not in the order of the spatial index.
+    for id in sorted(intersects):
+        tmpGeom = QgsGeometry(geometry_checker(features_a[id][0]))
+
+        if geom.intersects(tmpGeom):
+            lstIntersectingA.append(tmpGeom)
+
+    if len(lstIntersectingA) == 0:
+        res_geom = geom
+    else:
+        intA = QgsGeometry.unaryUnion(lstIntersectingA)
+        res_geom = geom.difference(intA)
+        if res_geom is None:
+            # LOGGER.debug(
+            #    tr('GEOS geoprocessing error: One or more input features '
+            #        'have null geometry.'))
+            pass
+            return []  # maybe it is better to fail like @gustry
+            # does below ....
+        if res_geom.isGeosEmpty() or not res_geom.isGeosValid():
+            # LOGGER.debug(
+            #    tr('GEOS geoprocessing error: One or more input features '
+            #        'have invalid geometry.'))
+            pass
+
+    # End of copy/paste from processing
+
+    return [(atMap, res_geom)]
+
+
+def _write_features(outputs, writer, not_null_field_index):
+    """Write features computed by the union to the output.
+
+    :param outputs: List of tuples (attributes, geometry).
+    :type outputs: list
+
+    :param writer: A vector layer in editing mode.
+    :type: QgsVectorLayer
+
+    :param not_null_field_index: The index in the attribute table which should
+        not be null.
+    :type not_null_field_index: int
+    """
+    for attributes, geometry in outputs:
+        try:
+            _write_feature(attributes, geometry, writer, not_null_field_index)
+        except:
+            LOGGER.debug(
+                tr('Feature geometry error: One or more output features '
+                   'ignored due to invalid geometry.'))
+
+
+def _union_partition(task):
+    """Compute the union of a partition in a process of the pool.
+
+    :param task: Tuple with the function to use (1 for features of the first
+        layer, 2 for the second one), features of the partition (position,
+        WKB, attributes, IDs found by the index), features of the other layer
+        (ID, WKB, attributes), the geometry type of the output, the index of
+        the field which should not be null and the number of fields in the
+        first layer.
+    :type task: tuple
+
+    :return: List of tuples (position, list of (attributes, WKB)).
+    :rtype: list
+    """
+    (step, features, other_features, geometry_type, not_null_field_index,
+     length) = task
+    other_features = dict(
+        (i, (geometry_from_wkb(wkb), attributes))
+        for i, wkb, attributes in other_features)
+
+    results = []
+    for position, wkb, attributes, intersects in features:
+        geom = geometry_checker(geometry_from_wkb(wkb))
+        if step == 1:
+            outputs = _union_feature_a(
+                geom, attributes, intersects, other_features)
+        else:
+            outputs = _union_feature_b(
+                geom, attributes, intersects, other_features, length)
+
+        valid_outputs = []
+        for attrs, geometry in outputs:
             try:
-                _write_feature(
-                    at_map_a,
-                    diff_geom,
-                    writer,
-                    not_null_field_index)
+                if _is_valid_feature(
+                        attrs,
+                        geometry,
+                        geometry_type,
+                        not_null_field_index):
+                    valid_outputs.append(
+                        (picklable_attributes(attrs),
+                         geometry_to_wkb(geometry)))
             except:
                 LOGGER.debug(
                     tr('Feature geometry error: One or more output features '
                        'ignored due to invalid geometry.'))
+        results.append((position, valid_outputs))
+    return results
 
-    length = len(union_a.fields())
-    at_map_a = [None] * length
-
-    # nFeat = len(union_b.getFeatures())
-    for in_feat_a in union_b.getFeatures():
-        # progress.setPercentage(nElement / float(nFeat) * 100)
-        add = False
-        geom = geometry_checker(in_feat_a.geometry())
-        atMap = [None] * length
-        atMap.extend(in_feat_a.attributes())
-        intersects = index_b.intersects(geom.boundingBox())
-        lstIntersectingA = []
-
-        for id in intersects:
-            request = QgsFeatureRequest().setFilterFid(id)
-            inFeatB = union_a.getFeatures(request).next()
-            atMapB = inFeatB.attributes()
-            tmpGeom = QgsGeometry(geometry_checker(inFeatB.geometry()))
-
-            if geom.intersects(tmpGeom):
-                lstIntersectingA.append(tmpGeom)
-
-        if len(lstIntersectingA) == 0:
-            res_geom = geom
-        else:
-            intA = QgsGeometry.unaryUnion(lstIntersectingA)
-            res_geom = geom.difference(intA)
-            if res_geom is None:
-                # LOGGER.debug(
-                #    tr('GEOS geoprocessing error: One or more input features '
-                #        'have null geometry.'))
-                pass
-                continue  # maybe it is better to fail like @gustry
-                # does below ....
-            if res_geom.isGeosEmpty() or not res_geom.isGeosValid():
-                # LOGGER.debug(
-                #    tr('GEOS geoprocessing error: One or more input features '
-                #        'have invalid geometry.'))
-                pass
 
-        try:
-            _write_feature(atMap, res_geom, writer, not_null_field_index)
-        except:
-            # LOGGER.debug(
-            #     tr('Feature geometry error: One or more output features '
-            #        'ignored due to invalid geometry.'))
-            pass
+def _parallel_union(
+        union_a,
+        union_b,
+        index_a,
+        index_b,
+        geometry_type,
+        not_null_field_index,
+        workers,
+        partition_size):
+    """Compute the union by spatial partitions with a process pool.
 
-        n_element += 1
+    Features are split in spatial partitions. Each partition is sent with the
+    features of the other layer it needs. Features are returned in the same
+    order as without the process pool.
 
-    # End of copy/paste from processing
+    :param union_a: The vector layer for the union.
+    :type union_a: QgsVectorLayer
 
-    writer.commitChanges()
+    :param union_b: The vector layer for the union.
+    :type union_b: QgsVectorLayer
 
-    fill_hazard_class(writer)
+    :param index_a: The spatial index of union_b.
+    :type index_a: QgsSpatialIndex
 
-    check_layer(writer)
-    return writer
+    :param index_b: The spatial index of union_a.
+    :type index_b: QgsSpatialIndex
 
+    :param geometry_type: The geometry type of the output.
+    :type geometry_type: QGis.GeometryType
 
-def _write_feature(attributes, geometry, writer, not_null_field_index):
+    :param not_null_field_index: The index in the attribute table which should
+        not be null.
+    :type not_null_field_index: int
+
+    :param workers: The number of processes.
+    :type workers: int
+
+    :param partition_size: The number of features in a partition.
+    :type partition_size: int
+
+    :return: List of tuples (attributes, geometry) to write.
+    :rtype: list
     """
-    Internal function to write the feature to the output.
+    features_a = _picklable_features(union_a)
+    features_b = _picklable_features(union_b)
+    length = len(union_a.fields())
+
+    outputs = []
+    steps = [
+        (1, union_a, index_a, features_b),
+        (2, union_b, index_b, features_a),
+    ]
+    for step, layer, index, other_features in steps:
+        items = []
+        for position, feature in enumerate(layer.getFeatures()):
+            geom = geometry_checker(feature.geometry())
+            intersects = index.intersects(geom.boundingBox())
+            payload = (
+                geometry_to_wkb(geom),
+                picklable_attributes(feature.attributes()),
+                intersects)
+            items.append((position, bounding_box(geom), payload))
+
+        tasks = []
+        for partition in spatial_partitions(items, partition_size):
+            needed = sorted(set(
+                i for item in partition for i in item[2][2]))
+            tasks.append((
+                step,
+                [(item[0], ) + item[2] for item in partition],
+                [(i, ) + other_features[i] for i in needed],
+                geometry_type,
+                not_null_field_index,
+                length))
+
+        for position, results in run_partitions(
+                _union_partition, tasks, workers):
+            for attributes, wkb in results:
+                outputs.append((attributes, geometry_from_wkb(wkb)))
+
+    return outputs
+
+
+def _picklable_features(layer):
+    """Read all features of a layer so they can be sent to other processes.
+
+    :param layer: The vector layer.
+    :type layer: QgsVectorLayer
+
+    :return: Features, key: ID, value: tuple (WKB, attributes).
+    :rtype: dict
+    """
+    features = {}
+    for feature in layer.getFeatures():
+        features[feature.id()] = (
+            geometry_to_wkb(feature.geometry()),
+            picklable_attributes(feature.attributes()))
+    return features
+
+
+def _is_valid_feature(
+        attributes, geometry, geometry_type, not_null_field_index):
+    """Check if a feature computed by the union should be written.
 
     :param attributes: Attributes of the feature.
     :type attributes: list
@@ -289,21 +507,51 @@ def _write_feature(attributes, geometry, writer, not_null_field_index):
     :param geometry: The geometry to write to the output.
     :type geometry: QgsGeometry
 
-    :param writer: A vector layer in editing mode.
-    :type: QgsVectorLayer
+    :param geometry_type: The geometry type of the output.
+    :type geometry_type: QGis.GeometryType
 
     :param not_null_field_index: The index in the attribute table which should
         not be null.
     :type not_null_field_index: int
+
+    :return: True if the feature should be written.
+    :rtype: bool
     """
-    if writer.geometryType() != geometry.type():
+    if geometry_type != geometry.type():
         # We don't write the feature if it's not the same geometry type.
-        return
+        return False
 
     compulsary_field = attributes[not_null_field_index]
     if not compulsary_field or isinstance(compulsary_field, QPyNullVariant):
         # We don't want feature without a compulsary field.
         # I think this a bug from the union algorithm.
+        return False
+
+    return True
+
+
+def _write_feature(attributes, geometry, writer, not_null_field_index):
+    """
+    Internal function to write the feature to the output.
+
+    :param attributes: Attributes of the feature.
+    :type attributes: list
+
+    :param geometry: The geometry to write to the output.
+    :type geometry: QgsGeometry
+
+    :param writer: A vector layer in editing mode.
+    :type: QgsVectorLayer
+
+    :param not_null_field_index: The index in the attribute table which should
+        not be null.
+    :type not_null_field_index: int
+    """
+    if not _is_valid_feature(
+            attributes,
+            geometry,
+            writer.geometryType(),
+            not_null_field_index):
         return
 
     out_feature = QgsFeature()
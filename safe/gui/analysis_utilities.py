@@ -4,7 +4,7 @@
 
 import os
 from collections import OrderedDict
-from PyQt4.QtCore import QDir, Qt
+from PyQt4.QtCore import QDir, QFileInfo, Qt
 from qgis.core import QgsMapLayerRegistry, QgsProject, QgsMapLayer, QGis
 
 from safe.definitions.utilities import definition
@@ -46,7 +46,7 @@ def generate_impact_report(impact_function, iface):
 
     # no other option for now
     # TODO: retrieve the information from data store
-    if isinstance(impact_function.datastore.uri, QDir):
+    if isinstance(impact_function.datastore.uri, (QDir, QFileInfo)):
         layer_dir = impact_function.datastore.uri.absolutePath()
     else:
         # No other way for now
@@ -93,7 +93,7 @@ def generate_impact_map_report(impact_function, iface):
 
     # no other option for now
     # TODO: retrieve the information from data store
-    if isinstance(impact_function.datastore.uri, QDir):
+    if isinstance(impact_function.datastore.uri, (QDir, QFileInfo)):
         layer_dir = impact_function.datastore.uri.absolutePath()
     else:
         # No other way for now
@@ -114,6 +114,8 @@ def add_impact_layers_to_canvas(impact_function, iface):
     :param iface: QGIS QGisAppInterface instance.
     :type iface: QGisAppInterface
     """
+    # Outputs are written in the background, we want them from the datastore.
+    impact_function.datastore.wait()
     layers = impact_function.outputs
     name = impact_function.name
 
@@ -172,6 +174,7 @@ def add_debug_layers_to_canvas(impact_function):
         classification = None
 
     datastore = impact_function.datastore
+    datastore.wait()
     for layer in datastore.layers():
         qgis_layer = datastore.layer(layer)
         if not isinstance(qgis_layer, QgsMapLayer):
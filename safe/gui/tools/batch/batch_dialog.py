@@ -522,6 +522,9 @@ class BatchDialog(QDialog, FORM_CLASS):
                         except:
                             status_item.setText(
                                 self.tr('Report failed to generate.'))
+                        # Outputs are written in the background, the project
+                        # must use them from the datastore.
+                        impact_function.datastore.wait()
                     else:
                         LOGGER.info('Impact layer is invalid')
 
@@ -25,11 +25,12 @@ import shutil
 import logging
 import codecs
 import pytz
-from xml.dom import minidom
+import numpy
+from xml.parsers import expat
 from datetime import datetime
 from pytz import timezone
 from subprocess import call, CalledProcessError
-from osgeo import gdal, ogr
+from osgeo import gdal, ogr, osr
 from osgeo.gdalconst import GA_ReadOnly
 # This import is required to enable PyQt API v2
 # noinspection PyUnresolvedReferences
@@ -38,7 +39,6 @@ import qgis
 # pylint: enable=unused-import
 from qgis.core import (
     QgsVectorLayer,
-    QgsFeatureRequest,
     QgsRectangle,
     QgsRasterLayer)
 from safe.common.utilities import which, romanise
@@ -254,63 +254,36 @@ class ShakeGrid(object):
         LOGGER.debug('ParseGridXml requested.')
         grid_path = self.grid_file_path()
         try:
-            document = minidom.parse(grid_path)
-            event_element = document.getElementsByTagName('event')
-            event_element = event_element[0]
-            self.magnitude = float(
-                event_element.attributes['magnitude'].nodeValue)
-            self.longitude = float(
-                event_element.attributes['lon'].nodeValue)
-            self.latitude = float(
-                event_element.attributes['lat'].nodeValue)
-            self.location = event_element.attributes[
-                'event_description'].nodeValue.strip()
-            self.depth = float(
-                event_element.attributes['depth'].nodeValue)
+            reader = GridXmlReader()
+            with open(grid_path, 'rb') as grid_file:
+                reader.read(grid_file)
+
+            event_element = reader.event
+            self.magnitude = float(event_element['magnitude'])
+            self.longitude = float(event_element['lon'])
+            self.latitude = float(event_element['lat'])
+            self.location = event_element['event_description'].strip()
+            self.depth = float(event_element['depth'])
             # Get the date - it's going to look something like this:
             # 2012-08-07T01:55:12WIB
-            time_stamp = event_element.attributes['event_timestamp'].nodeValue
+            time_stamp = event_element['event_timestamp']
             # Note the timezone here is inconsistent with YZ from grid.xml
             # use the latter
             self.time_zone = time_stamp[19:]
             self.extract_date_time(time_stamp)
 
-            specification_element = document.getElementsByTagName(
-                'grid_specification')
-            specification_element = specification_element[0]
-            self.x_minimum = float(
-                specification_element.attributes['lon_min'].nodeValue)
-            self.x_maximum = float(
-                specification_element.attributes['lon_max'].nodeValue)
-            self.y_minimum = float(
-                specification_element.attributes['lat_min'].nodeValue)
-            self.y_maximum = float(
-                specification_element.attributes['lat_max'].nodeValue)
+            specification_element = reader.specification
+            self.x_minimum = float(specification_element['lon_min'])
+            self.x_maximum = float(specification_element['lon_max'])
+            self.y_minimum = float(specification_element['lat_min'])
+            self.y_maximum = float(specification_element['lat_max'])
             self.grid_bounding_box = QgsRectangle(
                 self.x_minimum, self.y_maximum, self.x_maximum, self.y_minimum)
-            self.rows = float(
-                specification_element.attributes['nlat'].nodeValue)
-            self.columns = float(
-                specification_element.attributes['nlon'].nodeValue)
-            data_element = document.getElementsByTagName(
-                'grid_data')
-            data_element = data_element[0]
-            data = data_element.firstChild.nodeValue
-
-            # Extract the 1,2 and 5th (MMI) columns and populate mmi_data
-            longitude_column = 0
-            latitude_column = 1
-            mmi_column = 4
-            self.mmi_data = []
-            for line in data.split('\n'):
-                if not line:
-                    continue
-                tokens = line.split(' ')
-                longitude = tokens[longitude_column]
-                latitude = tokens[latitude_column]
-                mmi = tokens[mmi_column]
-                mmi_tuple = (longitude, latitude, mmi)
-                self.mmi_data.append(mmi_tuple)
+            self.rows = float(specification_element['nlat'])
+            self.columns = float(specification_element['nlon'])
+
+            # Structured array with the lon, lat and mmi columns.
+            self.mmi_data = reader.data()
 
         except Exception, e:
             LOGGER.exception('Event parse failed')
@@ -344,11 +317,15 @@ class ShakeGrid(object):
            123.1250,01.7900,1.15
            123.1500,01.7900,1.16
            etc...
+
+        Values are written as they are in the grid.xml file, which is read
+        again: mmi_data only keeps the numbers.
         """
-        delimited_text = 'lon,lat,mmi\n'
-        for row in self.mmi_data:
-            delimited_text += '%s,%s,%s\n' % (row[0], row[1], row[2])
-        return delimited_text
+        reader = GridXmlReader(keep_text=True)
+        with open(self.grid_file_path(), 'rb') as grid_file:
+            reader.read(grid_file)
+        lines = ['lon,lat,mmi'] + reader.text_lines + ['']
+        return '\n'.join(lines)
 
     def mmi_to_delimited_file(self, force_flag=True):
         """Save mmi_data to delimited text file suitable for gdal_grid.
@@ -458,14 +435,77 @@ class ShakeGrid(object):
             else:
                 raise Exception(message)
 
+    def mmi_to_array(self):
+        """Put the mmi values of the grid in a 2D array.
+
+        :returns: The array, with nlat rows from north to south and nlon
+            columns from west to east, or None if the grid data is not a full
+            regular lattice.
+        :rtype: numpy.ndarray
+        """
+        rows = int(self.rows)
+        columns = int(self.columns)
+        if rows < 2 or columns < 2 or len(self.mmi_data) != rows * columns:
+            return None
+
+        x_spacing = (self.x_maximum - self.x_minimum) / (columns - 1)
+        y_spacing = (self.y_maximum - self.y_minimum) / (rows - 1)
+        column = numpy.rint(
+            (self.mmi_data['lon'] - self.x_minimum) / x_spacing)
+        row = numpy.rint(
+            (self.y_maximum - self.mmi_data['lat']) / y_spacing)
+        if (column.min() < 0 or column.max() >= columns or
+                row.min() < 0 or row.max() >= rows):
+            return None
+
+        index = (row * columns + column).astype(numpy.int64)
+        if numpy.bincount(index, minlength=rows * columns).max() != 1:
+            # Some grid points are missing or duplicated.
+            return None
+
+        mmi_grid = numpy.empty(rows * columns, dtype=numpy.float32)
+        mmi_grid[index] = self.mmi_data['mmi']
+        return mmi_grid.reshape(rows, columns)
+
+    def array_to_tif(self, mmi_grid, tif_path):
+        """Write the mmi array as a GeoTIFF covering the grid extent.
+
+        The raster has the same extent and size as the one from gdal_grid,
+        but north up.
+
+        :param mmi_grid: The array from mmi_to_array.
+        :type mmi_grid: numpy.ndarray
+
+        :param tif_path: The output file path.
+        :type tif_path: str
+        """
+        rows, columns = mmi_grid.shape
+        driver = gdal.GetDriverByName('GTiff')
+        dataset = driver.Create(
+            tif_path, columns, rows, 1, gdal.GDT_Float32)
+        dataset.SetGeoTransform((
+            self.x_minimum,
+            (self.x_maximum - self.x_minimum) / columns,
+            0,
+            self.y_maximum,
+            0,
+            -(self.y_maximum - self.y_minimum) / rows))
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(4326)
+        dataset.SetProjection(srs.ExportToWkt())
+        dataset.GetRasterBand(1).WriteArray(mmi_grid)
+        dataset.FlushCache()
+        del dataset
+
     def mmi_to_raster(
             self, force_flag=False, algorithm='nearest'):
-        """Convert the grid.xml's mmi column to a raster using gdal_grid.
+        """Convert the grid.xml's mmi column to a raster.
 
         A geotiff file will be created.
 
-        Unfortunately no python bindings exist for doing this so we are
-        going to do it using a shell call.
+        With the nearest algorithm, the raster is written directly from the
+        grid data. Otherwise, unfortunately no python bindings exist for
+        doing this so we are going to do it using a shell call to gdal_grid.
 
         .. see also:: http://www.gdal.org/gdal_grid.html
 
@@ -516,39 +556,48 @@ class ShakeGrid(object):
         if os.path.exists(tif_path) and force_flag is not True:
             return tif_path
 
-        # Ensure the vrt mmi file exists (it will generate csv too if needed)
-        vrt_path = self.mmi_to_vrt(force_flag)
-
-        # now generate the tif using default nearest neighbour interpolation
-        # options. This gives us the same output as the mi.grd generated by
-        # the earthquake server.
+        # The grid is a regular lattice. With the nearest neighbour algorithm,
+        # each pixel gets the value of its grid point, so we write the raster
+        # directly from the parsed data.
+        mmi_grid = None
+        if algorithm == 'nearest':
+            mmi_grid = self.mmi_to_array()
 
-        if 'invdist' in algorithm:
-            algorithm = 'invdist:power=2.0:smoothing=1.0'
-
-        # (Sunni): I'm not sure how this 'mmi' will work
-        # (Tim): Its the mapping to which field in the CSV contains the data
-        #    to be gridded.
-        command = ((
-            '%(gdal_grid)s -a %(alg)s -zfield "mmi" -txe %(xMin)s '
-            '%(xMax)s -tye %(yMin)s %(yMax)s -outsize %(dimX)i '
-            '%(dimY)i -of GTiff -ot Float16 -a_srs EPSG:4326 -l mmi '
-            '"%(vrt)s" "%(tif)s"') % {
-                'gdal_grid': which('gdal_grid')[0],
-                'alg': algorithm,
-                'xMin': self.x_minimum,
-                'xMax': self.x_maximum,
-                'yMin': self.y_minimum,
-                'yMax': self.y_maximum,
-                'dimX': self.columns,
-                'dimY': self.rows,
-                'vrt': vrt_path,
-                'tif': tif_path
-            })
-
-        LOGGER.info('Created this gdal command:\n%s' % command)
-        # Now run GDAL warp scottie...
-        self._run_command(command)
+        if mmi_grid is not None:
+            self.array_to_tif(mmi_grid, tif_path)
+        else:
+            # Ensure the vrt mmi file exists (it will generate csv too if
+            # needed)
+            vrt_path = self.mmi_to_vrt(force_flag)
+
+            # now generate the tif using the requested interpolation options.
+
+            if 'invdist' in algorithm:
+                algorithm = 'invdist:power=2.0:smoothing=1.0'
+
+            # (Sunni): I'm not sure how this 'mmi' will work
+            # (Tim): Its the mapping to which field in the CSV contains the
+            #    data to be gridded.
+            command = ((
+                '%(gdal_grid)s -a %(alg)s -zfield "mmi" -txe %(xMin)s '
+                '%(xMax)s -tye %(yMin)s %(yMax)s -outsize %(dimX)i '
+                '%(dimY)i -of GTiff -ot Float16 -a_srs EPSG:4326 -l mmi '
+                '"%(vrt)s" "%(tif)s"') % {
+                    'gdal_grid': which('gdal_grid')[0],
+                    'alg': algorithm,
+                    'xMin': self.x_minimum,
+                    'xMax': self.x_maximum,
+                    'yMin': self.y_minimum,
+                    'yMax': self.y_maximum,
+                    'dimX': self.columns,
+                    'dimY': self.rows,
+                    'vrt': vrt_path,
+                    'tif': tif_path
+                })
+
+            LOGGER.info('Created this gdal command:\n%s' % command)
+            # Now run GDAL warp scottie...
+            self._run_command(command)
 
         # We will use keywords file name with simple algorithm name since it
         # will raise an error in windows related to having double colon in path
@@ -776,62 +825,51 @@ class ShakeGrid(object):
         if not layer.isValid():
             raise InvalidLayerError(input_file)
 
-        layer.startEditing()
-        # Now loop through the db adding selected features to mem layer
-        request = QgsFeatureRequest()
-        fields = layer.dataProvider().fields()
-
-        for feature in layer.getFeatures(request):
+        provider = layer.dataProvider()
+        fields = provider.fields()
+        index = dict(
+            (name, fields.indexFromName(name))
+            for name in ['X', 'Y', 'RGB', 'ROMAN', 'ALIGN', 'VALIGN', 'LEN'])
+
+        # Contours share a few MMI levels, so we compute labels only once per
+        # level. Key: the MMI value, value: tuple (roman, rgb).
+        # RGB from http://en.wikipedia.org/wiki/Mercalli_intensity_scale
+        labels = {}
+        changes = {}
+        for feature in layer.getFeatures():
             if not feature.isValid():
                 LOGGER.debug('Skipping feature')
                 continue
-            # Work out x and y
-            line = feature.geometry().asPolyline()
-            y = line[0].y()
-
-            x_max = line[0].x()
-            x_min = x_max
-            for point in line:
-                if point.y() < y:
-                    y = point.y()
-                x = point.x()
-                if x < x_min:
-                    x_min = x
-                if x > x_max:
-                    x_max = x
-            x = x_min + ((x_max - x_min) / 2)
-
-            # Get length
-            length = feature.geometry().length()
+            geometry = feature.geometry()
+
+            # Work out x and y: x is the middle of the contour and y is its
+            # lowest point, so labels line up nicely vertically.
+            box = geometry.boundingBox()
+            y = box.yMinimum()
+            x = box.xMinimum() + ((box.xMaximum() - box.xMinimum()) / 2)
 
             mmi_value = float(feature['MMI'])
-            # We only want labels on the whole number contours
-            if mmi_value != round(mmi_value):
-                roman = ''
-            else:
-                roman = romanise(mmi_value)
-
-            # RGB from http://en.wikipedia.org/wiki/Mercalli_intensity_scale
-            rgb = mmi_colour(mmi_value)
-
-            # Now update the feature
-            feature_id = feature.id()
-            layer.changeAttributeValue(
-                feature_id, fields.indexFromName('X'), x)
-            layer.changeAttributeValue(
-                feature_id, fields.indexFromName('Y'), y)
-            layer.changeAttributeValue(
-                feature_id, fields.indexFromName('RGB'), rgb)
-            layer.changeAttributeValue(
-                feature_id, fields.indexFromName('ROMAN'), roman)
-            layer.changeAttributeValue(
-                feature_id, fields.indexFromName('ALIGN'), 'Center')
-            layer.changeAttributeValue(
-                feature_id, fields.indexFromName('VALIGN'), 'HALF')
-            layer.changeAttributeValue(
-                feature_id, fields.indexFromName('LEN'), length)
-
-        layer.commitChanges()
+            if mmi_value not in labels:
+                # We only want labels on the whole number contours
+                if mmi_value != round(mmi_value):
+                    roman = ''
+                else:
+                    roman = romanise(mmi_value)
+                labels[mmi_value] = roman, mmi_colour(mmi_value)
+            roman, rgb = labels[mmi_value]
+
+            changes[feature.id()] = {
+                index['X']: x,
+                index['Y']: y,
+                index['RGB']: rgb,
+                index['ROMAN']: roman,
+                index['ALIGN']: 'Center',
+                index['VALIGN']: 'HALF',
+                index['LEN']: geometry.length(),
+            }
+
+        # Now update all features at once
+        provider.changeAttributeValues(changes)
 
     def create_keyword_file(self, algorithm):
         """Create keyword file for the raster file created.
@@ -890,6 +928,183 @@ class ShakeGrid(object):
         keyword_io.write_keywords(hazard_layer, keywords)
 
 
+class GridXmlReader(object):
+    """Incremental reader of a shakemap grid.xml file.
+
+    The file is read with expat by chunks. Attributes of the event and
+    grid_specification elements are kept and the text of grid_data is
+    converted by batches of lines to a numpy structured array. No DOM and no
+    Python object per row are created.
+
+    With keep_text, the lon, lat and mmi values of grid_data are kept as
+    text lines instead, exactly as they are written in the file.
+    """
+
+    # Columns we keep from grid_data, with their default index.
+    columns = [('LON', 'lon', 0), ('LAT', 'lat', 1), ('MMI', 'mmi', 4)]
+
+    # Size in bytes of the text converted at once.
+    batch_size = 1 << 20
+
+    def __init__(self, keep_text=False):
+        """Constructor.
+
+        :param keep_text: If we keep the lines of grid_data as text, with
+            the lon, lat and mmi values separated by commas, instead of the
+            structured array.
+        :type keep_text: bool
+        """
+        self.event = None
+        self.specification = None
+        # key: the name of the grid field, value: the index of the column
+        self.fields = {}
+        # number of values in a row of grid_data
+        self._row_size = None
+        self._in_data = False
+        self._pending = []
+        self._pending_size = 0
+        self._batches = []
+        self.text_lines = [] if keep_text else None
+
+    def read(self, grid_file):
+        """Read a grid.xml file.
+
+        :param grid_file: The file opened in binary mode.
+        :type grid_file: file
+        """
+        parser = expat.ParserCreate()
+        parser.buffer_text = True
+        parser.buffer_size = self.batch_size
+        parser.StartElementHandler = self._start_element
+        parser.EndElementHandler = self._end_element
+        parser.CharacterDataHandler = self._character_data
+        parser.ParseFile(grid_file)
+
+        if self.event is None:
+            raise GridXmlParseError('The event element is missing.')
+        if self.specification is None:
+            raise GridXmlParseError(
+                'The grid_specification element is missing.')
+
+    def data(self):
+        """The grid data.
+
+        :returns: Structured array with the lon, lat and mmi fields.
+        :rtype: numpy.ndarray
+        """
+        dtype = [(name, numpy.float64) for _, name, _ in self.columns]
+        if not self._batches:
+            return numpy.zeros(0, dtype=dtype)
+        return numpy.concatenate(self._batches)
+
+    def _start_element(self, name, attributes):
+        """Expat handler called when an element starts."""
+        if name == 'event':
+            self.event = attributes
+        elif name == 'grid_specification':
+            self.specification = attributes
+        elif name == 'grid_field':
+            self.fields[attributes['name']] = int(attributes['index']) - 1
+        elif name == 'grid_data':
+            self._in_data = True
+
+    def _end_element(self, name):
+        """Expat handler called when an element ends."""
+        if name == 'grid_data':
+            self._convert(''.join(self._pending))
+            self._pending = []
+            self._pending_size = 0
+            self._in_data = False
+
+    def _character_data(self, text):
+        """Expat handler called with the text of an element."""
+        if not self._in_data:
+            return
+        self._pending.append(text)
+        self._pending_size += len(text)
+        if self._pending_size < self.batch_size:
+            return
+
+        # Convert complete lines only, we keep the last partial line.
+        text = ''.join(self._pending)
+        position = text.rfind('\n') + 1
+        self._convert(text[:position])
+        self._pending = [text[position:]]
+        self._pending_size = len(text) - position
+
+    def _convert(self, text):
+        """Convert complete lines of grid_data to the structured array.
+
+        :param text: Lines of grid_data.
+        :type text: basestring
+        """
+        if not text.strip():
+            return
+
+        indexes = [
+            self.fields.get(field, default_index)
+            for field, _, default_index in self.columns]
+        row_size = self._data_row_size(text, max(indexes) + 1)
+
+        if self.text_lines is not None:
+            for line in text.split('\n'):
+                if not line:
+                    continue
+                tokens = line.split(' ')
+                if len(tokens) < row_size:
+                    raise GridXmlParseError(
+                        'Each row of grid_data must have %s values.'
+                        % row_size)
+                self.text_lines.append(
+                    ','.join(tokens[index] for index in indexes))
+            return
+
+        # Expat gives unicode, numpy needs the bytes of the text.
+        values = numpy.fromstring(
+            text.encode('utf-8'), dtype=numpy.float64, sep=' ')
+
+        if values.size % row_size:
+            raise GridXmlParseError(
+                'Each row of grid_data must have %s values.' % row_size)
+        rows = values.reshape(-1, row_size)
+
+        dtype = [(name, numpy.float64) for _, name, _ in self.columns]
+        batch = numpy.empty(rows.shape[0], dtype=dtype)
+        for name, index in zip(batch.dtype.names, indexes):
+            batch[name] = rows[:, index]
+        self._batches.append(batch)
+
+    def _data_row_size(self, text, minimum):
+        """Get the number of values in a row of grid_data.
+
+        It is the number of grid_field elements. Without them, the default
+        indexes of the columns are used and the first line of grid_data
+        gives the number of values.
+
+        :param text: Lines of grid_data.
+        :type text: basestring
+
+        :param minimum: The number of values needed to read the columns.
+        :type minimum: int
+
+        :returns: The number of values in a row.
+        :rtype: int
+
+        :raises: GridXmlParseError
+        """
+        if self._row_size is None:
+            if self.fields:
+                self._row_size = len(self.fields)
+            else:
+                first_line = text.strip().split('\n', 1)[0]
+                self._row_size = len(first_line.split())
+            if self._row_size < minimum:
+                raise GridXmlParseError(
+                    'Each row of grid_data must have at least %s values.'
+                    % minimum)
+        return self._row_size
+
+
 def convert_mmi_data(
         grid_xml_path,
         title,
@@ -20,12 +20,16 @@ __copyright__ = ('Copyright 2012, Australia Indonesia Facility for '
 import os
 import unittest
 import shutil
+from StringIO import StringIO
 
+from osgeo import gdal
 from qgis.core import QgsVectorLayer
+from safe.common.exceptions import GridXmlParseError
 from safe.common.utilities import unique_filename, temp_dir
 from safe.test.utilities import standard_data_path, get_qgis_app
 from safe.gui.tools.shake_grid.shake_grid import (
     ShakeGrid,
+    GridXmlReader,
     convert_mmi_data)
 
 QGIS_APP, CANVAS, IFACE, PARENT = get_qgis_app()
@@ -123,6 +127,11 @@ class ShakeGridTest(unittest.TestCase):
 
         grid_xml_data = SHAKE_GRID.mmi_data
         self.assertEquals(10201, len(grid_xml_data))
+        self.assertEquals(('lon', 'lat', 'mmi'), grid_xml_data.dtype.names)
+        self.assertEquals(
+            (139.37, -1.1813, 1.0), tuple(grid_xml_data[0].tolist()))
+        self.assertEquals(
+            (141.87, -3.6787, 1.0), tuple(grid_xml_data[-1].tolist()))
 
         # Check SHAKE_GRID.grid_bounding_box
         bounds = SHAKE_GRID.grid_bounding_box.toString()
@@ -132,6 +141,33 @@ class ShakeGridTest(unittest.TestCase):
         message = 'Got:\n%s\nExpected:\n%s\n' % (bounds, expected_result)
         self.assertEqual(bounds, expected_result, message)
 
+    def test_grid_without_grid_field(self):
+        """Test the default columns are used without grid_field."""
+        with open(GRID_PATH, 'rb') as grid_file:
+            lines = [
+                line for line in grid_file if '<grid_field ' not in line]
+
+        reader = GridXmlReader()
+        reader.read(StringIO(''.join(lines)))
+        self.assertEqual({}, reader.fields)
+        self.assertEqual(
+            SHAKE_GRID.mmi_data.tolist(), reader.data().tolist())
+
+        reader = GridXmlReader(keep_text=True)
+        reader.read(StringIO(''.join(lines)))
+        self.assertEqual('139.3700,-01.1813,1', reader.text_lines[0])
+
+        # The MMI column is the fifth one.
+        start = lines.index('<grid_data>\n') + 1
+        end = lines.index('</grid_data>\n')
+        short_lines = [
+            ' '.join(line.split()[:4]) + '\n' for line in lines[start:end]]
+        grid = ''.join(lines[:start] + short_lines + lines[end:])
+        for keep_text in (False, True):
+            reader = GridXmlReader(keep_text)
+            with self.assertRaises(GridXmlParseError):
+                reader.read(StringIO(grid))
+
     def test_grid_file_path(self):
         """Test grid_file_path works properly."""
         grid_path = SHAKE_GRID.grid_file_path()
@@ -144,6 +180,8 @@ class ShakeGridTest(unittest.TestCase):
         """Test mmi_to_delimited_text works."""
         delimited_string = SHAKE_GRID.mmi_to_delimited_text()
         self.assertEqual(204869, len(delimited_string))
+        self.assertTrue(
+            delimited_string.startswith('lon,lat,mmi\n139.3700,-01.1813,1\n'))
 
     def test_mmi_to_delimited_file(self):
         """Test mmi_to_delimited_file works."""
@@ -174,6 +212,25 @@ class ShakeGridTest(unittest.TestCase):
         expected_keywords = raster_path.replace('tif', 'xml')
         self.assertTrue(os.path.exists(expected_keywords))
 
+    def test_mmi_to_array(self):
+        """Check the grid data is a full lattice for the nearest raster."""
+        mmi_grid = SHAKE_GRID.mmi_to_array()
+        self.assertEqual((101, 101), mmi_grid.shape)
+        self.assertEqual(
+            SHAKE_GRID.mmi_data['mmi'][0], mmi_grid[0, 0])
+        self.assertEqual(
+            SHAKE_GRID.mmi_data['mmi'][-1], mmi_grid[-1, -1])
+
+        raster_path = SHAKE_GRID.mmi_to_raster(
+            force_flag=True, algorithm='nearest')
+        dataset = gdal.Open(raster_path)
+        self.assertEqual(101, dataset.RasterXSize)
+        self.assertEqual(101, dataset.RasterYSize)
+        self.assertEqual(
+            mmi_grid.tolist(),
+            dataset.GetRasterBand(1).ReadAsArray().tolist())
+        del dataset
+
     def test_mmi_to_shapefile(self):
         """Check we can convert the shake event to a shapefile."""
         # Check the shp file
@@ -200,6 +257,12 @@ class ShakeGridTest(unittest.TestCase):
         file_path = SHAKE_GRID.mmi_to_contours(
             force_flag=True, algorithm='nearest')
         self.assertTrue(self.check_feature_count(file_path, 132))
+        layer = QgsVectorLayer(file_path, 'Contours', 'ogr')
+        for feature in layer.getFeatures():
+            self.assertEqual('Center', feature['ALIGN'])
+            self.assertEqual('HALF', feature['VALIGN'])
+            if feature['MMI'] == round(feature['MMI']):
+                self.assertNotEqual('', feature['ROMAN'])
         file_path = SHAKE_GRID.mmi_to_contours(
             force_flag=True, algorithm='average')
         self.assertTrue(self.check_feature_count(file_path, 132))
@@ -16,7 +16,12 @@ from safe.definitions.fields import (
     analysis_id_field,
     analysis_name_field,
     profiling_function_field,
-    profiling_time_field
+    profiling_time_field,
+    profiling_features_in_field,
+    profiling_features_out_field,
+    profiling_vertices_out_field,
+    profiling_memory_field,
+    profiling_peak_memory_field,
 )
 from safe.definitions.constants import inasafe_keyword_version_key
 from safe.definitions.versions import inasafe_keyword_version
@@ -129,16 +134,22 @@ def create_analysis_layer(analysis_extent, crs, name):
 def create_profile_layer(profiling):
     """Create a tabular layer with the profiling.
 
-    :param profiling: A dict containing benchmarking data.
-    :type profiling: safe.messaging.message.Message
+    :param profiling: The root of the profiling tree.
+    :type profiling: safe.utilities.profiling.Tree
 
     :return: A tabular layer.
     :rtype: QgsVectorLayer
     """
-    fields = [
-        create_field_from_definition(profiling_function_field),
-        create_field_from_definition(profiling_time_field)
+    definitions = [
+        profiling_function_field,
+        profiling_time_field,
+        profiling_features_in_field,
+        profiling_features_out_field,
+        profiling_vertices_out_field,
+        profiling_memory_field,
+        profiling_peak_memory_field,
     ]
+    fields = [create_field_from_definition(field) for field in definitions]
     tabular = create_memory_layer('profiling', QGis.NoGeometry, fields=fields)
 
     # Generate profiling keywords
@@ -146,23 +157,28 @@ def create_profile_layer(profiling):
     tabular.keywords['title'] = layer_purpose_profiling['name']
     tabular.setLayerName(tabular.keywords['title'])
     tabular.keywords['inasafe_fields'] = {
-        profiling_function_field['key']:
-            profiling_function_field['field_name'],
-        profiling_time_field['key']:
-            profiling_time_field['field_name']
+        field['key']: field['field_name'] for field in definitions
     }
     tabular.keywords[inasafe_keyword_version_key] = (
         inasafe_keyword_version)
 
-    table = profiling.to_text().splitlines()[3:]
-    tabular.startEditing()
-    for line in table:
-        feature = QgsFeature()
-        items = line.split(', ')
-        time = items[1].replace('-', '')
-        feature.setAttributes([items[0], time])
-        tabular.addFeature(feature)
+    features = []
+    if profiling is not None:
+        for label, node in profiling.rows():
+            feature = QgsFeature()
+            feature.setAttributes([
+                label,
+                node.elapsed_time,
+                node.features_in,
+                node.features_out,
+                node.vertices_out,
+                node.memory_delta,
+                node.peak_memory,
+            ])
+            features.append(feature)
 
+    tabular.startEditing()
+    tabular.addFeatures(features)
     tabular.commitChanges()
     return tabular
 
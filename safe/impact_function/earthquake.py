@@ -4,7 +4,8 @@
 
 import logging
 
-from osgeo import gdal, gdalconst
+import numpy as np
+from osgeo import gdal
 from qgis.core import (
     QGis,
     QgsCoordinateReferenceSystem,
@@ -18,7 +19,7 @@ from qgis.core import (
     QgsVectorFileWriter,
 )
 
-from safe.definitions.utilities import definition
+from safe.definitions.utilities import definition, class_for_value
 from safe.definitions.fields import (
     aggregation_id_field,
     population_count_field,
@@ -33,8 +34,9 @@ from safe.definitions.layer_purposes import (
     layer_purpose_aggregation_summary, layer_purpose_exposure_summary)
 from safe.definitions.processing_steps import earthquake_displaced
 from safe.gis.vector.tools import create_field_from_definition
-from safe.gis.raster.write_raster import array_to_raster, make_array
-from safe.common.utilities import unique_filename
+from safe.gis.raster.storage import intermediate_filename
+from safe.gis.raster.tiles import band_windows
+from safe.gis.raster.write_raster import empty_raster_like
 from safe.utilities.profiling import profile
 
 __copyright__ = "Copyright 2016, The InaSAFE Project"
@@ -57,12 +59,9 @@ def from_mmi_to_hazard_class(mmi_level, classification_key):
     :return: The hazard class key
     :rtype: basestring
     """
-    classes = definition(classification_key)['classes']
-    for hazard_class in classes:
-        minimum = hazard_class['numeric_default_min']
-        maximum = hazard_class['numeric_default_max']
-        if minimum < mmi_level <= maximum:
-            return hazard_class['key']
+    hazard_class = class_for_value(classification_key, mmi_level)
+    if hazard_class:
+        return hazard_class['key']
     return None
 
 
@@ -78,12 +77,9 @@ def displacement_rate(mmi_level, classification_key):
     :return: The displacement rate.
     :rtype: float
     """
-    classes = definition(classification_key)['classes']
-    for hazard_class in classes:
-        minimum = hazard_class['numeric_default_min']
-        maximum = hazard_class['numeric_default_max']
-        if minimum < mmi_level <= maximum:
-            return hazard_class['displacement_rate']
+    hazard_class = class_for_value(classification_key, mmi_level)
+    if hazard_class:
+        return hazard_class['displacement_rate']
     return 0.0
 
 
@@ -99,15 +95,118 @@ def fatality_rate(mmi_level, classification_key):
     :return: The fatality rate.
     :rtype: float
     """
-    classes = definition(classification_key)['classes']
-    for hazard_class in classes:
-        minimum = hazard_class['numeric_default_min']
-        maximum = hazard_class['numeric_default_max']
-        if minimum < mmi_level <= maximum:
-            return hazard_class['fatality_rate']
+    hazard_class = class_for_value(classification_key, mmi_level)
+    if hazard_class:
+        return hazard_class['fatality_rate']
     return 0.0
 
 
+def rate_lookup_table(classification_key, rate_function):
+    """Build an array giving a rate for each integer MMI level.
+
+    The table is built once per classification so that rates can be fetched
+    for a whole raster with a single fancy indexing operation. The last
+    entry of the table is above every class, so its rate is the default one
+    given by the rate function. Callers should clip their MMI levels to
+    the last index of the table.
+
+    :param classification_key: The earthquake classification key.
+    :type classification_key: safe.definitions.hazard_classifications
+
+    :param rate_function: The function giving the rate for one MMI level,
+        such as fatality_rate or displacement_rate.
+    :type rate_function: function
+
+    :return: The lookup table, indexed by the MMI level.
+    :rtype: numpy.array
+    """
+    classes = definition(classification_key)['classes']
+    highest = max(
+        hazard_class['numeric_default_max'] for hazard_class in classes)
+    size = int(np.ceil(highest)) + 2
+    return np.array(
+        [rate_function(mmi, classification_key) for mmi in xrange(size)],
+        dtype=np.float64)
+
+
+def exposed_people_arrays(
+        hazard_array,
+        exposure_array,
+        aggregation_array,
+        fatality_table,
+        displacement_table):
+    """Compute exposed and displaced people with numpy arrays.
+
+    The three arrays must be aligned on the same grid. It's the vectorized
+    version of walking the rasters pixel by pixel.
+
+    :param hazard_array: MMI values.
+    :type hazard_array: numpy.array
+
+    :param exposure_array: Population counts.
+    :type exposure_array: numpy.array
+
+    :param aggregation_array: Aggregation zone IDs.
+    :type aggregation_array: numpy.array
+
+    :param fatality_table: Fatality rates per integer MMI level.
+    :type fatality_table: numpy.array
+
+    :param displacement_table: Displacement rates per integer MMI level.
+    :type displacement_table: numpy.array
+
+    :return: A tuple with the exposed dictionary and the displaced array.
+        Dictionary key: tuple (mmi, agg_zone), value: number of exposed people
+        Pixels outside of the hazard or the aggregation are set to -1 in the
+        displaced array.
+    :rtype: (dict, numpy.array)
+    """
+    hazard_array = np.asarray(hazard_array, dtype=np.float64)
+    exposure_array = np.asarray(exposure_array, dtype=np.float64)
+    # Same truncation as int() on each value.
+    aggregation_array = np.asarray(aggregation_array).astype(np.int64)
+
+    valid = (hazard_array >= 2.0) & (exposure_array >= 0.0)
+
+    # Same as int(round(value)) for the positive MMI levels we keep.
+    mmi = np.zeros(hazard_array.shape, dtype=np.int64)
+    mmi[valid] = np.floor(hazard_array[valid] + 0.5)
+
+    last_index = min(len(fatality_table), len(displacement_table)) - 1
+    lookup = np.minimum(mmi, last_index)
+    # Rounding down, as with int() for positive values.
+    fatalities = np.floor(mmi * fatality_table[lookup])
+    displaced = (exposure_array - fatalities) * displacement_table[lookup]
+
+    # We build a raster only for the aggregation area.
+    displaced_array = np.where(
+        valid & (aggregation_array > 0), displaced, -1)
+
+    exposed = {}
+    if not valid.any():
+        return exposed, displaced_array
+
+    mmi_valid = mmi[valid]
+    aggregation_valid = aggregation_array[valid]
+    exposure_valid = exposure_array[valid]
+
+    # Aggregation IDs can be big and sparse, they are factorized before
+    # encoding each (mmi, aggregation zone) pair as a single integer.
+    mmi_levels, mmi_codes = np.unique(mmi_valid, return_inverse=True)
+    zones, zone_codes = np.unique(aggregation_valid, return_inverse=True)
+    codes = mmi_codes * len(zones) + zone_codes
+
+    pixels = np.bincount(codes)
+    people = np.bincount(codes, weights=exposure_valid)
+    for code in np.flatnonzero(pixels):
+        key = (
+            int(mmi_levels[code // len(zones)]),
+            int(zones[code % len(zones)]))
+        exposed[key] = float(people[code])
+
+    return exposed, displaced_array
+
+
 @profile
 def exposed_people_stats(hazard, exposure, aggregation):
     """Calculate the number of exposed people per MMI level per aggregation.
@@ -131,64 +230,50 @@ def exposed_people_stats(hazard, exposure, aggregation):
     """
     output_layer_name = earthquake_displaced['output_layer_name']
     processing_step = earthquake_displaced['step_name']
-    exposed_raster_filename = unique_filename(
+    exposed_raster_filename = intermediate_filename(
         prefix=output_layer_name, suffix='.tif')
 
-    hazard_provider = hazard.dataProvider()
-    extent = hazard.extent()
-    width, height = hazard_provider.xSize(), hazard_provider.ySize()
-    hazard_block = hazard_provider.block(1, extent, width, height)
-
-    exposure_provider = exposure.dataProvider()
-    exposure_block = exposure_provider.block(1, extent, width, height)
-
-    agg_provider = aggregation.dataProvider()
-    agg_block = agg_provider.block(1, extent, width, height)
-
-    exposed = {}  # key: tuple (mmi, agg_zone), value: number of exposed people
-
-    exposed_array = make_array(width, height)
-
     classification_key = hazard.keywords['classification']
+    fatality_table = rate_lookup_table(classification_key, fatality_rate)
+    displacement_table = rate_lookup_table(
+        classification_key, displacement_rate)
 
-    # walk through the rasters pixel by pixel and aggregate numbers
-    # of people in the combination of hazard zones and aggregation zones
-    for i in xrange(width * height):
-        hazard_mmi = hazard_block.value(long(i))
-        people_count = exposure_block.value(long(i))
-        agg_zone_index = int(agg_block.value(long(i)))
-
-        if hazard_mmi >= 2.0 and people_count >= 0.0:
-            hazard_mmi = int(round(hazard_mmi))
-            mmi_fatality_rate = fatality_rate(hazard_mmi, classification_key)
-            mmi_fatalities = int(  # rounding down
-                hazard_mmi * mmi_fatality_rate)
-            mmi_displaced = (
-                (people_count - mmi_fatalities) *
-                displacement_rate(hazard_mmi, classification_key))
-
-            key = (hazard_mmi, agg_zone_index)
-            if key not in exposed:
-                exposed[key] = 0
-
-            exposed[key] += people_count
-        else:
-            # If hazard is less than 2 or population is less than 0
-            mmi_displaced = -1
-
-        # We build a raster only for the aggregation area.
-        if agg_zone_index > 0:
-            exposed_array[i / width, i % width] = mmi_displaced
-        else:
-            exposed_array[i / width, i % width] = -1
+    hazard_dataset = gdal.Open(hazard.source())
+    exposure_dataset = gdal.Open(exposure.source())
+    aggregation_dataset = gdal.Open(aggregation.source())
+    hazard_band = hazard_dataset.GetRasterBand(1)
+    exposure_band = exposure_dataset.GetRasterBand(1)
+    aggregation_band = aggregation_dataset.GetRasterBand(1)
 
     # output raster data - e.g. displaced people
-    array_to_raster(exposed_array, exposed_raster_filename, hazard)
+    exposed_dataset = empty_raster_like(exposed_raster_filename, hazard)
+    exposed_band = exposed_dataset.GetRasterBand(1)
+    exposed_band.SetNoDataValue(-1)
+
+    exposed = {}  # key: tuple (mmi, agg_zone), value: number of exposed people
 
-    # I didn't find a way to do that with the QGIS API.
-    data = gdal.Open(exposed_raster_filename, gdalconst.GA_Update)
-    data.GetRasterBand(1).SetNoDataValue(-1)
-    del data
+    # The three rasters are aligned on the same grid. We walk through them
+    # window by window so the memory used doesn't depend on the raster size
+    # and aggregate numbers of people in the combination of hazard zones and
+    # aggregation zones.
+    for x_offset, y_offset, x_size, y_size in band_windows(hazard_band):
+        window = (x_offset, y_offset, x_size, y_size)
+        exposed_window, exposed_array = exposed_people_arrays(
+            hazard_band.ReadAsArray(*window),
+            exposure_band.ReadAsArray(*window),
+            aggregation_band.ReadAsArray(*window),
+            fatality_table,
+            displacement_table)
+
+        for key, count in exposed_window.iteritems():
+            exposed[key] = exposed.get(key, 0) + count
+
+        exposed_band.WriteArray(exposed_array, x_offset, y_offset)
+
+    exposed_dataset.FlushCache()
+    del exposed_band, exposed_dataset
+    del hazard_band, exposure_band, aggregation_band
+    del hazard_dataset, exposure_dataset, aggregation_dataset
 
     exposed_raster = QgsRasterLayer(exposed_raster_filename, 'exposed', 'gdal')
     assert exposed_raster.isValid()
@@ -3,6 +3,7 @@
 """Impact Function."""
 
 import getpass
+import json
 import platform
 from datetime import datetime
 from os.path import join, exists
@@ -28,6 +29,7 @@ import logging
 from safe.common.utilities import temp_dir
 from safe.common.version import get_version
 from safe.datastore.folder import Folder
+from safe.datastore.geopackage import GeoPackage
 from safe.datastore.datastore import DataStore
 from safe.gis.sanity_check import check_inasafe_fields, check_layer
 from safe.gis.vector.tools import remove_fields
@@ -50,6 +52,7 @@ from safe.gis.vector.summary_33_eq_raster_analysis import (
     analysis_eartquake_summary)
 from safe.gis.vector.summary_4_exposure_summary_table import (
     exposure_summary_table)
+from safe.gis.vector.summary_tools import layer_rows
 from safe.gis.vector.recompute_counts import recompute_counts
 from safe.gis.vector.update_value_map import update_value_map
 from safe.gis.raster.clip_bounding_box import clip_by_extent
@@ -58,6 +61,7 @@ from safe.gis.raster.polygonize import polygonize
 from safe.gis.raster.zonal_statistics import zonal_stats
 from safe.gis.raster.align import align_rasters
 from safe.gis.raster.rasterize import rasterize_vector_layer
+from safe.gis.raster.storage import IntermediateFiles
 from safe.definitions.post_processors import post_processors
 from safe.definitions.analysis_steps import analysis_steps
 from safe.definitions.utilities import definition
@@ -107,8 +111,7 @@ from safe.impact_function.earthquake import (
     exposed_people_stats,
     make_summary_layer,
 )
-from safe.impact_function.postprocessors import (
-    run_single_post_processor, enough_input)
+from safe.impact_function.postprocessors import run_post_processors
 from safe.impact_function.create_extra_layers import (
     create_analysis_layer,
     create_virtual_aggregation,
@@ -131,7 +134,8 @@ from safe.utilities.metadata import (
 from safe.utilities.utilities import (
     replace_accentuated_characters, get_error_message)
 from safe.utilities.profiling import (
-    profile, clear_prof_data, profiling_log)
+    Profiler, profile)
+from safe.definitions.default_settings import inasafe_default_settings
 from safe.utilities.settings import setting
 from safe import messaging as m
 from safe.messaging import styles
@@ -197,7 +201,8 @@ class ImpactFunction(object):
 
         # Metadata on the IF
         self.state = {}
-        self._performance_log = None
+        self._profiler = Profiler()
+        self._intermediate_files = IntermediateFiles()
         self.reset_state()
         self._is_ready = False
         self._provenance_ready = False
@@ -225,10 +230,10 @@ class ImpactFunction(object):
     def performance_log(self):
         """Property for the performance log that can be used for benchmarking.
 
-        :returns: A dict containing benchmarking data.
-        :rtype: dict
+        :returns: The root of the profiling tree.
+        :rtype: safe.utilities.profiling.Tree
         """
-        return self._performance_log
+        return self._profiler.root
 
     def performance_log_message(self):
         """Return the profiling log as a message."""
@@ -237,38 +242,32 @@ class ImpactFunction(object):
         row = m.Row()
         row.add(m.Cell(tr('Function')), header_flag=True)
         row.add(m.Cell(tr('Time')), header_flag=True)
+        row.add(m.Cell(tr('Features in')), header_flag=True)
+        row.add(m.Cell(tr('Features out')), header_flag=True)
+        row.add(m.Cell(tr('Vertices out')), header_flag=True)
+        row.add(m.Cell(tr('Memory (MB)')), header_flag=True)
+        row.add(m.Cell(tr('Peak memory (MB)')), header_flag=True)
         table.add(row)
 
         if self.performance_log is None:
             message.add(table)
             return message
 
-        indent = -1
-
-        def display_tree(tree, space):
-            space += 1
+        for label, tree in self.performance_log.rows():
             new_row = m.Row()
-
-            # This is a kind of hack to display the tree with indentation
-            text = '|'
-            text += '*' * space
-
-            if tree.children:
-                text += '\ '
-            else:
-                text += '| '
-            text += tree.__str__()
-
-            new_row.add(m.Cell(text))
+            new_row.add(m.Cell(label))
             new_row.add(m.Cell(tree.elapsed_time))
+            # Counters are None if they are not relevant for the function.
+            counters = [
+                tree.features_in,
+                tree.features_out,
+                tree.vertices_out,
+                tree.memory_delta,
+                tree.peak_memory]
+            for value in counters:
+                new_row.add(m.Cell('' if value is None else value))
             table.add(new_row)
-            if tree.children:
-                for child in tree.children:
-                    display_tree(child, space)
-            space -= 1
 
-        # noinspection PyTypeChecker
-        display_tree(self.performance_log, indent)
         message.add(table)
 
         return message
@@ -648,6 +647,14 @@ class ImpactFunction(object):
         LOGGER.info('%s: %s' % (context, process))
         self.state[context]["process"].append(process)
 
+        # Each process is a step in the profiling.
+        layers = {
+            'hazard': self._hazard,
+            'exposure': self._exposure,
+            'aggregation': self._aggregation
+        }
+        self._profiler.start_step(context, process, layers.get(context))
+
     def set_state_info(self, context, key, value):
         """Method to add information for a context in the IF state.
 
@@ -1019,6 +1026,9 @@ class ImpactFunction(object):
         # This one checks the memory layer.
         check_layer(layer, has_geometry=None)
 
+        # The layer is the output of the current step.
+        self._profiler.step_output(layer)
+
         if isinstance(layer, QgsVectorLayer) and check_fields:
             check_inasafe_fields(layer)
 
@@ -1066,22 +1076,30 @@ class ImpactFunction(object):
 
         try:
             self.reset_state()
-            clear_prof_data()
-            self._run()
+            self._profiler.clear()
+            self._profiler.count_vertices = self.debug_mode or setting(
+                'profiling_vertex_count',
+                inasafe_default_settings['profiling_vertex_count'],
+                bool)
+            # Outputs of the previous run are in its datastore. We can free
+            # intermediate files it kept in memory.
+            if self._datastore:
+                self._datastore.wait()
+            self._intermediate_files.release()
+            with self._profiler, self._intermediate_files:
+                self._run()
 
-            # Get the profiling log
-            self._performance_log = profiling_log()
             self.callback(8, 8, analysis_steps['profiling'])
 
             self._profiling_table = create_profile_layer(
-                self.performance_log_message())
-            result, name = self.datastore.add_layer(
+                self.performance_log)
+            self._write_profiling()
+            self._profiling_table = self.datastore.add_layer_async(
                 self._profiling_table, self._profiling_table.keywords['title'])
-            if not result:
-                raise Exception(
-                    'Something went wrong with the datastore : {error_message}'
-                    .format(error_message=name))
-            self._profiling_table = self.datastore.layer(name)
+
+            # Outputs are still written in the background. Styling and
+            # reports use them from memory, callers needing the datastore
+            # URIs must call datastore.wait().
 
             # Later, we should move this call.
             self.style()
@@ -1169,6 +1187,26 @@ class ImpactFunction(object):
         else:
             return ANALYSIS_SUCCESS, None
 
+    def _write_profiling(self):
+        """Write the profiling as JSON next to the outputs.
+
+        Files from different versions of InaSAFE can be compared to track
+        performance regressions.
+        """
+        profiling = {
+            'unique_name': self._unique_name,
+            'datetime': self._datetime.isoformat(),
+            'host_name': self._provenance['host_name'],
+            'inasafe_version': self._provenance['inasafe_version'],
+            'qgis_version': self._provenance['qgis_version'],
+            'profiling': self.performance_log.to_dict()
+        }
+        path = join(
+            self.datastore.uri_path, '%s_profiling.json' % self._unique_name)
+        with open(path, 'w') as json_file:
+            json.dump(profiling, json_file, indent=2)
+        LOGGER.info('Profiling written to %s' % path)
+
     @profile
     def _run(self):
         """Internal function to run the impact function with profiling."""
@@ -1198,11 +1236,21 @@ class ImpactFunction(object):
                 path = join(default_user_directory, self._unique_name)
                 if not exists(path):
                     makedirs(path)
-                self._datastore = Folder(path)
             else:
-                self._datastore = Folder(temp_dir(sub_dir=self._unique_name))
-
-            self._datastore.default_vector_format = 'geojson'
+                path = temp_dir(sub_dir=self._unique_name)
+
+            default_datastore = setting(
+                'default_datastore',
+                inasafe_default_settings['default_datastore'],
+                str)
+            if (default_datastore == 'geopackage' and
+                    GeoPackage.supports_gridded_coverage()):
+                # A single file, next to the folder for the reports.
+                self._datastore = GeoPackage(
+                    join(path, '%s.gpkg' % self._unique_name))
+            else:
+                self._datastore = Folder(path)
+                self._datastore.default_vector_format = 'geojson'
         LOGGER.info('Datastore : %s' % self.datastore.uri_path)
 
         if self.debug_mode:
@@ -1213,7 +1261,6 @@ class ImpactFunction(object):
             if self.aggregation:
                 self.datastore.add_layer(self.aggregation, 'aggregation')
 
-        self._performance_log = profiling_log()
         self.callback(2, step_count, analysis_steps['aggregation_preparation'])
         self.aggregation_preparation()
 
@@ -1230,7 +1277,6 @@ class ImpactFunction(object):
         else:
             self.gis_overlay_analysis()
 
-        self._performance_log = profiling_log()
         self.callback(7, step_count, analysis_steps['post_processing'])
         if is_vector_layer(self._exposure_summary):
             # We post process the exposure summary
@@ -1245,7 +1291,6 @@ class ImpactFunction(object):
                 # Earthquake raster on population raster.
                 self.post_process(self._aggregation_summary)
 
-        self._performance_log = profiling_log()
         self.callback(8, step_count, analysis_steps['summary_calculation'])
         self.summary_calculation()
 
@@ -1254,75 +1299,50 @@ class ImpactFunction(object):
         self._generate_provenance()
 
         # End of the impact function, we can add layers to the datastore.
-        # We replace memory layers by the real layer from the datastore.
+        # They are written in the background while the analysis ends, layers
+        # are checked before because the writer thread reads them.
 
         # Exposure summary
         if self._exposure_summary:
             self._exposure_summary.keywords[
                 'provenance_data'] = self.provenance
-
-            result, name = self.datastore.add_layer(
+            self.debug_layer(self._exposure_summary, add_to_datastore=False)
+            self._exposure_summary = self.datastore.add_layer_async(
                 self._exposure_summary,
                 layer_purpose_exposure_summary['key'])
-            if not result:
-                raise Exception(
-                    tr('Something went wrong with the datastore : '
-                       '{error_message}').format(error_message=name))
-            self._exposure_summary = self.datastore.layer(name)
-            self.debug_layer(self._exposure_summary, add_to_datastore=False)
 
         # Aggregate hazard impacted
         if self.aggregate_hazard_impacted:
             self.aggregate_hazard_impacted.keywords[
                 'provenance_data'] = self.provenance
-            result, name = self.datastore.add_layer(
-                self._aggregate_hazard_impacted,
-                layer_purpose_aggregate_hazard_impacted['key'])
-            if not result:
-                raise Exception(
-                    tr('Something went wrong with the datastore : '
-                       '{error_message}').format(error_message=name))
-            self._aggregate_hazard_impacted = self.datastore.layer(name)
             self.debug_layer(
                 self._aggregate_hazard_impacted, add_to_datastore=False)
+            self._aggregate_hazard_impacted = self.datastore.add_layer_async(
+                self._aggregate_hazard_impacted,
+                layer_purpose_aggregate_hazard_impacted['key'])
 
         # Exposure summary table
         if self._exposure.keywords.get('classification'):
             self._exposure_summary_table.keywords[
                 'provenance_data'] = self.provenance
-            result, name = self.datastore.add_layer(
-                self._exposure_summary_table,
-                layer_purpose_exposure_summary_table['key'])
-            if not result:
-                raise Exception(
-                    tr('Something went wrong with the datastore : '
-                       '{error_message}').format(error_message=name))
-            self._exposure_summary_table = self.datastore.layer(name)
             self.debug_layer(
                 self._exposure_summary_table, add_to_datastore=False)
+            self._exposure_summary_table = self.datastore.add_layer_async(
+                self._exposure_summary_table,
+                layer_purpose_exposure_summary_table['key'])
 
         # Aggregation summary
         self.aggregation_summary.keywords['provenance_data'] = self.provenance
-        result, name = self.datastore.add_layer(
+        self.debug_layer(self._aggregation_summary, add_to_datastore=False)
+        self._aggregation_summary = self.datastore.add_layer_async(
             self._aggregation_summary,
             layer_purpose_aggregation_summary['key'])
-        if not result:
-            raise Exception(
-                tr('Something went wrong with the datastore : '
-                   '{error_message}').format(error_message=name))
-        self._aggregation_summary = self.datastore.layer(name)
-        self.debug_layer(self._aggregation_summary, add_to_datastore=False)
 
         # Analysis impacted
         self.analysis_impacted.keywords['provenance_data'] = self.provenance
-        result, name = self.datastore.add_layer(
-            self._analysis_impacted, layer_purpose_analysis_impacted['key'])
-        if not result:
-            raise Exception(
-                tr('Something went wrong with the datastore : '
-                   '{error_message}').format(error_message=name))
-        self._analysis_impacted = self.datastore.layer(name)
         self.debug_layer(self._analysis_impacted, add_to_datastore=False)
+        self._analysis_impacted = self.datastore.add_layer_async(
+            self._analysis_impacted, layer_purpose_analysis_impacted['key'])
 
     @profile
     def gis_overlay_analysis(self):
@@ -1333,20 +1353,16 @@ class ImpactFunction(object):
         self._earthquake_function = None
         step_count = len(analysis_steps)
 
-        self._performance_log = profiling_log()
         self.callback(3, step_count, analysis_steps['hazard_preparation'])
         self.hazard_preparation()
 
-        self._performance_log = profiling_log()
         self.callback(
             4, step_count, analysis_steps['aggregate_hazard_preparation'])
         self.aggregate_hazard_preparation()
 
-        self._performance_log = profiling_log()
         self.callback(5, step_count, analysis_steps['exposure_preparation'])
         self.exposure_preparation()
 
-        self._performance_log = profiling_log()
         self.callback(6, step_count, analysis_steps['combine_hazard_exposure'])
         self.intersect_exposure_and_aggregate_hazard()
 
@@ -1882,16 +1898,15 @@ class ImpactFunction(object):
             # On an aggregation layer, the default title does make any sense.
             layer_title(layer)
 
-        for post_processor in post_processors:
-            valid, message = enough_input(layer, post_processor['input'])
+        # Post processors are evaluated in order on columns, with a single
+        # pass on the layer and a single write back.
+        results = run_post_processors(layer, post_processors)
+        for post_processor, valid, message in results:
             name = get_unicode(post_processor['name'])
 
             if valid:
-                valid, message = run_single_post_processor(
-                    layer, post_processor)
-                if valid:
-                    self.set_state_process('post_processor', name)
-                    message = u'{name} : Running'.format(name=name)
+                self.set_state_process('post_processor', name)
+                message = u'{name} : Running'.format(name=name)
 
             else:
                 message = u'{name} : Could not run : {reason}'.format(
@@ -1918,11 +1933,15 @@ class ImpactFunction(object):
             self.debug_layer(self._exposure_summary, add_to_datastore=False)
 
         if self._aggregate_hazard_impacted:
+            # The next summaries are reductions of the aggregate hazard, we
+            # read it once for all of them.
+            rows = layer_rows(self._aggregate_hazard_impacted)
+
             self.set_state_process(
                 'impact function',
                 'Aggregate the aggregation summary')
             self._aggregation_summary = aggregation_summary(
-                self._aggregate_hazard_impacted, self.aggregation)
+                self._aggregate_hazard_impacted, self.aggregation, rows=rows)
             self.debug_layer(
                 self._aggregation_summary, add_to_datastore=False)
 
@@ -1930,7 +1949,9 @@ class ImpactFunction(object):
                 'impact function',
                 'Aggregate the analysis summary')
             self._analysis_impacted = analysis_summary(
-                self._aggregate_hazard_impacted, self._analysis_impacted)
+                self._aggregate_hazard_impacted,
+                self._analysis_impacted,
+                rows=rows)
             self.debug_layer(self._analysis_impacted)
 
             if self._exposure.keywords.get('classification'):
@@ -1938,7 +1959,7 @@ class ImpactFunction(object):
                     'impact function',
                     'Build the exposure summary table')
                 self._exposure_summary_table = exposure_summary_table(
-                    self._aggregate_hazard_impacted)
+                    self._aggregate_hazard_impacted, rows=rows)
                 self.debug_layer(
                     self._exposure_summary_table, add_to_datastore=False)
         else:
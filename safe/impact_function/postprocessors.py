@@ -2,9 +2,13 @@
 
 """Postprocessors."""
 
+import ast
+import numpy as np
 from PyQt4.QtCore import QPyNullVariant
 from qgis.core import QgsFeatureRequest
 
+from safe.common.exceptions import InvalidFormulaError
+from safe.definitions.constants import qvariant_whole_numbers
 from safe.definitions.minimum_needs import minimum_needs_parameter
 from safe.definitions.post_processors import (
     field_input_type,
@@ -26,8 +30,76 @@ __email__ = "info@inasafe.org"
 __revision__ = '$Format:%H$'
 
 
+# Nodes allowed in a post processor formula, only simple arithmetic.
+_formula_nodes = (
+    ast.Expression,
+    ast.BinOp,
+    ast.UnaryOp,
+    ast.Num,
+    ast.Name,
+    ast.Load,
+    ast.Add,
+    ast.Sub,
+    ast.Mult,
+    ast.Div,
+    ast.FloorDiv,
+    ast.Mod,
+    ast.Pow,
+    ast.UAdd,
+    ast.USub,
+)
+
+# Formulas already compiled, key: formula, value: code object.
+_compiled_formulas = {}
+
+
+def compile_formula(formula):
+    """Parse and compile a formula only once.
+
+    The formula can only use numbers, variables and arithmetic operators.
+
+    :param formula: A simple formula.
+    :type formula: str
+
+    :returns: The compiled formula.
+    :rtype: code
+
+    :raises: InvalidFormulaError
+    """
+    code = _compiled_formulas.get(formula)
+    if code is not None:
+        return code
+
+    try:
+        tree = ast.parse(formula, mode='eval')
+    except SyntaxError as e:
+        raise InvalidFormulaError(e)
+
+    for node in ast.walk(tree):
+        if not isinstance(node, _formula_nodes):
+            raise InvalidFormulaError(
+                'The formula %s is using %s which is not allowed.' % (
+                    formula, node.__class__.__name__))
+
+    code = compile(tree, '<formula>', 'eval')
+    _compiled_formulas[formula] = code
+    return code
+
+
+def _is_null(value):
+    """Check if a value will make the formula null.
+
+    :param value: The value.
+    :type value: QPyNullVariant, None, int, float
+
+    :returns: True if the value is null or zero.
+    :rtype: bool
+    """
+    return isinstance(value, QPyNullVariant) or not value
+
+
 def evaluate_formula(formula, variables):
-    """Very simple formula evaluator. Beware the security.
+    """Very simple formula evaluator.
 
     :param formula: A simple formula.
     :type formula: str
@@ -39,11 +111,200 @@ def evaluate_formula(formula, variables):
     :rtype: float, int
     """
     for key, value in variables.items():
-        if isinstance(value, QPyNullVariant) or not value:
+        if _is_null(value):
             # If one value is null, we return null.
             return value
-        formula = formula.replace(key, str(value))
-    return eval(formula)
+    return eval(compile_formula(formula), {'__builtins__': {}}, variables)
+
+
+def evaluate_formula_columns(formula, columns, constants, count):
+    """Evaluate a formula on whole columns of values at once.
+
+    The formula is evaluated only once with numpy arrays. Like with
+    evaluate_formula, if one value is null for a row, the result is null
+    for this row, and the result is an integer if all values are integers.
+
+    :param formula: A simple formula.
+    :type formula: str
+
+    :param columns: Values for each row, key: variable, value: list.
+    :type columns: dict
+
+    :param constants: Values shared by all rows, key: variable, value: value.
+    :type constants: dict
+
+    :param count: The number of rows.
+    :type count: int
+
+    :returns: The result of the formula for each row.
+    :rtype: list
+
+    :raises: ZeroDivisionError
+    """
+    code = compile_formula(formula)
+
+    for key, value in constants.items():
+        if _is_null(value):
+            # If one value is null, we return null.
+            return [value] * count
+
+    # Rows with a null value, and the first null value of each row.
+    null_mask = np.zeros(count, dtype=np.bool_)
+    null_values = [None] * count
+    for values in columns.values():
+        for row, value in enumerate(values):
+            if not null_mask[row] and _is_null(value):
+                null_mask[row] = True
+                null_values[row] = value
+
+    # The formula is evaluated only on rows without null.
+    valid_mask = ~null_mask
+    valid_count = int(valid_mask.sum())
+    variables = dict(constants)
+    for key, values in columns.items():
+        whole_numbers = all(
+            isinstance(value, (int, long))
+            for value, is_null in zip(values, null_mask) if not is_null)
+        dtype = np.int64 if whole_numbers else np.float64
+        array = np.zeros(count, dtype=dtype)
+        for row, value in enumerate(values):
+            if not null_mask[row]:
+                array[row] = value
+        variables[key] = array[valid_mask]
+
+    # Like python, a division by zero is an error, not inf or nan.
+    with np.errstate(divide='raise', invalid='raise'):
+        try:
+            value = eval(code, {'__builtins__': {}}, variables)
+        except FloatingPointError as e:
+            raise ZeroDivisionError(e)
+    value = np.asarray(value)
+    valid_results = np.empty(valid_count, dtype=value.dtype)
+    valid_results[:] = value
+    valid_results = iter(valid_results.tolist())
+
+    return [
+        null_values[row] if null_mask[row] else next(valid_results)
+        for row in xrange(count)]
+
+
+def _post_processor_inputs(layer, post_processor, field_names):
+    """Find where to read each input of a post processor.
+
+    :param layer: The vector layer to use for post processing.
+    :type layer: QgsVectorLayer
+
+    :param post_processor: A post processor definition.
+    :type post_processor: dict
+
+    :param field_names: The names of the fields we can read.
+    :type field_names: list
+
+    :returns: Tuple with True if success, else False, an error message,
+        inputs to read on each feature (key: input, value: the field name or
+        the geometry property key) and default parameters for all features.
+    :rtype: (bool, str, dict, dict)
+    """
+    inputs = {}
+
+    # Default parameters
+    default_parameters = {}
+
+    msg = None
+
+    for key, values in post_processor['input'].items():
+        values = values if isinstance(values, list) else [values]
+        for value in values:
+            is_constant_input = (
+                value['type'] == constant_input_type)
+            is_field_input = (
+                value['type'] == field_input_type or
+                value['type'] == dynamic_field_input_type)
+            is_geometry_input = (
+                value['type'] == geometry_property_input_type)
+            is_keyword_input = (
+                value['type'] == keyword_input_type)
+            is_needs_input = (
+                value['type'] == needs_profile_input_type)
+            is_layer_property_input = (
+                value['type'] == layer_property_input_type)
+            if is_constant_input:
+                default_parameters[key] = value['value']
+                break
+            elif is_field_input:
+                if value['type'] == dynamic_field_input_type:
+                    key_template = value['value']['key']
+                    field_param = value['field_param']
+                    field_key = key_template % field_param
+                else:
+                    field_key = value['value']['key']
+
+                inasafe_fields = layer.keywords['inasafe_fields']
+                name_field = inasafe_fields.get(field_key)
+
+                if not name_field:
+                    msg = tr(
+                        '%s has not been found in inasafe fields.'
+                        % value['value']['key'])
+                    continue
+
+                if name_field not in field_names:
+                    msg = tr(
+                        'The field name %s has not been found in %s'
+                        % (
+                            name_field,
+                            field_names
+                        ))
+                    continue
+
+                inputs[key] = name_field
+                break
+
+            # For geometry, create new field that contain the value
+            elif is_geometry_input:
+                inputs[key] = geometry_property_input_type['key']
+                break
+
+            # for keyword
+            elif is_keyword_input:
+
+                # See http://stackoverflow.com/questions/14692690/
+                # access-python-nested-dictionary-items-via-a-list-of-keys
+                value = reduce(
+                    lambda d, k: d[k], value['value'], layer.keywords)
+
+                default_parameters[key] = value
+                break
+
+            # for needs profile
+            elif is_needs_input:
+                need_parameter = minimum_needs_parameter(
+                    parameter_name=value['value'])
+                value = need_parameter.value
+
+                default_parameters[key] = value
+                break
+
+            # for layer property
+            elif is_layer_property_input:
+                if value['value'] == layer_crs_input_value:
+                    default_parameters[key] = layer.crs()
+
+                if value['value'] == size_calculator_input_value:
+                    exposure = layer.keywords.get('exposure')
+                    if not exposure:
+                        keywords = layer.keywords.get('exposure_keywords')
+                        exposure = keywords.get('exposure')
+
+                    default_parameters[key] = SizeCalculator(
+                        layer.crs(), layer.geometryType(), exposure)
+                break
+
+        else:
+            # executed when we can't find all the inputs
+            return False, msg, None, None
+
+    return True, None, inputs, default_parameters
 
 
 @profile
@@ -62,203 +323,249 @@ def run_single_post_processor(layer, post_processor):
     :returns: Tuple with True if success, else False with an error message.
     :rtype: (bool, str)
     """
-    if not layer.editBuffer():
+    _, valid, msg = run_post_processors(layer, [post_processor])[0]
+    return valid, msg
 
-        # Turn on the editing mode.
-        if not layer.startEditing():
-            msg = tr('The impact layer could not start the editing mode.')
-            return False, msg
 
-    # Calculate based on formula
-    # Iterate all possible output
-    for output_key, output_value in post_processor['output'].items():
-
-        # Get output attribute name
-        key = output_value['value']['key']
-        output_field_name = output_value['value']['field_name']
-        layer.keywords['inasafe_fields'][key] = output_field_name
-
-        # If there is already the output field, don't proceed
-        if layer.fieldNameIndex(output_field_name) > -1:
-            msg = tr(
-                'The field name %s already exists.'
-                % output_field_name)
-            layer.rollBack()
-            return False, msg
+def _cast_to_field(values, field):
+    """Cast values like the data provider will do when storing them.
 
-        # Add output attribute name to the layer
-        field = create_field_from_definition(output_value['value'])
-        result = layer.addAttribute(field)
-        if not result:
-            msg = tr(
-                'Error while creating the field %s.'
-                % output_field_name)
-            layer.rollBack()
-            return False, msg
+    A post processor reading a column created by a previous one must read
+    the same values as if they were read from the layer.
 
-        # Get the index of output attribute
-        output_field_index = layer.fieldNameIndex(output_field_name)
+    :param values: The values of the column.
+    :type values: list
 
-        if layer.fieldNameIndex(output_field_name) == -1:
-            msg = tr(
-                'The field name %s has not been created.'
-                % output_field_name)
-            layer.rollBack()
-            return False, msg
+    :param field: The field where the values will be stored.
+    :type field: QgsField
 
-        # Get the input field's indexes for input
-        input_indexes = {}
+    :returns: The casted values.
+    :rtype: list
+    """
+    if field.type() not in qvariant_whole_numbers:
+        return values
+    return [
+        value if _is_null(value) else int(round(value)) for value in values]
 
-        input_properties = {}
 
-        # Default parameters
-        default_parameters = {}
+def _call_function(python_function, parameters):
+    """Call the python function of a post processor output on one feature.
 
-        msg = None
+    :param python_function: The function of the output.
+    :type python_function: function
 
-        for key, values in post_processor['input'].items():
-            values = values if isinstance(values, list) else [values]
-            for value in values:
-                is_constant_input = (
-                    value['type'] == constant_input_type)
-                is_field_input = (
-                    value['type'] == field_input_type or
-                    value['type'] == dynamic_field_input_type)
-                is_geometry_input = (
-                    value['type'] == geometry_property_input_type)
-                is_keyword_input = (
-                    value['type'] == keyword_input_type)
-                is_needs_input = (
-                    value['type'] == needs_profile_input_type)
-                is_layer_property_input = (
-                    value['type'] == layer_property_input_type)
-                if is_constant_input:
-                    default_parameters[key] = value['value']
-                    break
-                elif is_field_input:
-                    if value['type'] == dynamic_field_input_type:
-                        key_template = value['value']['key']
-                        field_param = value['field_param']
-                        field_key = key_template % field_param
-                    else:
-                        field_key = value['value']['key']
-
-                    inasafe_fields = layer.keywords['inasafe_fields']
-                    name_field = inasafe_fields.get(field_key)
-
-                    if not name_field:
-                        msg = tr(
-                            '%s has not been found in inasafe fields.'
-                            % value['value']['key'])
-                        continue
-
-                    index = layer.fieldNameIndex(name_field)
-
-                    if index == -1:
-                        fields = layer.fields().toList()
-                        msg = tr(
-                            'The field name %s has not been found in %s'
-                            % (
-                                name_field,
-                                [f.name() for f in fields]
-                            ))
-                        continue
-
-                    input_indexes[key] = index
-                    break
+    :param parameters: The inputs of the function.
+    :type parameters: dict
 
-                # For geometry, create new field that contain the value
-                elif is_geometry_input:
-                    input_properties[key] = geometry_property_input_type['key']
-                    break
+    :returns: The result for the feature.
+    :rtype: float, int, basestring
+    """
+    post_processor_result = python_function(**parameters)
 
-                # for keyword
-                elif is_keyword_input:
+    # The affected postprocessor returns a boolean.
+    if isinstance(post_processor_result, bool):
+        post_processor_result = tr(unicode(post_processor_result))
+    return post_processor_result
 
-                    # See http://stackoverflow.com/questions/14692690/
-                    # access-python-nested-dictionary-items-via-a-list-of-keys
-                    value = reduce(
-                        lambda d, k: d[k], value['value'], layer.keywords)
 
-                    default_parameters[key] = value
-                    break
+def _evaluate_output(
+        layer, output_value, inputs, default_parameters, columns,
+        feature_ids):
+    """Evaluate an output of a post processor on columns of values.
 
-                # for needs profile
-                elif is_needs_input:
-                    need_parameter = minimum_needs_parameter(
-                        parameter_name=value['value'])
-                    value = need_parameter.value
+    :param layer: The vector layer to use for post processing.
+    :type layer: QgsVectorLayer
 
-                    default_parameters[key] = value
-                    break
+    :param output_value: The output definition of the post processor.
+    :type output_value: dict
 
-                # for layer property
-                elif is_layer_property_input:
-                    if value['value'] == layer_crs_input_value:
-                        default_parameters[key] = layer.crs()
+    :param inputs: Inputs to read on each feature, key: input, value: the
+        field name or the geometry property key.
+    :type inputs: dict
 
-                    if value['value'] == size_calculator_input_value:
-                        exposure = layer.keywords.get('exposure')
-                        if not exposure:
-                            keywords = layer.keywords.get('exposure_keywords')
-                            exposure = keywords.get('exposure')
+    :param default_parameters: Parameters for all features.
+    :type default_parameters: dict
 
-                        default_parameters[key] = SizeCalculator(
-                            layer.crs(), layer.geometryType(), exposure)
-                    break
+    :param columns: Values of each field, key: field name, value: list.
+    :type columns: dict
+
+    :param feature_ids: The feature IDs, in the order of the columns.
+    :type feature_ids: list
 
+    :returns: The value of the output for each feature.
+    :rtype: list
+    """
+    python_function = output_value.get('function')
+    if not python_function:
+        formula_columns = dict(
+            (key, columns[value]) for key, value in inputs.items())
+        return evaluate_formula_columns(
+            output_value['formula'],
+            formula_columns,
+            default_parameters,
+            len(feature_ids))
+
+    geometry_key = geometry_property_input_type['key']
+    if geometry_key not in inputs.values():
+        values = []
+        for row in xrange(len(feature_ids)):
+            parameters = dict(default_parameters)
+            for key, value in inputs.items():
+                parameters[key] = columns[value][row]
+            values.append(_call_function(python_function, parameters))
+        return values
+
+    # The geometry is used with the output of a previous post processor,
+    # we need to read the geometries again.
+    rows = dict(
+        (feature_id, row) for row, feature_id in enumerate(feature_ids))
+    values = [None] * len(feature_ids)
+    request = QgsFeatureRequest().setSubsetOfAttributes([])
+    for feature in layer.getFeatures(request):
+        row = rows[feature.id()]
+        parameters = dict(default_parameters)
+        for key, value in inputs.items():
+            if value == geometry_key:
+                parameters[key] = feature.geometry()
             else:
-                # executed when we can't find all the inputs
-                layer.rollBack()
-                return False, msg
+                parameters[key] = columns[value][row]
+        values[row] = _call_function(python_function, parameters)
+    return values
+
 
-        # Create iterator for feature
-        request = QgsFeatureRequest().setSubsetOfAttributes(
-            input_indexes.values())
-        iterator = layer.getFeatures(request)
+@profile
+def run_post_processors(layer, post_processors):
+    """Run many post processors with a single pass on the layer.
 
-        inputs = input_indexes.copy()
-        inputs.update(input_properties)
+    Only the fields used by the post processors are read, once, as columns.
+    Outputs using the geometry are computed while reading, so geometries
+    are not kept in memory. Post processors are evaluated in the given
+    order, so a post processor can use the output of a previous one, and all
+    new fields are written back with a single call to the data provider.
 
-        # Iterate all feature
-        for feature in iterator:
-            attributes = feature.attributes()
+    :param layer: The vector layer to use for post processing.
+    :type layer: QgsVectorLayer
 
-            # Create dictionary to store the input
-            parameters = {}
-            parameters.update(default_parameters)
+    :param post_processors: Post processor definitions, in the order of
+        execution.
+    :type post_processors: list
 
-            # Fill up the input from fields
+    :returns: List of tuples with the post processor, True if success, else
+        False with an error message.
+    :rtype: list
+    """
+    field_names = [f.name() for f in layer.fields().toList()]
+    geometry_key = geometry_property_input_type['key']
+
+    # Find the inputs of each post processor before reading the layer.
+    results = []
+    planned = []
+    available_fields = list(field_names)
+    for post_processor in post_processors:
+        valid, msg = enough_input(layer, post_processor['input'])
+        if valid:
+            valid, msg, inputs, default_parameters = _post_processor_inputs(
+                layer, post_processor, available_fields)
+        if valid:
+            for output_value in post_processor['output'].values():
+                output_field_name = output_value['value']['field_name']
+
+                # If there is already the output field, don't proceed
+                if output_field_name in available_fields:
+                    msg = tr(
+                        'The field name %s already exists.'
+                        % output_field_name)
+                    valid = False
+                    break
+        if valid:
+            for output_value in post_processor['output'].values():
+                definition = output_value['value']
+                available_fields.append(definition['field_name'])
+                layer.keywords['inasafe_fields'][definition['key']] = (
+                    definition['field_name'])
+            planned.append((post_processor, inputs, default_parameters))
+        results.append((post_processor, valid, msg))
+
+    if not planned:
+        return results
+
+    # Outputs using the geometry and fields of the layer only are computed
+    # while reading the layer.
+    read_fields = set()
+    geometry_outputs = []
+    for post_processor, inputs, default_parameters in planned:
+        read_fields.update(
+            value for value in inputs.values() if value in field_names)
+        in_read_loop = geometry_key in inputs.values() and all(
+            value == geometry_key or value in field_names
+            for value in inputs.values())
+        if not in_read_loop:
+            continue
+        for output_value in post_processor['output'].values():
+            if output_value.get('function'):
+                geometry_outputs.append(
+                    (output_value, inputs, default_parameters, []))
+
+    # Read the layer once.
+    indexes = dict((name, layer.fieldNameIndex(name)) for name in read_fields)
+    columns = dict((name, []) for name in read_fields)
+    feature_ids = []
+    request = QgsFeatureRequest()
+    if not geometry_outputs:
+        request.setFlags(QgsFeatureRequest.NoGeometry)
+    request.setSubsetOfAttributes(indexes.values())
+    for feature in layer.getFeatures(request):
+        feature_ids.append(feature.id())
+        attributes = feature.attributes()
+        for name, index in indexes.items():
+            columns[name].append(attributes[index])
+
+        for output_value, inputs, default_parameters, values in (
+                geometry_outputs):
+            parameters = dict(default_parameters)
             for key, value in inputs.items():
-                if value == geometry_property_input_type['key']:
+                if value == geometry_key:
                     parameters[key] = feature.geometry()
                 else:
-                    parameters[key] = attributes[value]
-            # Fill up the input from geometry property
-
-            # Evaluate the function
-            python_function = output_value.get('function')
-            if python_function:
-                # Launch the python function
-                post_processor_result = python_function(**parameters)
-            else:
-                # Evaluate the function
-                formula = output_value['formula']
-                post_processor_result = evaluate_formula(
-                    formula, parameters)
-
-            # The affected postprocessor returns a boolean.
-            if isinstance(post_processor_result, bool):
-                post_processor_result = tr(unicode(post_processor_result))
-
-            layer.changeAttributeValue(
-                feature.id(),
-                output_field_index,
-                post_processor_result
-            )
-
-    layer.commitChanges()
-    return True, None
+                    parameters[key] = attributes[indexes[value]]
+            values.append(
+                _call_function(output_value['function'], parameters))
+
+    computed = dict(
+        (output_value['value']['field_name'], values)
+        for output_value, _, _, values in geometry_outputs)
+
+    new_fields = []
+    for post_processor, inputs, default_parameters in planned:
+        for output_value in post_processor['output'].values():
+            field = create_field_from_definition(output_value['value'])
+            values = computed.get(field.name())
+            if values is None:
+                values = _evaluate_output(
+                    layer,
+                    output_value,
+                    inputs,
+                    default_parameters,
+                    columns,
+                    feature_ids)
+            columns[field.name()] = _cast_to_field(values, field)
+            new_fields.append(field)
+
+    # Write all new fields at once.
+    data_provider = layer.dataProvider()
+    data_provider.addAttributes(new_fields)
+    layer.updateFields()
+
+    indexes = dict(
+        (field.name(), layer.fieldNameIndex(field.name()))
+        for field in new_fields)
+    update_map = {}
+    for row, feature_id in enumerate(feature_ids):
+        update_map[feature_id] = dict(
+            (index, columns[name][row]) for name, index in indexes.items())
+    data_provider.changeAttributeValues(update_map)
+
+    return results
 
 
 def enough_input(layer, post_processor_input):
@@ -4,9 +4,17 @@
 
 import unittest
 
+import numpy as np
+
 from safe.definitions.hazard_classifications import (
     earthquake_mmi_scale)
-from safe.impact_function.earthquake import from_mmi_to_hazard_class
+from safe.impact_function.earthquake import (
+    from_mmi_to_hazard_class,
+    fatality_rate,
+    displacement_rate,
+    rate_lookup_table,
+    exposed_people_arrays,
+)
 
 __copyright__ = "Copyright 2016, The InaSAFE Project"
 __license__ = "GPL version 3"
@@ -25,3 +33,67 @@ class TestEarthquake(unittest.TestCase):
             from_mmi_to_hazard_class(8, earthquake_mmi_scale['key']))
         self.assertIsNone(
             from_mmi_to_hazard_class(99, earthquake_mmi_scale['key']))
+
+    def test_exposed_people_arrays(self):
+        """Test the vectorized engine gives the same result as a loop."""
+        classification_key = earthquake_mmi_scale['key']
+        hazard = np.array([
+            [1.0, 2.0, 2.6, 5.4],
+            [7.5, 8.49, 10.4, 15.0],
+            [6.0, 6.0, 9.0, -9999]])
+        exposure = np.array([
+            [10.0, 20.0, 30.0, 40.0],
+            [50.0, 60.0, -1, 80.0],
+            [90.0, 100.0, 110.0, 120.0]])
+        aggregation = np.array([
+            [1, 1, 2, 2],
+            [1, 2, -1, 2],
+            [0, 1, 1, 2]])
+
+        exposed, displaced = exposed_people_arrays(
+            hazard,
+            exposure,
+            aggregation,
+            rate_lookup_table(classification_key, fatality_rate),
+            rate_lookup_table(classification_key, displacement_rate))
+
+        # The previous pixel by pixel implementation.
+        expected_exposed = {}
+        expected_displaced = np.zeros(hazard.shape)
+        for (row, column), hazard_mmi in np.ndenumerate(hazard):
+            people_count = exposure[row, column]
+            agg_zone_index = int(aggregation[row, column])
+            if hazard_mmi >= 2.0 and people_count >= 0.0:
+                hazard_mmi = int(round(hazard_mmi))
+                mmi_fatalities = int(
+                    hazard_mmi * fatality_rate(hazard_mmi, classification_key))
+                mmi_displaced = (
+                    (people_count - mmi_fatalities) *
+                    displacement_rate(hazard_mmi, classification_key))
+                key = (hazard_mmi, agg_zone_index)
+                expected_exposed.setdefault(key, 0)
+                expected_exposed[key] += people_count
+            else:
+                mmi_displaced = -1
+            if agg_zone_index > 0:
+                expected_displaced[row, column] = mmi_displaced
+            else:
+                expected_displaced[row, column] = -1
+
+        self.assertDictEqual(expected_exposed, exposed)
+        self.assertTrue(np.allclose(expected_displaced, displaced))
+
+        # Big and sparse aggregation IDs give the same sums.
+        big_ids = np.where(
+            aggregation > 0, aggregation * 10 ** 12, aggregation)
+        exposed, _ = exposed_people_arrays(
+            hazard,
+            exposure,
+            big_ids,
+            rate_lookup_table(classification_key, fatality_rate),
+            rate_lookup_table(classification_key, displacement_rate))
+        self.assertDictEqual(
+            dict(
+                ((mmi, zone * 10 ** 12 if zone > 0 else zone), value)
+                for (mmi, zone), value in expected_exposed.items()),
+            exposed)
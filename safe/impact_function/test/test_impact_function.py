@@ -562,6 +562,12 @@ class TestImpactFunction(unittest.TestCase):
         impact_function.prepare()
         status, message = impact_function.run()
         self.assertEqual(ANALYSIS_SUCCESS, status, message)
+
+        # Outputs are written in the datastore in the background.
+        impact_function.datastore.wait()
+        for layer in impact_function.outputs:
+            self.assertNotEqual(layer.providerType(), 'memory')
+
         message = impact_function.performance_log_message().to_text()
         expected_result = get_control_text(
             'test-profiling-logs.txt')
@@ -572,6 +578,20 @@ class TestImpactFunction(unittest.TestCase):
                 continue
             self.assertIn(line, message)
 
+        # Steps of the analysis are in the profiling too.
+        path = join(
+            impact_function.datastore.uri_path,
+            '%s_profiling.json' % impact_function._unique_name)
+        with open(path) as json_file:
+            profiling = json.load(json_file)
+        self.assertEqual(profiling['profiling']['function'], '_run')
+        rows = list(impact_function.performance_log.rows())
+        self.assertEqual(impact_function.profiling.featureCount(), len(rows))
+        steps = [node for _, node in rows if node.title]
+        self.assertIn(
+            'Union hazard polygons with aggregation areas and assign '
+            'hazard class', [str(step) for step in steps])
+
         # Notes(IS): For some unknown reason I need to do this to make
         # test_provenance pass
         del hazard_layer
@@ -40,8 +40,12 @@ from safe.definitions.post_processors import (
 from safe.test.utilities import load_test_vector_layer
 from safe.impact_function.postprocessors import (
     run_single_post_processor,
+    run_post_processors,
     evaluate_formula,
+    evaluate_formula_columns,
+    compile_formula,
     enough_input)
+from safe.common.exceptions import InvalidFormulaError
 
 
 __copyright__ = "Copyright 2016, The InaSAFE Project"
@@ -80,6 +84,44 @@ class TestPostProcessors(unittest.TestCase):
         self.assertIn(
             male_displaced_count_field['field_name'], impact_fields)
 
+    def test_run_post_processors(self):
+        """Test many post processors with a single pass on the layer."""
+        impact_layer = load_test_vector_layer(
+            'impact',
+            'indivisible_polygon_impact.geojson',
+            clone_to_memory=True)
+        expected_layer = load_test_vector_layer(
+            'impact',
+            'indivisible_polygon_impact.geojson',
+            clone_to_memory=True)
+
+        post_processors = [post_processor_gender, post_processor_youth]
+        results = run_post_processors(impact_layer, post_processors)
+        self.assertEqual(
+            post_processors, [result[0] for result in results])
+        for post_processor, result, message in results:
+            self.assertTrue(result, message)
+
+            result, message = run_single_post_processor(
+                expected_layer, post_processor)
+            self.assertTrue(result, message)
+
+        for field in [
+                female_displaced_count_field,
+                male_displaced_count_field,
+                youth_displaced_count_field]:
+            values = [
+                feature[field['field_name']]
+                for feature in impact_layer.getFeatures()]
+            expected_values = [
+                feature[field['field_name']]
+                for feature in expected_layer.getFeatures()]
+            self.assertEqual(expected_values, values)
+
+        # The output fields are already there.
+        results = run_post_processors(impact_layer, [post_processor_gender])
+        self.assertFalse(results[0][1])
+
     def test_youth_post_processor(self):
         """Test youth post processor."""
         impact_layer = load_test_vector_layer(
@@ -409,6 +451,54 @@ class TestPostProcessors(unittest.TestCase):
         }
         self.assertIsNone(evaluate_formula(formula, variables))
 
+        # Only arithmetic is allowed.
+        with self.assertRaises(InvalidFormulaError):
+            compile_formula('__import__("os").getcwd()')
+
+        # The formula is compiled only once.
+        self.assertIs(compile_formula(formula), compile_formula(formula))
+
+    def test_evaluate_formula_columns(self):
+        """Test for evaluating formula on columns."""
+        formula = 'population_displaced * (1 - gender_ratio)'
+        columns = {
+            'population_displaced': [100, None, 0, 20]
+        }
+        constants = {
+            'gender_ratio': 0.5
+        }
+        self.assertEqual(
+            [50, None, 0, 10],
+            evaluate_formula_columns(formula, columns, constants, 4))
+
+        constants = {
+            'gender_ratio': None
+        }
+        self.assertEqual(
+            [None] * 4,
+            evaluate_formula_columns(formula, columns, constants, 4))
+
+        # Integers stay integers, like with evaluate_formula.
+        formula = 'population_displaced / divisor'
+        columns = {
+            'population_displaced': [7, 9, 0],
+            'divisor': [2, None, 3]
+        }
+        results = evaluate_formula_columns(formula, columns, {}, 3)
+        self.assertEqual([3, None, 0], results)
+        self.assertIsInstance(results[0], int)
+
+        columns['population_displaced'] = [7.0, 9.0, 0.0]
+        self.assertEqual(
+            [3.5, None, 0.0],
+            evaluate_formula_columns(formula, columns, {}, 3))
+
+        # A division by zero is an error.
+        formula = 'population_displaced / (divisor - 2)'
+        self.assertRaises(
+            ZeroDivisionError,
+            evaluate_formula_columns, formula, columns, {}, 3)
+
 
 if __name__ == '__main__':
     unittest.main()
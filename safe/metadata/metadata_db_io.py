@@ -12,6 +12,7 @@ __copyright__ += 'Disaster Reduction'
 import os
 from os.path import expanduser
 import logging
+import threading
 import sqlite3 as sqlite
 from sqlite3 import OperationalError
 
@@ -25,6 +26,13 @@ from safe.common.exceptions import (
 
 LOGGER = logging.getLogger('InaSAFE')
 
+# Connections are kept open for each thread and each database path, sqlite
+# connections can't be shared between threads.
+_pool = threading.local()
+
+# Maximum number of parameters in a sqlite query.
+_max_parameters = 500
+
 
 class MetadataDbIO(QObject):
     """Class for doing metadata read/write operations on the local DB
@@ -97,9 +105,19 @@ class MetadataDbIO(QObject):
         overridden in QSettings. If the db does not exist it will
         be created.
 
+        The connection is kept open for the current thread and reused by
+        next calls with the same database path.
+
         :raises: An sqlite.Error is raised if anything goes wrong
         """
-        self.connection = None
+        connections = getattr(_pool, 'connections', None)
+        if connections is None:
+            connections = _pool.connections = {}
+
+        self.connection = connections.get(self.metadata_db_path)
+        if self.connection is not None:
+            return
+
         base_directory = os.path.dirname(self.metadata_db_path)
         if not os.path.exists(base_directory):
             try:
@@ -110,23 +128,42 @@ class MetadataDbIO(QObject):
                 raise
 
         try:
-            self.connection = sqlite.connect(self.metadata_db_path)
+            connection = sqlite.connect(self.metadata_db_path)
+            # Readers don't block the writer with the write-ahead log.
+            connection.execute('PRAGMA journal_mode=WAL;')
+            connection.execute(
+                'create table if not exists metadata ('
+                'hash varchar(32) primary key, json text, xml text);')
+            connection.commit()
         except (OperationalError, sqlite.Error):
             LOGGER.exception('Failed to open metadata cache database.')
             raise
 
+        connections[self.metadata_db_path] = connection
+        self.connection = connection
+
     def close_connection(self):
-        """Close the active sqlite3 connection."""
-        if self.connection is not None:
-            self.connection.close()
-            self.connection = None
+        """Release the active sqlite3 connection.
+
+        The connection stays open in the pool of the thread, use
+        close_connections to close it.
+        """
+        self.connection = None
+
+    @staticmethod
+    def close_connections():
+        """Close all sqlite3 connections opened in the current thread."""
+        connections = getattr(_pool, 'connections', None) or {}
+        for connection in connections.values():
+            connection.close()
+        connections.clear()
 
     def get_cursor(self):
         """Get a cursor for the active connection.
 
         The cursor can be used to execute arbitrary queries against the
-        database. This method also checks that the metadata table exists in
-        the schema, and if not, it creates it.
+        database. The metadata table is created when the connection is
+        opened.
 
         :returns: A valid cursor opened against the connection.
         :rtype: sqlite.
@@ -139,28 +176,7 @@ class MetadataDbIO(QObject):
             except OperationalError:
                 raise
         try:
-            cursor = self.connection.cursor()
-            cursor.execute('SELECT SQLITE_VERSION()')
-            data = cursor.fetchone()
-            LOGGER.debug("SQLite version: %s" % data)
-            # Check if we have some tables, if not create them
-            sql = 'select sql from sqlite_master where type = \'table\';'
-            cursor.execute(sql)
-            data = cursor.fetchone()
-            LOGGER.debug("Tables: %s" % data)
-            if data is None:
-                LOGGER.debug('No tables found')
-                sql = (
-                    'create table metadata (hash varchar(32) primary key,'
-                    'json text, xml text);')
-                LOGGER.debug(sql)
-                cursor.execute(sql)
-                # data = cursor.fetchone()
-                cursor.fetchone()
-            else:
-                LOGGER.debug('metadata table already exists')
-
-            return cursor
+            return self.connection.cursor()
         except sqlite.Error, e:
             LOGGER.debug("Error %s:" % e.args[0])
             raise
@@ -239,8 +255,8 @@ class MetadataDbIO(QObject):
         try:
             cursor = self.get_cursor()
             # now see if we have any data for our hash
-            sql = 'delete from metadata where hash = \'' + hash_value + '\';'
-            cursor.execute(sql)
+            cursor.execute(
+                'delete from metadata where hash = ?;', (hash_value, ))
             self.connection.commit()
         except sqlite.Error, e:
             LOGGER.debug("SQLITE Error %s:" % e.args[0])
@@ -275,30 +291,27 @@ class MetadataDbIO(QObject):
         :type xml: str
 
         """
-        hash_value = self.hash_for_datasource(uri)
+        self.write_metadata_for_uris([(uri, json, xml)])
+
+    def write_metadata_for_uris(self, records):
+        """Write metadata for many URIs in a single transaction.
+
+        .. seealso:: write_metadata_for_uri
+
+        :param records: List of tuples (uri, json, xml).
+        :type records: list
+        """
+        rows = [
+            (self.hash_for_datasource(uri), json, xml)
+            for uri, json, xml in records]
         try:
             cursor = self.get_cursor()
-            # now see if we have any data for our hash
-            sql = (
-                'select json, xml from metadata where hash = \'%s\';' %
-                hash_value)
-            cursor.execute(sql)
-            data = cursor.fetchone()
-            if data is None:
-                # insert a new rec
-                # cursor.execute('insert into metadata(hash) values(:hash);',
-                #             {'hash': hash_value})
-                cursor.execute(
-                    'insert into metadata(hash, json, xml ) '
-                    'values(:hash, :json, :xml);',
-                    {'hash': hash_value, 'json': json, 'xml': xml})
-                self.connection.commit()
-            else:
-                # update existing rec
-                cursor.execute(
-                    'update metadata set json=?, xml=? where hash = ?;',
-                    (json, xml, hash_value))
-                self.connection.commit()
+            # A new record is inserted or the existing one is replaced.
+            cursor.executemany(
+                'insert or replace into metadata(hash, json, xml) '
+                'values(?, ?, ?);',
+                rows)
+            self.connection.commit()
         except sqlite.Error:
             LOGGER.exception('Error writing metadata to SQLite db %s' %
                              self.metadata_db_path)
@@ -343,17 +356,11 @@ class MetadataDbIO(QObject):
             raise RuntimeError('%s' % message)
 
         hash_value = self.hash_for_datasource(uri)
-        try:
-            self.open_connection()
-        except OperationalError:
-            raise
         try:
             cursor = self.get_cursor()
             # now see if we have any data for our hash
-            sql = (
-                'select %s from metadata where hash = \'%s\';' % (
-                    metadata_format, hash_value))
-            cursor.execute(sql)
+            sql = 'select %s from metadata where hash = ?;' % metadata_format
+            cursor.execute(sql, (hash_value, ))
             data = cursor.fetchone()
             if data is None:
                 raise HashNotFoundError('No hash found for %s' % hash_value)
@@ -370,3 +377,49 @@ class MetadataDbIO(QObject):
             raise
         finally:
             self.close_connection()
+
+    def read_metadata_for_uris(self, uris, metadata_format):
+        """Get metadata of many URIs from the DB with a few queries.
+
+        .. seealso:: read_metadata_from_uri
+
+        :param uris: List of layer uris.
+        :type uris: list
+
+        :param metadata_format: The format of the metadata to retrieve.
+            Valid types are: 'json', 'xml'
+        :type metadata_format: str
+
+        :returns: A dictionary uri: metadata. URIs without metadata in the
+            DB are not in the dictionary.
+        :rtype: dict
+        """
+        allowed_formats = ['json', 'xml']
+        if metadata_format not in allowed_formats:
+            message = 'Metadata format %s is not valid. Valid types: %s' % (
+                metadata_format, allowed_formats)
+            raise RuntimeError('%s' % message)
+
+        uris_by_hash = {}
+        for uri in uris:
+            uris_by_hash.setdefault(self.hash_for_datasource(uri), []).append(
+                uri)
+        hashes = list(uris_by_hash.keys())
+
+        metadata = {}
+        try:
+            cursor = self.get_cursor()
+            for i in xrange(0, len(hashes), _max_parameters):
+                chunk = hashes[i:i + _max_parameters]
+                sql = 'select hash, %s from metadata where hash in (%s);' % (
+                    metadata_format, ', '.join('?' * len(chunk)))
+                cursor.execute(sql, chunk)
+                for hash_value, data in cursor.fetchall():
+                    for uri in uris_by_hash[hash_value]:
+                        metadata[uri] = str(data)
+        except sqlite.Error, e:
+            LOGGER.debug("Error %s:" % e.args[0])
+            raise
+        finally:
+            self.close_connection()
+        return metadata
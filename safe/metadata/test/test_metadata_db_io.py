@@ -0,0 +1,84 @@
+# coding=utf-8
+"""Test the metadata database."""
+
+import threading
+import unittest
+
+from safe.common.utilities import unique_filename, temp_dir
+from safe.common.exceptions import HashNotFoundError
+from safe.metadata.metadata_db_io import MetadataDbIO
+
+__copyright__ = "Copyright 2016, The InaSAFE Project"
+__license__ = "GPL version 3"
+__email__ = "info@inasafe.org"
+__revision__ = '$Format:%H$'
+
+
+class TestMetadataDbIO(unittest.TestCase):
+
+    """Test the metadata database."""
+
+    def setUp(self):
+        self.db_io = MetadataDbIO()
+        self.db_io.set_metadata_db_path(
+            unique_filename(suffix='.db', dir=temp_dir('test')))
+
+    def tearDown(self):
+        MetadataDbIO.close_connections()
+
+    def test_read_write_metadata(self):
+        """Test we can read and write metadata for one or many uris."""
+        uri = 'dbname=\'osm\' host=localhost key=\'id\' table="roads"'
+        self.db_io.write_metadata_for_uri(uri, '{}', '<xml/>')
+        self.assertEqual(
+            self.db_io.read_metadata_from_uri(uri, 'xml'), '<xml/>')
+
+        # The record is replaced.
+        self.db_io.write_metadata_for_uri(uri, '{"a": 1}', '<xml></xml>')
+        self.assertEqual(
+            self.db_io.read_metadata_from_uri(uri, 'json'), '{"a": 1}')
+
+        uris = ['table="layer_%s"' % i for i in range(600)]
+        self.db_io.write_metadata_for_uris(
+            [(uri, '{}', '<%s/>' % uri) for uri in uris])
+        metadata = self.db_io.read_metadata_for_uris(
+            uris + ['missing'], 'xml')
+        self.assertEqual(len(metadata), len(uris))
+        self.assertEqual(metadata[uris[42]], '<%s/>' % uris[42])
+
+        self.db_io.delete_metadata_for_uri(uri)
+        self.assertRaises(
+            HashNotFoundError, self.db_io.read_metadata_from_uri, uri, 'xml')
+
+    def test_connections(self):
+        """Test connections are reused in a thread, not between threads."""
+        self.db_io.open_connection()
+        connection = self.db_io.connection
+        journal_mode = connection.execute('PRAGMA journal_mode;').fetchone()
+        self.assertEqual(journal_mode[0], 'wal')
+
+        other = MetadataDbIO()
+        other.set_metadata_db_path(self.db_io.metadata_db_path)
+        other.open_connection()
+        self.assertIs(other.connection, connection)
+
+        connections = []
+
+        def open_connection():
+            db_io = MetadataDbIO()
+            db_io.set_metadata_db_path(self.db_io.metadata_db_path)
+            db_io.write_metadata_for_uri('thread', '{}', '<xml/>')
+            db_io.open_connection()
+            connections.append(db_io.connection)
+            MetadataDbIO.close_connections()
+
+        thread = threading.Thread(target=open_connection)
+        thread.start()
+        thread.join()
+        self.assertIsNot(connections[0], connection)
+        self.assertEqual(
+            self.db_io.read_metadata_from_uri('thread', 'json'), '{}')
+
+
+if __name__ == '__main__':
+    unittest.main()
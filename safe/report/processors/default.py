@@ -9,12 +9,14 @@ Module for basic renderer we support. Currently we have:
 import io
 import logging
 import os
+import threading
 from PyQt4 import QtXml
 from tempfile import mkdtemp
 
 from PyQt4.QtCore import QUrl
 from PyQt4.QtGui import QImage, QPainter
 from PyQt4.QtSvg import QSvgRenderer
+from jinja2.bccache import FileSystemBytecodeCache
 from jinja2.environment import Environment
 from jinja2.exceptions import TemplateNotFound
 from jinja2.loaders import FileSystemLoader
@@ -29,8 +31,10 @@ from qgis.core import (
 
 from safe.common.exceptions import TemplateLoadingError
 from safe.common.utilities import temp_dir
+from safe.definitions.default_settings import inasafe_default_settings
 from safe.report.report_metadata import QgisComposerComponentsMetadata
 from safe.utilities.i18n import tr
+from safe.utilities.settings import setting
 
 __copyright__ = "Copyright 2016, The InaSAFE Project"
 __license__ = "GPL version 3"
@@ -40,6 +44,52 @@ __revision__ = '$Format:%H$'
 
 LOGGER = logging.getLogger('InaSAFE')
 
+# Jinja2 environments by template folder. An environment keeps its compiled
+# templates, so they are compiled once per process.
+_jinja2_environments = {}
+_jinja2_environments_lock = threading.Lock()
+
+
+def jinja2_environment(template_folder):
+    """Get the Jinja2 environment of a template folder.
+
+    The environment is created the first time and reused later. Jinja2
+    reloads a template if its file changed.
+
+    :param template_folder: The folder of the templates.
+    :type template_folder: basestring
+
+    :return: The environment.
+    :rtype: Environment
+    """
+    template_folder = os.path.abspath(template_folder)
+    with _jinja2_environments_lock:
+        env = _jinja2_environments.get(template_folder)
+        if env is not None:
+            return env
+
+        extensions = [
+            'jinja2.ext.i18n',
+            'jinja2.ext.with_',
+            'jinja2.ext.loopcontrols',
+            'jinja2.ext.do',
+        ]
+        bytecode_cache = None
+        use_bytecode_cache = setting(
+            'report_bytecode_cache',
+            inasafe_default_settings['report_bytecode_cache'],
+            bool)
+        if use_bytecode_cache:
+            # Without directory, Jinja2 uses a private folder owned by the
+            # user, other users can't write bytecode in it.
+            bytecode_cache = FileSystemBytecodeCache()
+        env = Environment(
+            loader=FileSystemLoader(template_folder),
+            extensions=extensions,
+            bytecode_cache=bytecode_cache)
+        _jinja2_environments[template_folder] = env
+        return env
+
 
 def jinja2_renderer(impact_report, component):
     """Versatile text renderer using Jinja2 Template.
@@ -62,17 +112,7 @@ def jinja2_renderer(impact_report, component):
     context = component.context
 
     main_template_folder = impact_report.metadata.template_folder
-    loader = FileSystemLoader(
-        os.path.abspath(main_template_folder))
-    extensions = [
-        'jinja2.ext.i18n',
-        'jinja2.ext.with_',
-        'jinja2.ext.loopcontrols',
-        'jinja2.ext.do',
-    ]
-    env = Environment(
-        loader=loader,
-        extensions=extensions)
+    env = jinja2_environment(main_template_folder)
 
     template = env.get_template(component.template)
     rendered = template.render(context)
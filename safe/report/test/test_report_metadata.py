@@ -4,8 +4,10 @@ import unittest
 
 from safe.report.extractors.action_notes import action_checklist_extractor
 from safe.report.extractors.general_report import general_report_extractor
-from safe.report.processors.default import jinja2_renderer
+from safe.report.processors.default import (
+    jinja2_renderer, jinja2_environment)
 from safe.report.report_metadata import ReportMetadata
+from safe.utilities.resources import resources_path
 
 __copyright__ = "Copyright 2016, The InaSAFE Project"
 __license__ = "GPL version 3"
@@ -60,3 +62,10 @@ class TestReportMetadata(unittest.TestCase):
         self.assertEqual(
             len(sample_report_metadata_dict['components']),
             len(report_metadata.components))
+
+    def test_jinja2_environment(self):
+        """Test Jinja2 environments are reused for a template folder."""
+        template_folder = resources_path('report-templates')
+        env = jinja2_environment(template_folder)
+        self.assertIs(env, jinja2_environment(template_folder + '/'))
+        self.assertIsNot(env, jinja2_environment(resources_path()))
@@ -2,6 +2,7 @@
 """Metadata Utilities."""
 import os
 import logging
+import threading
 from copy import deepcopy
 from datetime import datetime, date
 
@@ -33,6 +34,53 @@ __revision__ = '$Format:%H$'
 
 LOGGER = logging.getLogger('InaSAFE')
 
+# Keywords read from XML files, the key is the path of the XML file and the
+# value is a tuple ((modification time, size), keywords).
+_keywords_cache = {}
+_keywords_cache_lock = threading.Lock()
+
+
+def _xml_signature(xml_uri):
+    """Get the modification time and the size of a XML file.
+
+    :param xml_uri: The path of the XML file.
+    :type xml_uri: str
+
+    :return: Tuple (modification time, size).
+    :rtype: tuple
+    """
+    stat = os.stat(xml_uri)
+    return stat.st_mtime, stat.st_size
+
+
+def clear_keywords_cache(xml_uri=None):
+    """Remove keywords read from XML files from the cache.
+
+    :param xml_uri: The path of the XML file. If None, the whole cache is
+        cleared.
+    :type xml_uri: str
+    """
+    with _keywords_cache_lock:
+        if xml_uri is None:
+            _keywords_cache.clear()
+        else:
+            _keywords_cache.pop(xml_uri, None)
+
+
+def _copy_value(value):
+    """Copy a keyword value, so the cache can't be modified by the caller.
+
+    :param value: The value of the keyword.
+    :type value: object
+
+    :return: A copy of the value, with the same type.
+    :rtype: object
+    """
+    # Qt values are copied with their constructor.
+    if isinstance(value, (QUrl, QDate, QDateTime)):
+        return type(value)(value)
+    return deepcopy(value)
+
 
 def write_iso19115_metadata(layer_uri, keywords):
     """Create metadata  object from a layer path and keywords dictionary.
@@ -66,6 +114,7 @@ def write_iso19115_metadata(layer_uri, keywords):
     if metadata.layer_is_file_based:
         xml_file_path = os.path.splitext(layer_uri)[0] + '.xml'
         metadata.write_to_file(xml_file_path)
+        clear_keywords_cache(xml_file_path)
     else:
         metadata.write_to_db()
 
@@ -74,6 +123,10 @@ def write_iso19115_metadata(layer_uri, keywords):
 
 def read_iso19115_metadata(layer_uri, keyword=None):
     """Retrieve keywords from a metadata object
+
+    Keywords read from a XML file are cached until the modification time or
+    the size of the file change.
+
     :param layer_uri:
     :param keyword:
     :return:
@@ -85,6 +138,44 @@ def read_iso19115_metadata(layer_uri, keyword=None):
         message = 'Layer based file but no xml file.\n'
         message += 'Layer path: %s.' % layer_uri
         raise NoKeywordsFoundError(message)
+
+    if xml_uri:
+        signature = _xml_signature(xml_uri)
+        with _keywords_cache_lock:
+            cached = _keywords_cache.get(xml_uri)
+        if cached and cached[0] == signature:
+            keywords = cached[1]
+        else:
+            keywords = _read_keywords(layer_uri, xml_uri)
+            with _keywords_cache_lock:
+                _keywords_cache[xml_uri] = (signature, keywords)
+    else:
+        keywords = _read_keywords(layer_uri, xml_uri)
+
+    if keyword:
+        try:
+            return _copy_value(keywords[keyword])
+        except KeyError:
+            message = 'Keyword with key %s is not found' % keyword
+            message += 'Layer path: %s' % layer_uri
+            raise KeywordNotFoundError(message)
+
+    # The caller might modify the keywords, not the cache.
+    return {key: _copy_value(value) for key, value in keywords.iteritems()}
+
+
+def _read_keywords(layer_uri, xml_uri):
+    """Read keywords from a metadata object.
+
+    :param layer_uri: Uri to layer.
+    :type layer_uri: str
+
+    :param xml_uri: Path to the XML file or None.
+    :type xml_uri: str
+
+    :return: The keywords.
+    :rtype: dict
+    """
     metadata = GenericLayerMetadata(layer_uri, xml_uri)
     if metadata.layer_purpose == layer_purpose_exposure['key']:
         metadata = ExposureLayerMetadata(layer_uri, xml_uri)
@@ -125,14 +216,6 @@ def read_iso19115_metadata(layer_uri, keyword=None):
             if temp_keywords[key] is not None:
                 keywords[key] = temp_keywords[key]
 
-    if keyword:
-        try:
-            return keywords[keyword]
-        except KeyError:
-            message = 'Keyword with key %s is not found' % keyword
-            message += 'Layer path: %s' % layer_uri
-            raise KeywordNotFoundError(message)
-
     if isinstance(metadata, ExposureSummaryLayerMetadata):
         keywords['if_provenance'] = metadata.provenance
     return keywords
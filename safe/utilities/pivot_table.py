@@ -12,6 +12,8 @@ Contact : ole.moller.nielsen@gmail.com
 
 import json
 
+import numpy
+
 
 class FlatTable(object):
     """ Flat table object - used as a source of data for pivot tables.
@@ -45,6 +47,22 @@ class FlatTable(object):
             self.data[key] = 0
         self.data[key] += value
 
+    def add_values(self, values, **kwargs):
+        """Add many rows at once.
+
+        :param values: The values of the rows.
+        :type values: list
+
+        :param kwargs: For each group, the list of group values of the rows.
+        :type kwargs: dict
+        """
+        columns = [kwargs[group] for group in self.groups]
+        for i, value in enumerate(values):
+            self.add_value(
+                value,
+                **dict((group, column[i]) for group, column in zip(
+                    self.groups, columns)))
+
     def get_value(self, **kwargs):
         """Return the value for a specific key."""
         key = tuple(kwargs[group] for group in self.groups)
@@ -123,6 +141,228 @@ class FlatTable(object):
         return self
 
 
+class ArrayFlatTable(FlatTable):
+    """Flat table storing the sums in a NumPy array.
+
+    Each group value is interned to an integer code, the first time it is
+    seen. Values are summed in a dense array with one dimension per group,
+    in the order they are added. It's faster than FlatTable for many rows or
+    with add_values, and PivotTable only reshapes the array.
+
+    Unlike FlatTable, get_value doesn't add a key for a missing value.
+    The data attribute is built on demand, it's a dictionary like the one
+    of FlatTable.
+    """
+
+    def __init__(self, *args):
+        """Construct flat table, fields are passed as arguments."""
+        self._init_groups(args)
+
+    def _init_groups(self, groups):
+        """Reset the table with new groups.
+
+        :param groups: The group names.
+        :type groups: tuple
+        """
+        self.groups = tuple(groups)
+        # For each group: value -> code and code -> value.
+        self._codes = [{} for _ in self.groups]
+        self._group_values = [[] for _ in self.groups]
+        # Rows not summed yet.
+        self._pending_codes = [[] for _ in self.groups]
+        self._pending_values = []
+        # Sums and keys which have been added.
+        self._sums = numpy.zeros((0, ) * len(self.groups))
+        self._seen = numpy.zeros((0, ) * len(self.groups), dtype=bool)
+        self._integer = True
+
+    def _intern(self, group_index, value):
+        """Get the code of a group value, a new one if needed."""
+        codes = self._codes[group_index]
+        code = codes.get(value)
+        if code is None:
+            code = len(codes)
+            codes[value] = code
+            self._group_values[group_index].append(value)
+        return code
+
+    def add_value(self, value, **kwargs):
+        for i, group in enumerate(self.groups):
+            self._pending_codes[i].append(self._intern(i, kwargs[group]))
+        self._pending_values.append(value)
+        if self._integer and not isinstance(value, (int, long)):
+            self._integer = False
+
+    def add_values(self, values, **kwargs):
+        """Add many rows at once.
+
+        :param values: The values of the rows.
+        :type values: list
+
+        :param kwargs: For each group, the list of group values of the rows.
+        :type kwargs: dict
+        """
+        for i, group in enumerate(self.groups):
+            intern = self._intern
+            self._pending_codes[i].extend(
+                intern(i, value) for value in kwargs[group])
+        values = list(values)
+        self._pending_values.extend(values)
+        if self._integer and not all(
+                isinstance(value, (int, long)) for value in values):
+            self._integer = False
+
+    def _reduce(self):
+        """Sum pending rows in the array."""
+        if not self._pending_values:
+            return
+
+        shape = tuple(len(codes) for codes in self._codes)
+        if self._sums.shape != shape:
+            # New group values, we grow the array.
+            sums = numpy.zeros(shape)
+            seen = numpy.zeros(shape, dtype=bool)
+            old = tuple(slice(0, size) for size in self._sums.shape)
+            sums[old] = self._sums
+            seen[old] = self._seen
+            self._sums, self._seen = sums, seen
+
+        codes = tuple(
+            numpy.array(code, dtype=numpy.int64)
+            for code in self._pending_codes)
+        values = numpy.array(self._pending_values, dtype=numpy.float64)
+        if self._seen.any():
+            # add.at is unbuffered, values are added one by one in order.
+            numpy.add.at(self._sums, codes, values)
+        else:
+            index = numpy.ravel_multi_index(codes, shape)
+            self._sums = numpy.bincount(
+                index, weights=values,
+                minlength=self._sums.size).reshape(shape)
+        self._seen[codes] = True
+
+        self._pending_codes = [[] for _ in self.groups]
+        self._pending_values = []
+
+    def _number(self, value):
+        """Convert a sum to a Python number."""
+        if self._integer:
+            return int(round(value))
+        return float(value)
+
+    def get_value(self, **kwargs):
+        """Return the value for a specific key."""
+        self._reduce()
+        try:
+            position = tuple(
+                self._codes[i][kwargs[group]]
+                for i, group in enumerate(self.groups))
+        except KeyError:
+            return 0
+        return self._number(self._sums[position])
+
+    @property
+    def data(self):
+        """Dictionary key: sum, for each key which has been added.
+
+        :return: The data, like FlatTable.data.
+        :rtype: dict
+        """
+        self._reduce()
+        data = {}
+        for position in zip(*numpy.nonzero(self._seen)):
+            key = tuple(
+                self._group_values[i][code]
+                for i, code in enumerate(position))
+            data[key] = self._number(self._sums[position])
+        return data
+
+    def group_values(self, group_name):
+        """Return all distinct group values for given group"""
+        group_index = self.groups.index(group_name)
+        return set(self._group_values[group_index])
+
+    def data_count(self):
+        """Return the number of keys which have been added.
+
+        :return: The same as len(data), without building data.
+        :rtype: int
+        """
+        self._reduce()
+        return int(self._seen.sum())
+
+    def from_dict(self, groups, data):
+        """Populate FlatTable based on groups and data.
+
+        :param groups: List of group name.
+        :type groups: list
+
+        :param data: Dictionary of raw table.
+        :type data: list
+        """
+        if tuple(groups) != self.groups:
+            self._init_groups(groups)
+        columns = dict(
+            (group, [item[i] for item in data])
+            for i, group in enumerate(self.groups))
+        self.add_values([item[-1] for item in data], **columns)
+        return self
+
+    def pivot(self, row_field, column_field, filter_field, filter_value):
+        """Sum the table by row and column, used by PivotTable.
+
+        :param row_field: The group for rows, or None.
+        :type row_field: str
+
+        :param column_field: The group for columns, or None.
+        :type column_field: str
+
+        :param filter_field: The group to filter on, or None.
+        :type filter_field: str
+
+        :param filter_value: The value to keep for filter_field.
+        :type filter_value: any
+
+        :return: A tuple with the row values, the column values, the sums
+            and the keys which have been added, both as 2D arrays rows x
+            columns. Row or column values are [''] if the field is None.
+        :rtype: (list, list, numpy.ndarray, numpy.ndarray)
+        """
+        self._reduce()
+        sums = self._sums
+        seen = self._seen
+
+        if filter_field is not None:
+            filter_index = self.groups.index(filter_field)
+            code = self._codes[filter_index].get(filter_value)
+            selection = [slice(None)] * len(self.groups)
+            if code is None:
+                selection[filter_index] = slice(0, 0)
+            else:
+                selection[filter_index] = slice(code, code + 1)
+            sums = sums[tuple(selection)]
+            seen = seen[tuple(selection)]
+
+        axes = []
+        labels = []
+        for field in [row_field, column_field]:
+            if field is None:
+                labels.append([''])
+            else:
+                axes.append(self.groups.index(field))
+                labels.append(self._group_values[axes[-1]])
+
+        # Sum every other group, then put rows first.
+        other = tuple(i for i in xrange(len(self.groups)) if i not in axes)
+        sums = sums.sum(axis=other)
+        seen = seen.any(axis=other)
+        if len(axes) == 2 and axes[0] > axes[1]:
+            sums = sums.T
+            seen = seen.T
+        shape = (len(labels[0]), len(labels[1]))
+        return labels[0], labels[1], sums.reshape(shape), seen.reshape(shape)
+
+
 class PivotTable(object):
     """ Pivot tables as known from spreadsheet software.
 
@@ -205,6 +445,12 @@ class PivotTable(object):
         if affected_columns is None:
             affected_columns = []
 
+        if isinstance(flat_table, ArrayFlatTable):
+            self._from_arrays(
+                flat_table, row_field, column_field, filter_field,
+                filter_value, columns, affected_columns)
+            return
+
         if len(flat_table.data) == 0:
             raise ValueError('No input data')
 
@@ -304,6 +550,81 @@ class PivotTable(object):
         except ZeroDivisionError:
             self.total_percent_affected = None
 
+    def _from_arrays(
+            self, flat_table, row_field, column_field, filter_field,
+            filter_value, columns, affected_columns):
+        """Make the pivot table from an ArrayFlatTable.
+
+        The result is the same as with a FlatTable, but sums are computed
+        on the arrays of the flat table.
+        """
+        if not flat_table.data_count():
+            raise ValueError('No input data')
+
+        row_values, column_values, sums, seen = flat_table.pivot(
+            row_field, column_field, filter_field, filter_value)
+
+        # Same rows and columns as with a FlatTable.
+        if row_field is None:
+            self.rows = ['']
+        else:
+            self.rows = list(flat_table.group_values(row_field))
+
+        if columns is not None:
+            self.columns = columns
+        elif column_field is None:
+            self.columns = ['']
+        else:
+            self.columns = list(flat_table.group_values(column_field))
+
+        self.affected_columns = affected_columns
+
+        row_positions = [self.rows.index(value) for value in row_values]
+        column_positions = []
+        for code, value in enumerate(column_values):
+            if value in self.columns:
+                column_positions.append(self.columns.index(value))
+            elif seen[:, code].any():
+                raise ValueError('%s is not in the columns' % value)
+            else:
+                column_positions.append(None)
+        kept = [
+            code for code, position in enumerate(column_positions)
+            if position is not None]
+
+        data = numpy.zeros((len(self.rows), len(self.columns)))
+        data[numpy.ix_(row_positions, [column_positions[i] for i in kept])] = (
+            sums[:, kept])
+
+        self.data = data.tolist()
+        self.total_rows = data.sum(axis=1).tolist()
+        self.total_columns = data.sum(axis=0).tolist()
+        self.total = float(data.sum())
+
+        self.total_rows_affected = [0.0] * len(self.rows)
+        if column_field is not None:
+            affected = [
+                code for code, value in enumerate(column_values)
+                if value in affected_columns]
+            affected_rows = sums[:, affected].sum(axis=1)
+            for code, position in enumerate(row_positions):
+                self.total_rows_affected[position] = float(
+                    affected_rows[code])
+        self.total_affected = float(sum(self.total_rows_affected))
+
+        self.total_percent_rows_affected = [0.0] * len(self.rows)
+        for row, value in enumerate(self.total_rows_affected):
+            try:
+                percent = value * 100 / self.total_rows[row]
+                self.total_percent_rows_affected[row] = percent
+            except ZeroDivisionError:
+                pass
+        try:
+            percent = self.total_affected * 100 / self.total
+            self.total_percent_affected = percent
+        except ZeroDivisionError:
+            self.total_percent_affected = None
+
     def __repr__(self):
         """ Dump object content in a readable format """
         pivot = '<PivotTable ' \
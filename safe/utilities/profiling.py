@@ -2,29 +2,119 @@
 
 """This module contains logic for performance profiling.
 
-This code was taken from http://stackoverflow.com/a/3620972
+The first version was taken from http://stackoverflow.com/a/3620972
 
+A Profiler holds the tree of the profiled functions of one analysis. It must
+be activated in the thread running the analysis, the @profile decorator adds
+a node to the tree of the active profiler. Without active profiler, the
+decorated function is called directly.
+
+Steps of the analysis can be added to the tree too, profiled functions called
+during a step are children of the step.
 """
 
-import time
-import inspect
+import os
+import sys
+import threading
 from functools import wraps
+from timeit import default_timer as perf_counter
+
+from qgis.core import QgsVectorLayer, QgsFeatureRequest
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows.
+    resource = None
 
 __copyright__ = "Vadim Shender (original poster in stack overflow), InaSAFE"
 __license__ = "Creative Commons"
 __email__ = "info@inasafe.org"
 __revision__ = '$Format:%H$'
 
+# The active profiler of each thread.
+_context = threading.local()
+
+
+def peak_memory():
+    """Get the peak resident memory of the process.
+
+    :return: The peak memory in MB or None if it's not available.
+    :rtype: float
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # Bytes on Mac OS, kilobytes on Linux.
+        peak /= 1024.0
+    return round(peak / 1024.0, 1)
+
+
+def current_memory():
+    """Get the current resident memory of the process.
+
+    :return: The memory in MB or None if it's not available.
+    :rtype: float
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+    except (IOError, OSError, IndexError, ValueError):
+        # Not available outside Linux.
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') / 1024.0 ** 2
+
+
+def feature_count(*values):
+    """Count features of vector layers in the values.
+
+    :param values: Arguments or result of a function.
+    :type values: list
+
+    :return: The number of features or None if there is no vector layer.
+    :rtype: int
+    """
+    count = None
+    for value in values:
+        if isinstance(value, QgsVectorLayer):
+            count = (count or 0) + value.featureCount()
+    return count
+
+
+def vertex_count(layer):
+    """Count vertices of a vector layer.
+
+    :param layer: The layer.
+    :type layer: QgsVectorLayer
+
+    :return: The number of vertices or None if it's not a vector layer.
+    :rtype: int
+    """
+    if not isinstance(layer, QgsVectorLayer):
+        return None
+    request = QgsFeatureRequest().setSubsetOfAttributes([])
+    count = 0
+    for feature in layer.getFeatures(request):
+        geometry = feature.geometry()
+        if geometry and geometry.geometry():
+            count += geometry.geometry().nCoordinates()
+    return count
+
 
 class Tree(object):
-    def __init__(self, key):
+    def __init__(self, key, parent=None, title=None):
 
         # Name of the current function
         self.key = key
-        self.parent = None
+        self.parent = parent
+
+        # Title of the step, if the node is not a function.
+        self.title = title
 
-        # Time of creation
-        self._start_time = time.time()
+        # Time and memory at creation
+        self._start_time = perf_counter()
+        self._start_memory = current_memory()
 
         # Time at the end.
         self._end_time = None
@@ -32,9 +122,25 @@ class Tree(object):
         # Children
         self.children = []
 
+        # Features of vector layers given to and returned by the function.
+        self.features_in = None
+        self.features_out = None
+
+        # Vertices of the vector layer produced by a step.
+        self.vertices_out = None
+
+        # Memory of the process in MB: the difference between the start and
+        # the end of the function, and the peak memory at the end.
+        self.memory_delta = None
+        self.peak_memory = None
+
     def ended(self):
         """We call this method when the function is finished."""
-        self._end_time = time.time()
+        self._end_time = perf_counter()
+        memory = current_memory()
+        if memory is not None and self._start_memory is not None:
+            self.memory_delta = round(memory - self._start_memory, 1)
+        self.peak_memory = peak_memory()
 
     @property
     def elapsed_time(self):
@@ -42,7 +148,7 @@ class Tree(object):
 
         This property might return None if the function is still running.
         """
-        if self._end_time:
+        if self._end_time is not None:
             elapsed_time = round(self._end_time - self._start_time, 3)
             return elapsed_time
         else:
@@ -50,15 +156,56 @@ class Tree(object):
 
     def append(self, node):
         """To append a new child."""
-        if node.parent == self.key and not self.elapsed_time:
-            self.children.append(node)
+        node.parent = self
+        self.children.append(node)
+
+    def rows(self, depth=0):
+        """Flatten the tree, depth first.
+
+        :param depth: The depth of this node in the tree.
+        :type depth: int
+
+        :return: Generator of tuples (label, node). The label is indented
+            with the depth of the node.
+        :rtype: generator
+        """
+        # This is a kind of hack to display the tree with indentation
+        label = '|'
+        label += '*' * depth
+
+        if self.children:
+            label += '\\ '
         else:
-            # Recursive call
-            for child in self.children:
-                if not child.elapsed_time:
-                    child.append(node)
+            label += '| '
+        label += self.__str__()
+
+        yield label, self
+        for child in self.children:
+            for row in child.rows(depth + 1):
+                yield row
+
+    def to_dict(self):
+        """Export the tree as a dictionary, for JSON.
+
+        :return: The node and its children.
+        :rtype: dict
+        """
+        return {
+            'name': self.__str__(),
+            'function': None if self.title else self.key,
+            'time': self.elapsed_time,
+            'features_in': self.features_in,
+            'features_out': self.features_out,
+            'vertices_out': self.vertices_out,
+            'memory_delta': self.memory_delta,
+            'peak_memory': self.peak_memory,
+            'children': [child.to_dict() for child in self.children]
+        }
 
     def __str__(self):
+        if self.title:
+            return self.title
+
         # It might be a private function.
         step = self.key.lstrip('_')
 
@@ -70,40 +217,164 @@ class Tree(object):
 
         return step
 
-ROOT = None
 
+class Profiler(object):
 
-def profile(fn):
-    @wraps(fn)
-    def with_profiling(*args, **kwargs):
-        global ROOT
+    """Profiling tree of one analysis.
 
-        current_frame = inspect.currentframe()
-        parent_frame = inspect.getouterframes(current_frame)[1]
-        parent_name = parent_frame[3]
+    The profiler is used as a context manager in the thread running the
+    analysis::
 
-        current_step = Tree(fn.__name__)
+        profiler = Profiler()
+        with profiler:
+            function_decorated_with_profile()
+        tree = profiler.root
+    """
 
-        if ROOT:
-            current_step.parent = parent_name
-            ROOT.append(current_step)
-        else:
-            ROOT = current_step
+    def __init__(self, count_vertices=False):
+        """Constructor.
+
+        :param count_vertices: If we count vertices of the output of each
+            step. It reads all the geometries again, so it's slow.
+        :type count_vertices: bool
+        """
+        # The first profiled function called.
+        self.root = None
+        self.count_vertices = count_vertices
+
+        # Functions being executed, the last one is the current one.
+        self._stack = []
+
+        # Profiler active in the thread before this one.
+        self._previous = []
+
+        # The current step of the analysis.
+        self._step = None
+
+    def clear(self):
+        """Remove the profiling data."""
+        self.root = None
+        self._stack = []
+        self._step = None
+
+    def __enter__(self):
+        self._previous.append(getattr(_context, 'profiler', None))
+        _context.profiler = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _context.profiler = self._previous.pop()
+
+    def start(self, key, title=None):
+        """Add a node for a function which is starting.
+
+        :param key: The name of the function.
+        :type key: basestring
+
+        :param title: The title if the node is a step, not a function.
+        :type title: basestring
+
+        :return: The new node.
+        :rtype: Tree
+        """
+        node = Tree(key, title=title)
+        if self._stack:
+            self._stack[-1].append(node)
+        elif self.root is None:
+            self.root = node
+        self._stack.append(node)
+        return node
+
+    def end(self, node):
+        """End the node of a function which is finished.
+
+        :param node: The node returned by start.
+        :type node: Tree
+        """
+        node.ended()
+        # A step or a function which raised an exception might still be in
+        # the stack on top of the node.
+        while self._stack:
+            last = self._stack.pop()
+            if last is node:
+                break
+            last.ended()
+
+    def start_step(self, context, process, layer=None):
+        """Start a new step of the analysis, the previous one is ended.
+
+        A step lasts until the next step in the same function or the end of
+        the function.
+
+        :param context: The context of the step, such as 'hazard'.
+        :type context: basestring
+
+        :param process: The text describing the step.
+        :type process: basestring
+
+        :param layer: The input layer of the step, if any.
+        :type layer: QgsMapLayer
+        """
+        if self._step is not None and self._step in self._stack:
+            self.end(self._step)
+        self._step = self.start(context, title=process)
+        self._step.features_in = feature_count(layer)
+
+    def step_output(self, layer):
+        """Record the output layer of the current step.
 
-        ret = fn(*args, **kwargs)
+        :param layer: The output layer.
+        :type layer: QgsMapLayer
+        """
+        if self._step is None or self._step not in self._stack:
+            return
+        self._step.features_out = feature_count(layer)
+        if self.count_vertices:
+            self._step.vertices_out = vertex_count(layer)
+
+
+def active_profiler():
+    """Get the active profiler in the current thread.
+
+    :return: The profiler or None.
+    :rtype: Profiler
+    """
+    return getattr(_context, 'profiler', None)
 
-        current_step.ended()
+
+def profile(fn):
+    @wraps(fn)
+    def with_profiling(*args, **kwargs):
+        profiler = getattr(_context, 'profiler', None)
+        if profiler is None:
+            return fn(*args, **kwargs)
+
+        current_step = profiler.start(fn.__name__)
+        current_step.features_in = feature_count(
+            *(args + tuple(kwargs.values())))
+        try:
+            ret = fn(*args, **kwargs)
+            if isinstance(ret, tuple):
+                current_step.features_out = feature_count(*ret)
+            else:
+                current_step.features_out = feature_count(ret)
+        finally:
+            profiler.end(current_step)
         return ret
 
     return with_profiling
 
 
 def profiling_log():
-    """Get the profiling logs."""
-    global ROOT
-    return ROOT
+    """Get the profiling logs of the active profiler."""
+    profiler = active_profiler()
+    if profiler is None:
+        return None
+    return profiler.root
 
 
 def clear_prof_data():
-    global ROOT
-    ROOT = None
+    """Clear the profiling logs of the active profiler."""
+    profiler = active_profiler()
+    if profiler is not None:
+        profiler.clear()
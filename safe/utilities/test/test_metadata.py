@@ -2,6 +2,7 @@
 """Test Metadata Utilities."""
 import unittest
 from datetime import datetime
+from os.path import splitext
 # Do not remove this, needed for QUrl
 from qgis.utils import iface  # pylint: disable=W0621
 from PyQt4.QtCore import QUrl
@@ -13,7 +14,8 @@ from safe.utilities.metadata import (
     read_iso19115_metadata,
     active_classification,
     active_thresholds_value_maps,
-    copy_layer_keywords
+    copy_layer_keywords,
+    _keywords_cache,
 )
 
 __copyright__ = "Copyright 2016, The InaSAFE Project"
@@ -105,6 +107,39 @@ class TestMetadataUtilities(unittest.TestCase):
         read_metadata = read_iso19115_metadata(layer.source())
         self.assertDictEqual(keywords, read_metadata)
 
+    def test_keywords_cache(self):
+        """Test keywords read from a XML file are cached."""
+        keywords = {
+            'exposure': 'structure',
+            'keyword_version': inasafe_keyword_version,
+            'layer_geometry': 'polygon',
+            'layer_mode': 'classified',
+            'layer_purpose': 'exposure',
+            'title': 'Buildings',
+        }
+        layer = clone_shp_layer(
+            name='buildings',
+            include_keywords=False,
+            source_directory=standard_data_path('exposure'))
+        xml_uri = splitext(layer.source())[0] + '.xml'
+        write_iso19115_metadata(layer.source(), keywords)
+        self.assertNotIn(xml_uri, _keywords_cache)
+
+        read_metadata = read_iso19115_metadata(layer.source())
+        self.assertIn(xml_uri, _keywords_cache)
+        self.assertEqual(
+            read_iso19115_metadata(layer.source(), 'title'), 'Buildings')
+
+        # The cache is not modified by the caller.
+        read_metadata['title'] = 'Modified'
+        self.assertDictEqual(keywords, read_iso19115_metadata(layer.source()))
+
+        # Writing keywords invalidates the cache.
+        keywords['title'] = 'New buildings'
+        write_iso19115_metadata(layer.source(), keywords)
+        self.assertEqual(
+            read_iso19115_metadata(layer.source(), 'title'), 'New buildings')
+
     def test_active_classification_thresholds_value_maps(self):
         """Test for active_classification and thresholds value maps method."""
         keywords = {
@@ -3,12 +3,14 @@
 import unittest
 import json
 
-from safe.utilities.pivot_table import FlatTable, PivotTable
+from safe.utilities.pivot_table import FlatTable, ArrayFlatTable, PivotTable
 
 
 class PivotTableTest(unittest.TestCase):
     """Tests for reading and writing of raster and vector data."""
 
+    flat_table_class = FlatTable
+
     def setUp(self):
         """
         This will generate a table like this:
@@ -24,7 +26,7 @@ class PivotTableTest(unittest.TestCase):
         Total         |   10      50     90   |   150         60          40
         """
         self.affected_columns = ['medium', 'high']
-        self.flat_table = FlatTable("road_type", "hazard")
+        self.flat_table = self.flat_table_class("road_type", "hazard")
         self.flat_table.add_value(10, road_type="primary", hazard="high")
         self.flat_table.add_value(20, road_type="primary", hazard="medium")
         self.flat_table.add_value(30, road_type="residential", hazard="medium")
@@ -136,7 +138,7 @@ class PivotTableTest(unittest.TestCase):
             '["residential", "medium", 30], ["secondary", "low", 40], '
             '["primary", "high", 10], ["primary", "medium", 20]], '
             '"groups": ["road_type", "hazard"]}')
-        flat_table = FlatTable()
+        flat_table = self.flat_table_class()
         flat_table.from_json(json_string)
         expected_groups = ["road_type", "hazard"]
         for i in range(len(flat_table.groups)):
@@ -157,7 +159,7 @@ class PivotTableTest(unittest.TestCase):
             ["primary", "high", 10],
             ["primary", "medium", 20]
         ]
-        flat_table = FlatTable()
+        flat_table = self.flat_table_class()
         flat_table.from_dict(groups, data)
 
         for i in range(len(flat_table.groups)):
@@ -179,7 +181,7 @@ class PivotTableTest(unittest.TestCase):
             [u'Meadow', u'medium', None, 5173.5242434723095]
         ]
 
-        flat_table = FlatTable()
+        flat_table = self.flat_table_class()
         flat_table.from_dict(groups, data)
 
         for i in range(len(flat_table.groups)):
@@ -191,7 +193,7 @@ class PivotTableTest(unittest.TestCase):
     def test_to_from_json(self):
         """Test FlatTable from_dict method"""
         json_string = self.flat_table.to_json()
-        flat_table = FlatTable()
+        flat_table = self.flat_table_class()
         flat_table.from_json(json_string)
 
         self.assertEquals(flat_table.data[('residential', 'low')], 50)
@@ -201,6 +203,33 @@ class PivotTableTest(unittest.TestCase):
         self.assertEquals(flat_table.data[('primary', 'medium')], 20)
 
 
+class ArrayPivotTableTest(PivotTableTest):
+    """Same tests with the flat table stored in arrays."""
+
+    flat_table_class = ArrayFlatTable
+
+    def test_add_values(self):
+        """Test we can add many values at once."""
+        flat_table = ArrayFlatTable('road_type', 'hazard')
+        flat_table.add_values(
+            [10, 20, 5],
+            road_type=['primary', 'primary', 'primary'],
+            hazard=['high', 'medium', 'high'])
+        self.assertEqual(
+            flat_table.get_value(road_type='primary', hazard='high'), 15)
+        self.assertEqual(
+            flat_table.get_value(road_type='primary', hazard='low'), 0)
+
+        # get_value doesn't add a key.
+        self.assertEqual(len(flat_table.data), 2)
+
+        flat_table.add_value(2.5, road_type='secondary', hazard='low')
+        self.assertEqual(
+            flat_table.get_value(road_type='secondary', hazard='low'), 2.5)
+        self.assertEqual(flat_table.group_values('hazard'), {
+            'high', 'medium', 'low'})
+
+
 if __name__ == '__main__':
     suite = unittest.makeSuite(PivotTableTest, 'test')
     runner = unittest.TextTestRunner(verbosity=2)
@@ -0,0 +1,122 @@
+# coding=utf-8
+"""Test the profiler."""
+
+import threading
+import unittest
+
+from safe.utilities.profiling import Profiler, profile, profiling_log
+
+__copyright__ = "Copyright 2016, The InaSAFE Project"
+__license__ = "GPL version 3"
+__email__ = "info@inasafe.org"
+__revision__ = '$Format:%H$'
+
+
+@profile
+def _child():
+    return 1
+
+
+@profile
+def _parent():
+    return _child() + _child()
+
+
+@profile
+def _failing():
+    _child()
+    raise ValueError
+
+
+class TestProfiling(unittest.TestCase):
+
+    """Test the profiler."""
+
+    def test_profiler_tree(self):
+        """Test the tree of profiled functions."""
+        profiler = Profiler()
+        with profiler:
+            self.assertEqual(_parent(), 2)
+            self.assertIs(profiling_log(), profiler.root)
+
+        root = profiler.root
+        self.assertEqual(root.key, '_parent')
+        self.assertEqual(str(root), 'Parent')
+        self.assertEqual(
+            [child.key for child in root.children], ['_child', '_child'])
+        self.assertIs(root.children[0].parent, root)
+        self.assertIsNotNone(root.elapsed_time)
+        self.assertIsNone(root.features_in)
+
+        # Without active profiler, nothing is recorded.
+        self.assertIsNone(profiling_log())
+        _parent()
+        self.assertEqual(len(root.children), 2)
+
+    def test_profiler_exception(self):
+        """Test the tree is still valid if a function raises an exception."""
+        profiler = Profiler()
+        with profiler:
+            self.assertRaises(ValueError, _failing)
+            _child()
+
+        self.assertEqual(profiler.root.key, '_failing')
+        self.assertIsNotNone(profiler.root.elapsed_time)
+        self.assertEqual(len(profiler.root.children), 1)
+
+    def test_profiler_steps(self):
+        """Test steps are nodes of the tree."""
+        profiler = Profiler()
+
+        @profile
+        def _analysis():
+            profiler.start_step('hazard', 'First step')
+            _child()
+            profiler.start_step('hazard', 'Second step')
+            _child()
+            _child()
+
+        with profiler:
+            _analysis()
+            profiler.start_step('hazard', 'Outside')
+
+        root = profiler.root
+        self.assertEqual(
+            [str(step) for step in root.children],
+            ['First step', 'Second step'])
+        self.assertEqual(len(root.children[0].children), 1)
+        self.assertEqual(len(root.children[1].children), 2)
+        for step in root.children:
+            self.assertIsNotNone(step.elapsed_time)
+
+        labels = [label for label, _ in root.rows()]
+        self.assertEqual(labels[0], '|\\ Analysis')
+        self.assertEqual(labels[1], '|*\\ First step')
+        self.assertEqual(labels[2], '|**| Child')
+
+        self.assertEqual(
+            root.to_dict()['children'][1]['name'], 'Second step')
+
+    def test_profiler_threads(self):
+        """Test each thread uses its own profiler."""
+        profilers = [Profiler() for _ in range(4)]
+
+        def run(profiler):
+            with profiler:
+                _parent()
+
+        threads = [
+            threading.Thread(target=run, args=(profiler, ))
+            for profiler in profilers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for profiler in profilers:
+            self.assertEqual(profiler.root.key, '_parent')
+            self.assertEqual(len(profiler.root.children), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()